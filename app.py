@@ -2,11 +2,13 @@ import streamlit as st
 import os
 import sys
 import shutil
+import hashlib
 import utils
 import traceback
 from datetime import datetime
 import io
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 # ===============================
 # ✅ 0️⃣ 获取 base_dir（兼容 .py & PyInstaller）
@@ -16,9 +18,7 @@ if getattr(sys, "frozen", False):
 else:
     base_dir = os.path.dirname(os.path.abspath(__file__))
 
-# ===============================
-# ✅ 小工具：打包目录为 zip bytes
-# ===============================
+
 def zip_dir_to_bytes(dir_path: str) -> bytes:
     """
     把整个目录打包成 zip，并返回 bytes（用于 st.download_button）
@@ -34,6 +34,142 @@ def zip_dir_to_bytes(dir_path: str) -> bytes:
     buf.seek(0)
     return buf.read()
 
+
+# ===============================
+# ✅ 运行方式
+# ===============================
+# - disk：上传文件保存到 {year}_{quarter} 季度目录，中间结果写入 {quarter}_intermediate
+#         （检查点 / 明细缓存（季度环比）/ 统计计数（多季度汇总）/ 历史库，与 gui_single_quater.py 相同）
+#         每次都真正写盘；相同输入靠检查点续跑，不使用下面的结果缓存
+# - memory：纯内存运行，不写任何文件（适合临时查看）
+RUN_MODES = {
+    "保存到季度目录（检查点 / 环比缓存 / 历史库）": "disk",
+    "纯内存（不写磁盘）": "memory",
+}
+
+# ===============================
+# ✅ 结果缓存（配置：rules_config.json → app_cache）
+# ===============================
+# 缓存键 = 上传文件内容哈希 + 年份 + 季度 + 规则 / 模板哈希 + 代码版本 + 运行方式，
+# 任何一项变化都会重新计算；max_entries / ttl_seconds 限制内存占用。
+_cache_cfg = utils.load_rules_config().get("app_cache", {})
+CACHE_MAX_ENTRIES = _cache_cfg.get("max_entries", 8)
+CACHE_TTL_SECONDS = _cache_cfg.get("ttl_seconds", 3600)
+
+
+def upload_digests(uploaded_files) -> tuple:
+    """
+    上传文件 → ((文件名, 内容 sha1), ...)，与上传顺序无关
+    每次上传的 file_id 唯一：按 file_id 记住哈希，页面 rerun 时不再重复计算
+    """
+    memo = st.session_state.setdefault("upload_digest_memo", {})
+    digests = []
+    for uf in uploaded_files:
+        file_id = getattr(uf, "file_id", None)
+        digest = memo.get(file_id) if file_id is not None else None
+        if digest is None:
+            digest = hashlib.sha1(uf.getvalue()).hexdigest()
+            if file_id is not None:
+                memo[file_id] = digest
+        digests.append((uf.name, digest))
+    return tuple(sorted(digests))
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def cached_pipelines(digests, year, quarter, rules_hash, template_hash, code_version, mode, _inputs):
+    """四大流水线（纯内存）。下划线开头的 _inputs 不参与缓存键，内容已由 digests 代表"""
+    out = utils.run_all_in_memory(_inputs, year, quarter)
+    return {
+        "results": out["results"],
+        "stats_dict": out["stats_dict"],
+        "pipeline_results": out["pipeline_results"],
+    }
+
+
+def sync_uploads_to_folder(inputs, quarter_folder: str, clear: bool):
+    """
+    上传文件写入季度目录：
+    - clear=True → 目录中不属于本次上传的文件全部删除（等同于先清空再保存）
+    - 内容相同的同名文件不重写：保留修改时间，检查点指纹不变，对应来源可以直接续跑
+    """
+    os.makedirs(quarter_folder, exist_ok=True)
+    names = {item.name for item in inputs}
+
+    if clear:
+        for name in os.listdir(quarter_folder):
+            if name in names:
+                continue
+            path = os.path.join(quarter_folder, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    for item in inputs:
+        path = os.path.join(quarter_folder, item.name)
+        if os.path.isfile(path) and os.path.getsize(path) == len(item.data):
+            with open(path, "rb") as f:
+                if f.read() == item.data:
+                    continue
+        with open(path, "wb") as f:
+            f.write(item.data)
+
+
+def run_pipelines_on_disk(inputs, year, quarter, quarter_folder, intermediate_dir,
+                          clear_quarter_folder, clear_intermediate_folder):
+    """
+    四大流水线（写磁盘）：保存上传文件 → run_all_pipelines_and_save_intermediate(resume=True)
+    不走 st.cache_data：目录清理 / 保存上传 每次都执行，磁盘上的中间结果始终对应本次输入；
+    复用由检查点负责（输入文件 / 规则 / 模板 / 代码版本都一致的来源直接恢复）
+    """
+    sync_uploads_to_folder(inputs, quarter_folder, clear_quarter_folder)
+
+    if clear_intermediate_folder and os.path.isdir(intermediate_dir):
+        shutil.rmtree(intermediate_dir)
+    os.makedirs(intermediate_dir, exist_ok=True)
+
+    results, stats_dict = utils.run_all_pipelines_and_save_intermediate(
+        quarter_folder=quarter_folder,
+        year=year,
+        quarter=quarter,
+        save_dir=intermediate_dir,
+        resume=True
+    )
+    return {
+        "results": results,
+        "stats_dict": stats_dict,
+        "intermediate_dir": intermediate_dir,
+    }
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def cached_preview(digests, year, quarter, rules_hash, template_hash, code_version, sample_rows, _inputs):
+    """抽样预览（每个来源只读前 sample_rows 行，统计数字为投影值）"""
+    return utils.preview_inputs(_inputs, year, quarter, sample_rows=sample_rows)
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def cached_final_excel(digests, year, quarter, rules_hash, template_hash, code_version, mode, _run):
+    """最终自存模板 bytes"""
+    buf = io.BytesIO()
+    utils.align_and_export_to_self_template_by_json(
+        template_json_path=utils.load_template_columns(),
+        output_excel_path=buf,
+        df_nmpa=_run["results"].get("NMPA"),
+        df_fda=_run["results"].get("FDA"),
+        df_ind=_run["results"].get("IND"),
+        df_nda=_run["results"].get("NDA"),
+        stats_dict=_run["stats_dict"]
+    )
+    return buf.getvalue()
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def cached_results_zip(digests, year, quarter, rules_hash, template_hash, code_version, mode, _run):
+    """各来源结果文件 + 统计计数 打包的 zip bytes（纯内存运行）"""
+    return utils.export_results_zip(_run["pipeline_results"], year, quarter)
+
+
 # ===============================
 # ✅ 1️⃣ Streamlit 页面设置
 # ===============================
@@ -52,15 +188,27 @@ year = st.sidebar.text_input("请输入年份（如 2025）", value="2025").stri
 quarter = st.sidebar.selectbox("请选择季度", ["Q1", "Q2", "Q3", "Q4"])
 operator = st.sidebar.text_input("处理人姓名（如 Kate）", value="Kate").strip()
 
-st.sidebar.markdown("---")
-clear_quarter_folder = st.sidebar.checkbox(
-    "上传前清空该季度原始数据目录（推荐）",
-    value=True,
-)
-clear_intermediate_folder = st.sidebar.checkbox(
-    "运行前清空中间结果目录（推荐）",
-    value=True,
+sample_rows = st.sidebar.number_input(
+    "抽样预览行数（每个来源）",
+    min_value=100,
+    value=int(utils.load_rules_config().get("preview", {}).get("sample_rows", 5000)),
+    step=1000,
 )
+
+st.sidebar.markdown("---")
+run_mode = RUN_MODES[st.sidebar.radio("运行方式", list(RUN_MODES), index=0)]
+
+clear_quarter_folder = False
+clear_intermediate_folder = False
+if run_mode == "disk":
+    clear_quarter_folder = st.sidebar.checkbox(
+        "上传前清空该季度原始数据目录（推荐）",
+        value=True,
+    )
+    clear_intermediate_folder = st.sidebar.checkbox(
+        "运行前清空中间结果目录（推荐）",
+        value=True,
+    )
 use_timestamp_output = st.sidebar.checkbox(
     "输出文件名增加时间戳（推荐）",
     value=True,
@@ -92,11 +240,46 @@ uploaded_files = st.file_uploader(
     accept_multiple_files=True
 )
 
+# ===============================
+# ✅ 4️⃣-1 上传后立即后台解析（点击运行时直接复用解析结果）
+# ===============================
+if "preload_executor" not in st.session_state:
+    st.session_state.preload_executor = ThreadPoolExecutor(max_workers=1)
+if "preload_sig" not in st.session_state:
+    st.session_state.preload_sig = None
+if "preload_future" not in st.session_state:
+    st.session_state.preload_future = None
+
+if uploaded_files:
+    # ✅ 按内容哈希判断（与结果缓存键相同）：同名同大小但内容不同的重新上传也会重新解析
+    upload_sig = upload_digests(uploaded_files)
+
+    # ✅ 文件有变化才重新提交后台解析（后台线程中串行读取，不在 Streamlit 进程的线程里起进程池）
+    if st.session_state.preload_sig != upload_sig:
+        inputs = [utils.as_excel_input(uf) for uf in uploaded_files]
+        st.session_state.preload_sig = upload_sig
+        st.session_state.preload_future = st.session_state.preload_executor.submit(
+            utils.preload_inputs, inputs, max_workers=1
+        )
+
+    future = st.session_state.preload_future
+    if not future.done():
+        st.info("⏳ 正在后台解析上传的文件，可以先检查左侧参数...")
+    elif future.exception() is not None:
+        st.warning(f"⚠️ 后台预解析未完成（运行时会重新解析并给出详细错误）：{future.exception()}")
+    else:
+        loaded = future.result()
+        st.success("⚡ 已在后台解析完成：" + "，".join(f"{k} {v} 行" for k, v in loaded.items()))
+
 # ===============================
 # ✅ 5️⃣ session_state 初始化（关键：防 rerun 丢结果）
 # ===============================
 if "done" not in st.session_state:
     st.session_state.done = False
+if "run" not in st.session_state:
+    st.session_state.run = None
+if "cache_key" not in st.session_state:
+    st.session_state.cache_key = None
 if "final_excel_bytes" not in st.session_state:
     st.session_state.final_excel_bytes = None
 if "final_excel_name" not in st.session_state:
@@ -107,13 +290,38 @@ if "intermediate_zip_name" not in st.session_state:
     st.session_state.intermediate_zip_name = None
 if "final_output_path" not in st.session_state:
     st.session_state.final_output_path = None
+if "preview" not in st.session_state:
+    st.session_state.preview = None
 if "intermediate_dir" not in st.session_state:
     st.session_state.intermediate_dir = None
 
 # ===============================
-# ✅ 6️⃣ 执行按钮
+# ✅ 6️⃣ 执行按钮（只跑流水线 + 统计；Excel / ZIP 在下载区按需生成）
 # ===============================
-run_clicked = st.button("🚀 开始自动化处理", type="primary")
+col_run, col_preview = st.columns(2)
+with col_run:
+    run_clicked = st.button("🚀 开始自动化处理", type="primary")
+with col_preview:
+    preview_clicked = st.button("🔎 抽样预览（先检查列映射 / 分类规则）")
+
+if preview_clicked:
+    if not uploaded_files:
+        st.warning("⚠️ 请先上传文件！")
+        st.stop()
+
+    try:
+        with st.spinner(f"正在抽样预览（每个来源前 {int(sample_rows)} 行）..."):
+            rules_hash, template_hash = utils.config_hashes()
+            inputs = [utils.as_excel_input(uf) for uf in uploaded_files]
+            st.session_state.preview = cached_preview(
+                upload_digests(uploaded_files), int(year), quarter,
+                rules_hash, template_hash, utils.code_version(), int(sample_rows),
+                _inputs=inputs
+            )
+    except Exception as e:
+        st.session_state.preview = None
+        st.error(f"❌ 抽样预览失败：{e}")
+        st.code(traceback.format_exc())
 
 if run_clicked:
     if not uploaded_files:
@@ -129,80 +337,62 @@ if run_clicked:
 
     intermediate_zip_name = f"{year}_{quarter}_{operator}_{ts}_intermediate.zip" if use_timestamp_output else f"{year}_{quarter}_{operator}_intermediate.zip"
 
-    with st.expander("📌 路径信息（点击展开）", expanded=True):
-        st.write("📁 季度数据目录：", quarter_folder)
-        st.write("📁 中间结果目录：", intermediate_dir)
-        st.write("📄 最终输出文件：", final_output_path)
-        st.write("📄 JSON 模板路径：", template_json_path)
+    if run_mode == "disk":
+        with st.expander("📌 路径信息（点击展开）", expanded=True):
+            st.write("📁 季度数据目录：", quarter_folder)
+            st.write("📁 中间结果目录：", intermediate_dir)
+            st.write("📄 最终输出文件：", final_output_path)
+            st.write("📄 JSON 模板路径：", template_json_path)
 
     progress_bar = st.progress(0)
     status_text = st.empty()
 
     try:
-        # A. 准备目录
-        status_text.text("正在准备目录...")
-        if clear_quarter_folder and os.path.isdir(quarter_folder):
-            shutil.rmtree(quarter_folder)
-        os.makedirs(quarter_folder, exist_ok=True)
-
-        if clear_intermediate_folder and os.path.isdir(intermediate_dir):
-            shutil.rmtree(intermediate_dir)
-        os.makedirs(intermediate_dir, exist_ok=True)
-
-        progress_bar.progress(5)
-
-        # B. 保存上传文件
-        status_text.text("正在保存上传文件到季度目录...")
-        n = len(uploaded_files)
-        for i, uf in enumerate(uploaded_files, start=1):
-            file_path = os.path.join(quarter_folder, uf.name)
-            with open(file_path, "wb") as f:
-                f.write(uf.getbuffer())
-            progress_bar.progress(5 + int(30 * i / max(1, n)))
-
-        # C. 跑流水线
-        status_text.text("正在运行监管流水线（生成中间文件）...")
-        progress_bar.progress(40)
-        results, stats_dict = utils.run_all_pipelines_and_save_intermediate(
-            quarter_folder=quarter_folder,
-            year=int(year),
-            quarter=quarter,
-            save_dir=intermediate_dir
-        )
-        progress_bar.progress(75)
-
-        # D. 生成最终表
-        status_text.text("正在生成最终汇总表（自存模板）...")
-        utils.align_and_export_to_self_template_by_json(
-            template_json_path=template_json_path,
-            output_excel_path=final_output_path,
-            df_nmpa=results.get("NMPA"),
-            df_fda=results.get("FDA"),
-            df_ind=results.get("IND"),
-            df_nda=results.get("NDA"),
-            stats_dict=stats_dict
+        # A. 缓存键：上传内容 + 参数 + 规则 / 模板 + 代码版本
+        status_text.text("正在计算文件指纹...")
+        rules_hash, template_hash = utils.config_hashes()
+        cache_key = (
+            upload_digests(uploaded_files), int(year), quarter,
+            rules_hash, template_hash, utils.code_version(), run_mode
         )
-        progress_bar.progress(90)
-        status_text.text("正在打包中间结果目录...")
-
-        # E. 读取最终文件 bytes
-        with open(final_output_path, "rb") as f:
-            final_excel_bytes = f.read()
-
-        # F. 打包中间目录为 zip bytes
-        intermediate_zip_bytes = zip_dir_to_bytes(intermediate_dir)
+        progress_bar.progress(10)
+
+        # B. 等待后台预解析结束（解析失败不影响：流水线会重新读取并报错）
+        future = st.session_state.preload_future
+        if future is not None and not future.done():
+            status_text.text("正在等待后台解析完成...")
+            try:
+                future.result()
+            except Exception:
+                pass
+
+        # C. 跑流水线（相同输入 + 参数直接命中缓存）
+        status_text.text("正在运行监管流水线...")
+        progress_bar.progress(40)
+        inputs = [utils.as_excel_input(uf) for uf in uploaded_files]
+        if run_mode == "disk":
+            run = run_pipelines_on_disk(
+                inputs, int(year), quarter, quarter_folder, intermediate_dir,
+                clear_quarter_folder, clear_intermediate_folder
+            )
+        else:
+            run = cached_pipelines(*cache_key, _inputs=inputs)
 
         progress_bar.progress(100)
         status_text.text("处理完成！")
 
         # ✅ 关键：写入 session_state（防止点击下载后 rerun 丢结果）
+        #    新结果 → 清掉上一次生成的文件
         st.session_state.done = True
-        st.session_state.final_excel_bytes = final_excel_bytes
+        st.session_state.run = run
+        st.session_state.cache_key = cache_key
+        st.session_state.final_excel_bytes = None
         st.session_state.final_excel_name = final_filename
-        st.session_state.intermediate_zip_bytes = intermediate_zip_bytes
+        st.session_state.intermediate_zip_bytes = None
         st.session_state.intermediate_zip_name = intermediate_zip_name
         st.session_state.final_output_path = final_output_path
-        st.session_state.intermediate_dir = intermediate_dir
+        st.session_state.intermediate_dir = run.get("intermediate_dir")
+        st.session_state.preview = None
 
         st.success(f"✅ 处理成功！共处理 {len(uploaded_files)} 个文件。")
 
@@ -212,7 +402,66 @@ if run_clicked:
         st.code(traceback.format_exc())
 
 # ===============================
-# ✅ 7️⃣ 结果区：无论 rerun 都稳定显示两个下载按钮
+# ✅ 6️⃣-1 抽样预览结果（投影计数 / 未匹配分类 / 列覆盖率）
+# ===============================
+if st.session_state.preview is not None:
+    st.markdown("---")
+    st.subheader("🔎 抽样预览")
+    st.caption("统计数字 = 样本计数 × 总行数 / 样本行数，仅为估计；样本取自每个 Sheet 的前若干行。")
+
+    previews = st.session_state.preview["previews"]
+    stats_dict = st.session_state.preview["stats_dict"]
+    tabs = st.tabs(list(previews))
+
+    for tab, (source, p) in zip(tabs, previews.items()):
+        with tab:
+            total = "未知" if p["total_rows"] is None else p["total_rows"]
+            st.caption(
+                f"样本 {p['sampled_rows']} 行 / 总计 {total} 行（×{p['factor']:.1f}），"
+                f"用时 {p['seconds']} 秒；筛选去重后样本明细 {len(p['df'])} 行"
+            )
+
+            if p["unmatched"].empty:
+                st.success("✅ 样本中所有分类组合都能匹配")
+            else:
+                st.warning(f"⚠️ {len(p['unmatched'])} 个分类组合未匹配（将归为 Others）")
+                st.dataframe(p["unmatched"], hide_index=True, use_container_width=True)
+
+            missing = p["coverage"].loc[~p["coverage"]["是否存在"], "列"].tolist()
+            if missing:
+                st.warning(f"⚠️ 缺失 {len(missing)} 列：{'、'.join(missing)}")
+            with st.expander("列覆盖率"):
+                st.dataframe(p["coverage"], hide_index=True, use_container_width=True)
+
+            for title, stat_df in stats_dict[utils.SOURCE_TEMPLATE_SHEETS[source]].items():
+                if stat_df is None or stat_df.empty:
+                    continue
+                st.markdown(f"**{title}（投影）**")
+                st.dataframe(stat_df, hide_index=True, use_container_width=True)
+
+# ===============================
+# ✅ 7️⃣ 统计结果：流水线结束立即展示
+# ===============================
+if st.session_state.done:
+    st.markdown("---")
+    st.subheader("📊 统计结果")
+
+    stats_dict = st.session_state.run["stats_dict"]
+    sheet_sources = {v: k for k, v in utils.SOURCE_TEMPLATE_SHEETS.items()}
+    tabs = st.tabs(list(stats_dict))
+
+    for tab, (sheet_name, stat_pack) in zip(tabs, stats_dict.items()):
+        with tab:
+            df_source = st.session_state.run["results"][sheet_sources[sheet_name]]
+            st.caption(f"明细行数：{len(df_source)}")
+            for title, stat_df in stat_pack.items():
+                if stat_df is None or stat_df.empty:
+                    continue
+                st.markdown(f"**{title}**")
+                st.dataframe(stat_df, hide_index=True, use_container_width=True)
+
+# ===============================
+# ✅ 8️⃣ 下载区：Excel / ZIP 只在需要时生成（生成后 rerun 也不会丢）
 # ===============================
 if st.session_state.done:
     st.markdown("---")
@@ -221,24 +470,49 @@ if st.session_state.done:
     col1, col2 = st.columns(2)
 
     with col1:
-        st.download_button(
-            label=f"📥 下载最终 Excel：{st.session_state.final_excel_name}",
-            data=st.session_state.final_excel_bytes,
-            file_name=st.session_state.final_excel_name,
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            key="download_final_excel"
-        )
+        if st.session_state.final_excel_bytes is None:
+            if st.button("🧾 生成最终 Excel", key="build_final_excel"):
+                with st.spinner("正在生成最终汇总表（自存模板）..."):
+                    final_excel_bytes = cached_final_excel(
+                        *st.session_state.cache_key, _run=st.session_state.run
+                    )
+                    with open(st.session_state.final_output_path, "wb") as f:
+                        f.write(final_excel_bytes)
+                st.session_state.final_excel_bytes = final_excel_bytes
+                st.rerun()
+        else:
+            st.download_button(
+                label=f"📥 下载最终 Excel：{st.session_state.final_excel_name}",
+                data=st.session_state.final_excel_bytes,
+                file_name=st.session_state.final_excel_name,
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="download_final_excel"
+            )
 
     with col2:
-        st.download_button(
-            label=f"📥 下载中间结果（ZIP）：{st.session_state.intermediate_zip_name}",
-            data=st.session_state.intermediate_zip_bytes,
-            file_name=st.session_state.intermediate_zip_name,
-            mime="application/zip",
-            key="download_intermediate_zip"
-        )
-
-    st.caption("✅ 本地也已保存：")
-    st.code(st.session_state.final_output_path)
-    st.caption("✅ 中间结果目录：")
-    st.code(st.session_state.intermediate_dir)
\ No newline at end of file
+        if st.session_state.intermediate_zip_bytes is None:
+            if st.button("🗜️ 生成中间结果 ZIP", key="build_intermediate_zip"):
+                with st.spinner("正在打包中间结果..."):
+                    if st.session_state.intermediate_dir is not None:
+                        # 写磁盘运行：直接打包中间结果目录（含检查点 / 明细缓存 / 统计计数）
+                        st.session_state.intermediate_zip_bytes = zip_dir_to_bytes(st.session_state.intermediate_dir)
+                    else:
+                        st.session_state.intermediate_zip_bytes = cached_results_zip(
+                            *st.session_state.cache_key, _run=st.session_state.run
+                        )
+                st.rerun()
+        else:
+            st.download_button(
+                label=f"📥 下载中间结果（ZIP）：{st.session_state.intermediate_zip_name}",
+                data=st.session_state.intermediate_zip_bytes,
+                file_name=st.session_state.intermediate_zip_name,
+                mime="application/zip",
+                key="download_intermediate_zip"
+            )
+
+    if st.session_state.final_excel_bytes is not None:
+        st.caption("✅ 本地也已保存：")
+        st.code(st.session_state.final_output_path)
+    if st.session_state.intermediate_dir is not None:
+        st.caption("✅ 中间结果目录：")
+        st.code(st.session_state.intermediate_dir)
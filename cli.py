@@ -0,0 +1,314 @@
+import utils
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from contextlib import redirect_stdout
+from datetime import datetime
+
+# ===============================
+# ✅ 0️⃣ 获取 base_dir（兼容 .py & .exe）
+# ===============================
+if getattr(sys, "frozen", False):
+    base_dir = os.path.dirname(sys.executable)
+else:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# ===============================
+# ✅ 无交互命令行（适合 cron / 调度器）
+# ===============================
+# 例：python cli.py --year 2025 --quarter Q4 --operator Kate
+#     python cli.py --year 2025 --quarter Q4 --summary -      （摘要 JSON 打到 stdout，流水线日志改走 stderr）
+#     python cli.py --watch --operator Kate                   （常驻：监听所有 {year}_{quarter} 目录，见 watch）
+#
+# 退出码：
+EXIT_OK = 0          # 成功
+EXIT_ERROR = 1       # 运行中出错（详见摘要中的 error / traceback）
+EXIT_USAGE = 2       # 参数错误（argparse）
+EXIT_INPUT = 3       # 输入问题：季度目录不存在 / 监管文件识别失败（其余错误一律是 EXIT_ERROR）
+EXIT_NO_DATA = 4     # 没有匹配到任何来源的文件
+
+
+def intermediate_dir_for(quarter: str, year: int = None) -> str:
+    """
+    与 gui_single_quater.py 相同的目录结构：save_dir = {quarter}_intermediate，结果在其下的 {quarter}_intermediate
+    - 给定 year（--watch）：save_dir = {year}_{quarter}_intermediate，不同年份的同一季度互不覆盖
+    """
+    save_dir = f"{year}_{quarter}_intermediate" if year is not None else f"{quarter}_intermediate"
+    return os.path.join(base_dir, save_dir, f"{quarter}_intermediate")
+
+
+def resolve_intermediate_dir(args) -> str:
+    """watch 会显式指定按年份区分的目录；单次运行沿用 GUI 的目录（检查点可以互相续跑）"""
+    return getattr(args, "intermediate_dir", None) or intermediate_dir_for(args.quarter)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="监管数据处理：无交互运行 + JSON 运行摘要")
+    parser.add_argument("--year", type=int, help="年份，如 2025（--watch 时可省略：监听所有年份）")
+    parser.add_argument("--quarter", type=str.upper, choices=["Q1", "Q2", "Q3", "Q4"],
+                        help="季度（--watch 时可省略：监听所有季度）")
+    parser.add_argument("--operator", default="", help="处理人（写入最终文件名）")
+    parser.add_argument("--quarter-folder", help="季度数据目录（默认：程序目录下的 {year}_{quarter}）")
+    parser.add_argument("--output", help="最终自存文件路径（默认：程序目录下的 {year}_{quarter}_{operator}_自存.xlsx）")
+    parser.add_argument("--summary", help="运行摘要 JSON 路径；'-' 表示输出到 stdout（默认：中间结果目录下）")
+    parser.add_argument("--resume", action="store_true", help="从上次中断处继续（输入 / 规则未变的来源直接复用）")
+    parser.add_argument("--preview", action="store_true", help="只做抽样预览，不写结果文件")
+    parser.add_argument("--history-db", help="历史库 SQLite 路径（默认读 rules_config.json → history_db.path）")
+    parser.add_argument("--watch", action="store_true",
+                        help="常驻监听季度目录，文件变化后只重算变化的来源并刷新自存文件（忽略 --output / --summary）")
+    parser.add_argument("--interval", type=float, help="--watch 轮询间隔秒数（默认读 rules_config.json → watch）")
+    parser.add_argument("--debounce", type=float, help="--watch 文件静止多少秒后才处理（默认读 rules_config.json → watch）")
+    return parser
+
+
+def run(args, summary: dict) -> int:
+    """跑完整流程，把行数 / 耗时 / 输出路径写进 summary，返回退出码"""
+    quarter_folder = args.quarter_folder or os.path.join(base_dir, f"{args.year}_{args.quarter}")
+    intermediate_dir = resolve_intermediate_dir(args)
+    save_dir = os.path.dirname(intermediate_dir)
+
+    name = f"{args.year}_{args.quarter}_{args.operator}_自存.xlsx" if args.operator else f"{args.year}_{args.quarter}_自存.xlsx"
+    final_output_path = args.output or os.path.join(base_dir, name)
+
+    sources = summary["sources"]
+    stages = summary["stages"]
+    started = {}
+
+    def progress(source, state):
+        if state == "running":
+            started[source] = time.time()
+            return
+        sources[source] = {"status": state}
+        if source in started:
+            sources[source]["seconds"] = round(time.time() - started[source], 2)
+
+    # ===== 1️⃣ 四大流水线 =====
+    t0 = time.time()
+    try:
+        results, stats_dict = utils.run_all_pipelines_and_save_intermediate(
+            quarter_folder=quarter_folder,
+            year=args.year,
+            quarter=args.quarter,
+            save_dir=save_dir,
+            history_db_path=args.history_db,
+            resume=args.resume,
+            preview=args.preview,
+            progress=progress
+        )
+    except (utils.QuarterFolderNotFoundError, utils.RegulatoryInputError) as e:
+        # 只有季度目录 / 监管文件识别问题算输入问题；流水线内部的错误交给 run_once 记录 traceback
+        summary["error"] = str(e)
+        return EXIT_INPUT
+    stages["pipelines"] = round(time.time() - t0, 2)
+
+    for source, df in results.items():
+        sources.setdefault(source, {})["rows"] = len(df)
+
+    if not results:
+        summary["error"] = "没有匹配到任何监管来源的文件"
+        return EXIT_NO_DATA
+
+    outputs = summary["outputs"]
+    if args.preview:
+        return EXIT_OK
+
+    outputs["intermediate_dir"] = intermediate_dir
+    outputs["sources"] = {
+        source: [
+            os.path.join(intermediate_dir, f)
+            for f in (f"{args.quarter}_{source}_结果.xlsx", f"{args.year}_{args.quarter}_{source}{utils.STAT_COUNTS_SUFFIX}")
+            if os.path.exists(os.path.join(intermediate_dir, f))
+        ]
+        for source in results
+    }
+
+    # ===== 2️⃣ 最终自存模板 =====
+    t0 = time.time()
+    utils.align_and_export_to_self_template_by_json(
+        template_json_path=os.path.join(base_dir, "template_columns.json"),
+        output_excel_path=final_output_path,
+        df_nmpa=results.get("NMPA"),
+        df_fda=results.get("FDA"),
+        df_ind=results.get("IND"),
+        df_nda=results.get("NDA"),
+        stats_dict=stats_dict
+    )
+    stages["export"] = round(time.time() - t0, 2)
+    outputs["final_excel"] = final_output_path
+
+    return EXIT_OK
+
+
+def run_once(args) -> int:
+    """跑一次完整流程并写出运行摘要，返回退出码"""
+    summary = {
+        "year": args.year,
+        "quarter": args.quarter,
+        "operator": args.operator,
+        "preview": args.preview,
+        "started": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "sources": {},
+        "stages": {},
+        "outputs": {}
+    }
+
+    # ✅ 摘要输出到 stdout 时，流水线的打印改走 stderr，stdout 只保留 JSON
+    log_stream = sys.stderr if args.summary == "-" else sys.stdout
+    t0 = time.time()
+    with redirect_stdout(log_stream):
+        try:
+            code = run(args, summary)
+        except Exception as e:
+            traceback.print_exc()
+            summary["error"] = str(e)
+            summary["traceback"] = traceback.format_exc()
+            code = EXIT_ERROR
+
+    summary["finished"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    summary["seconds"] = round(time.time() - t0, 2)
+    summary["status"] = "ok" if code == EXIT_OK else "failed"
+    summary["exit_code"] = code
+
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary == "-":
+        print(text)
+    else:
+        summary_path = args.summary or os.path.join(
+            resolve_intermediate_dir(args), f"{args.year}_{args.quarter}_run_summary.json"
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(summary_path)), exist_ok=True)
+        with open(summary_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"📄 运行摘要：{summary_path}（退出码 {code}）")
+
+    return code
+
+
+# ===============================
+# ✅ 常驻监听（配置：rules_config.json → watch）
+# ===============================
+# 轮询 base_dir 下所有 {year}_{quarter} 目录中的 Excel（大小 + 修改时间）：
+# - 目录内容变化后等待 debounce 秒，期间没有新变化（一批文件拷完）才处理
+# - 处理 = resume 模式的 run_once：检查点指纹未变的来源直接复用，只重算变化的来源，
+#   然后重新生成 {year}_{quarter}_{operator}_自存.xlsx
+# - 中间结果按年份分目录（{year}_{quarter}_intermediate），2024_Q4 与 2025_Q4 不会互相覆盖
+# - rules_config.json / template_columns.json 变化也算变化：所有目录重新处理
+#   （检查点记录了规则 / 模板哈希，受影响的来源会重算）
+# - 处理失败（例如文件还没拷完）不会退出，目录下次变化时重试
+
+QUARTER_FOLDER_PATTERN = re.compile(r"^(\d{4})_(Q[1-4])$")
+
+
+def find_quarter_folders(root: str, year: int = None, quarter: str = None) -> dict:
+    """root 下的季度目录 → {目录路径: (年份, 季度)}，可按 year / quarter 过滤"""
+    folders = {}
+    for name in sorted(os.listdir(root)):
+        m = QUARTER_FOLDER_PATTERN.match(name)
+        path = os.path.join(root, name)
+        if not m or not os.path.isdir(path):
+            continue
+        if (year is not None and int(m.group(1)) != year) or (quarter is not None and m.group(2) != quarter):
+            continue
+        folders[path] = (int(m.group(1)), m.group(2))
+    return folders
+
+
+def folder_snapshot(folder: str) -> dict:
+    """目录中 Excel 文件的 {文件名: (大小, 修改时间ns)}（忽略 ~$ 临时文件）"""
+    snapshot = {}
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.startswith("~$") or not name.lower().endswith(utils.EXCEL_SUFFIXES) or not os.path.isfile(path):
+            continue
+        st = os.stat(path)
+        snapshot[name] = (st.st_size, st.st_mtime_ns)
+    return snapshot
+
+
+def watch(args) -> int:
+    cfg = utils.load_rules_config().get("watch", {})
+    interval = args.interval if args.interval is not None else cfg.get("interval_seconds", 10)
+    debounce = args.debounce if args.debounce is not None else cfg.get("debounce_seconds", 30)
+
+    print("\n==============================")
+    print(f"👀 开始监听季度目录：{base_dir}")
+    print(f"   轮询间隔 {interval} 秒，文件静止 {debounce} 秒后处理；Ctrl+C 停止")
+    print("==============================\n")
+
+    processed = {}   # 目录 → 上次处理时的快照（含规则 / 模板哈希）
+    pending = {}     # 目录 → (最新快照, 最近一次发现变化的时间)
+
+    try:
+        while True:
+            now = time.time()
+            config = utils.config_hashes()
+            for folder, (year, quarter) in find_quarter_folders(base_dir, args.year, args.quarter).items():
+                files = folder_snapshot(folder)
+                snapshot = (files, config)
+
+                if not files and folder not in processed:
+                    # 还没有文件的空目录：不提示，等第一份文件进来
+                    processed[folder] = snapshot
+                    continue
+
+                if snapshot == processed.get(folder):
+                    pending.pop(folder, None)
+                    continue
+
+                if folder not in pending or pending[folder][0] != snapshot:
+                    pending[folder] = (snapshot, now)
+                    print(f"🔔 检测到变化：{folder}（{debounce} 秒内无新变化后处理）")
+                    continue
+
+                if now - pending[folder][1] < debounce:
+                    continue
+
+                pending.pop(folder)
+                processed[folder] = snapshot
+                if not files:
+                    print(f"ℹ️ {folder} 中已没有 Excel 文件，跳过")
+                    continue
+
+                print(f"\n🚀 {year} {quarter}：文件已稳定，开始增量处理")
+                code = run_once(argparse.Namespace(**{
+                    **vars(args),
+                    "year": year,
+                    "quarter": quarter,
+                    "quarter_folder": folder,
+                    "intermediate_dir": intermediate_dir_for(quarter, year),
+                    "output": None,
+                    "summary": None,
+                    "resume": True,
+                    "preview": False
+                }))
+                print(f"{'✅' if code == EXIT_OK else '⚠️'} {year} {quarter} 处理结束（退出码 {code}），继续监听...")
+
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\n⏹️ 已停止监听")
+
+    return EXIT_OK
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.watch:
+        return watch(args)
+
+    if args.year is None or args.quarter is None:
+        parser.error("非 --watch 模式必须提供 --year 和 --quarter")
+
+    return run_once(args)
+
+
+# ✅ 读取阶段会用多进程并行解析 Sheet：spawn 模式下子进程会重新导入本文件
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
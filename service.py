@@ -0,0 +1,403 @@
+import utils
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import threading
+import traceback
+import multiprocessing
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+# ===============================
+# ✅ 0️⃣ 获取 base_dir（兼容 .py & PyInstaller）
+# ===============================
+if getattr(sys, "frozen", False):
+    base_dir = os.path.dirname(sys.executable)
+else:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# ===============================
+# ✅ 本地 HTTP 任务服务（配置：rules_config.json → service）
+# ===============================
+# 接口：
+#   POST /jobs                               multipart/form-data：year、quarter、operator（可选）+ 任意多个 Excel 文件
+#                                            → 202 {"id": ...}；排队已满 → 503
+#   GET  /jobs                               所有任务的状态
+#   GET  /jobs/<id>                          单个任务：state（queued / running / done / failed）+ 各阶段状态与耗时
+#   GET  /jobs/<id>/log                      任务运行日志（流水线的全部打印输出）
+#   GET  /jobs/<id>/artifacts/<文件名>        下载结果：{year}_{quarter}_{operator}_自存.xlsx / {year}_{quarter}_intermediate.zip
+#
+# 每个任务一个目录：{jobs_dir}/{id}/ → inputs/（上传文件）、outputs/（结果）、status.json、log.txt
+# 任务交给固定大小的进程池执行；状态写在 status.json 中，服务重启后仍可查询、下载
+# （重启时仍处于 queued / running 的任务已随旧进程池中断，启动时统一标记为 failed）
+
+JOB_STAGES = ["IND", "NDA", "FDA", "NMPA", "final", "zip"]
+
+
+def _status_path(job_dir: str) -> str:
+    return os.path.join(job_dir, "status.json")
+
+
+def read_job_status(job_dir: str) -> dict:
+    with open(_status_path(job_dir), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def update_job_status(job_dir: str, **changes) -> dict:
+    """读取 → 修改 → 原子写回 status.json（先写 .tmp 再替换，读取方不会看到半个文件）"""
+    path = _status_path(job_dir)
+    status = read_job_status(job_dir) if os.path.exists(path) else {}
+
+    stages = changes.pop("stages", None)
+    status.update(changes)
+    if stages:
+        status.setdefault("stages", {}).update(stages)
+
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(status, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return status
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ===============================
+# ✅ 1️⃣ 子进程中执行的任务（模块顶层函数，可 pickle）
+# ===============================
+def run_job(job_dir: str):
+    """
+    ✅ 在工作进程中跑完一个任务：
+    四大流水线（纯内存）→ 最终自存模板 → 中间结果 zip，全部写到 outputs/
+    每个阶段开始 / 结束都会更新 status.json
+    """
+    status = read_job_status(job_dir)
+    year, quarter, operator = status["year"], status["quarter"], status["operator"]
+
+    input_dir = os.path.join(job_dir, "inputs")
+    output_dir = os.path.join(job_dir, "outputs")
+    os.makedirs(output_dir, exist_ok=True)
+
+    update_job_status(job_dir, state="running", started=_now())
+    stage_started = {}
+
+    def progress(stage, state):
+        if state == "running":
+            stage_started[stage] = time.time()
+            update_job_status(job_dir, stages={stage: {"status": "running"}})
+        elif state == "skipped":
+            update_job_status(job_dir, stages={stage: {"status": "skipped"}})
+        else:
+            seconds = round(time.time() - stage_started.get(stage, time.time()), 2)
+            update_job_status(job_dir, stages={stage: {"status": state, "seconds": seconds}})
+
+    with open(os.path.join(job_dir, "log.txt"), "w", encoding="utf-8") as log, redirect_stdout(log):
+        try:
+            inputs = [os.path.join(input_dir, f) for f in sorted(os.listdir(input_dir))]
+            run = utils.run_all_in_memory(inputs, year, quarter, progress=progress)
+
+            # ===== 最终自存模板 =====
+            progress("final", "running")
+            final_name = f"{year}_{quarter}_{operator}_自存.xlsx" if operator else f"{year}_{quarter}_自存.xlsx"
+            utils.align_and_export_to_self_template_by_json(
+                template_json_path=os.path.join(base_dir, "template_columns.json"),
+                output_excel_path=os.path.join(output_dir, final_name),
+                df_nmpa=run["results"].get("NMPA"),
+                df_fda=run["results"].get("FDA"),
+                df_ind=run["results"].get("IND"),
+                df_nda=run["results"].get("NDA"),
+                stats_dict=run["stats_dict"]
+            )
+            progress("final", "done")
+
+            # ===== 中间结果 zip（结构同 {quarter}_intermediate 目录）=====
+            progress("zip", "running")
+            with open(os.path.join(output_dir, f"{year}_{quarter}_intermediate.zip"), "wb") as f:
+                f.write(utils.export_results_zip(run["pipeline_results"], year, quarter))
+            progress("zip", "done")
+
+        except Exception as e:
+            traceback.print_exc()
+            stages = {
+                stage: {**info, "status": "failed"}
+                for stage, info in read_job_status(job_dir).get("stages", {}).items()
+                if info.get("status") == "running"
+            }
+            update_job_status(job_dir, state="failed", finished=_now(), error=str(e), stages=stages)
+            return
+
+    update_job_status(
+        job_dir, state="done", finished=_now(),
+        rows={source: len(df) for source, df in run["results"].items()},
+        artifacts=sorted(os.listdir(output_dir))
+    )
+
+
+# ===============================
+# ✅ 2️⃣ 任务管理（HTTP 线程中使用）
+# ===============================
+class JobManager:
+    """固定大小的进程池 + 排队上限；状态以各任务目录下的 status.json 为准"""
+
+    def __init__(self, jobs_dir: str, workers: int, max_queued: int):
+        self.jobs_dir = jobs_dir
+        self.max_queued = max_queued
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.pending = {}
+        self.lock = threading.Lock()
+        os.makedirs(jobs_dir, exist_ok=True)
+        self.fail_interrupted_jobs()
+
+    def fail_interrupted_jobs(self):
+        """启动时：上次服务停止时仍在排队 / 运行的任务不会再被执行，标记为 failed"""
+        for job_id in sorted(os.listdir(self.jobs_dir)):
+            job_dir = self.job_dir(job_id)
+            if job_dir is None:
+                continue
+            status = read_job_status(job_dir)
+            if status.get("state") not in ["queued", "running"]:
+                continue
+
+            stages = {
+                stage: {**info, "status": "failed"}
+                for stage, info in status.get("stages", {}).items()
+                if info.get("status") == "running"
+            }
+            update_job_status(job_dir, state="failed", finished=_now(),
+                              error="服务重启，任务已中断，请重新提交", stages=stages)
+            print(f"⚠️ 任务 {job_id} 在服务停止时未完成，已标记为 failed")
+
+    def job_dir(self, job_id: str):
+        """合法且存在的任务 → 目录，否则 None（防止路径穿越）"""
+        if not job_id or job_id != os.path.basename(job_id) or job_id.startswith("."):
+            return None
+        path = os.path.join(self.jobs_dir, job_id)
+        return path if os.path.exists(_status_path(path)) else None
+
+    def submit(self, year: int, quarter: str, operator: str, files: list):
+        """保存上传文件并排队；排队已满返回 None"""
+        with self.lock:
+            if len(self.pending) >= self.max_queued:
+                return None
+
+            job_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{year}_{quarter}_{uuid.uuid4().hex[:6]}"
+            job_dir = os.path.join(self.jobs_dir, job_id)
+            input_dir = os.path.join(job_dir, "inputs")
+            os.makedirs(input_dir)
+
+            try:
+                for name, data in files:
+                    with open(os.path.join(input_dir, name), "wb") as f:
+                        f.write(data)
+
+                update_job_status(
+                    job_dir, id=job_id, state="queued", created=_now(),
+                    year=year, quarter=quarter, operator=operator,
+                    inputs=[name for name, _ in files],
+                    stages={stage: {"status": "pending"} for stage in JOB_STAGES}
+                )
+            except Exception:
+                # 保存失败：不留下没有 status.json 的半个任务目录
+                shutil.rmtree(job_dir, ignore_errors=True)
+                raise
+
+            future = self.executor.submit(run_job, job_dir)
+            self.pending[job_id] = future
+
+        future.add_done_callback(lambda f: self._finished(job_id, job_dir, f))
+        return job_id
+
+    def _finished(self, job_id: str, job_dir: str, future):
+        with self.lock:
+            self.pending.pop(job_id, None)
+
+        if future.cancelled():
+            update_job_status(job_dir, state="failed", finished=_now(), error="服务停止，任务已取消")
+            return
+
+        # 工作进程异常退出（run_job 自身的异常已写入 status.json）
+        error = future.exception()
+        if error is not None:
+            update_job_status(job_dir, state="failed", finished=_now(), error=f"工作进程异常：{error}")
+
+    def list_jobs(self):
+        jobs = []
+        for job_id in sorted(os.listdir(self.jobs_dir)):
+            job_dir = self.job_dir(job_id)
+            if job_dir is not None:
+                jobs.append(read_job_status(job_dir))
+        return jobs
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def validate_upload_names(files: list):
+    """
+    ✅ 上传文件名检查（所有文件保存在同一个 inputs/ 目录）：
+    - 空文件名 / "." / ".." → 报错
+    - 重复文件名（不区分大小写，兼容 Windows）→ 报错，避免后上传的覆盖先上传的
+    """
+    seen = set()
+    for name, _ in files:
+        if name in ["", ".", ".."] or "\x00" in name:
+            raise ValueError(f"❌ 不合法的文件名：{name!r}")
+        key = name.casefold()
+        if key in seen:
+            raise ValueError(f"❌ 文件名重复：{name}（同一任务中的文件名必须互不相同）")
+        seen.add(key)
+
+
+def parse_multipart(content_type: str, body: bytes):
+    """
+    ✅ 解析 multipart/form-data（标准库 email 解析器）
+    返回 (普通字段 {name: 文本}, 文件 [(文件名, bytes), ...])
+    """
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\nMIME-Version: 1.0\r\n\r\n".encode("utf-8") + body
+    )
+    if not message.is_multipart():
+        raise ValueError("❌ 请求体必须是 multipart/form-data")
+
+    fields, files = {}, []
+    for part in message.iter_parts():
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True) or b""
+        if filename:
+            files.append((os.path.basename(filename.replace("\\", "/")), payload))
+        else:
+            name = part.get_param("name", header="content-disposition")
+            fields[name] = payload.decode("utf-8").strip()
+
+    return fields, files
+
+
+# ===============================
+# ✅ 3️⃣ HTTP 接口
+# ===============================
+class JobRequestHandler(BaseHTTPRequestHandler):
+    manager: JobManager = None
+
+    def _send_json(self, code: int, obj):
+        data = json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_file(self, path: str, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.send_header(
+            "Content-Disposition",
+            f"attachment; filename*=UTF-8''{quote(os.path.basename(path))}"
+        )
+        self.end_headers()
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                self.wfile.write(chunk)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            return self._send_json(404, {"error": "未知接口"})
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            fields, files = parse_multipart(self.headers.get("Content-Type", ""), self.rfile.read(length))
+
+            year = fields.get("year", "")
+            quarter = fields.get("quarter", "").upper()
+            if not year.isdigit():
+                raise ValueError("❌ 年份必须是数字，如 2025")
+            if quarter not in ["Q1", "Q2", "Q3", "Q4"]:
+                raise ValueError("❌ 季度必须是 Q1 / Q2 / Q3 / Q4")
+            if not files:
+                raise ValueError("❌ 请至少上传一个文件")
+            validate_upload_names(files)
+        except ValueError as e:
+            return self._send_json(400, {"error": str(e)})
+
+        job_id = self.manager.submit(int(year), quarter, fields.get("operator", ""), files)
+        if job_id is None:
+            return self._send_json(503, {"error": "排队任务已满，请稍后再提交"})
+
+        self._send_json(202, {"id": job_id, "status": f"/jobs/{job_id}"})
+
+    def do_GET(self):
+        parts = [unquote(p) for p in self.path.split("?")[0].strip("/").split("/")]
+
+        if parts == ["jobs"]:
+            return self._send_json(200, self.manager.list_jobs())
+
+        if len(parts) < 2 or parts[0] != "jobs":
+            return self._send_json(404, {"error": "未知接口"})
+
+        job_dir = self.manager.job_dir(parts[1])
+        if job_dir is None:
+            return self._send_json(404, {"error": f"任务不存在：{parts[1]}"})
+
+        if len(parts) == 2:
+            return self._send_json(200, read_job_status(job_dir))
+
+        if parts[2:] == ["log"] and os.path.exists(os.path.join(job_dir, "log.txt")):
+            return self._send_file(os.path.join(job_dir, "log.txt"), "text/plain; charset=utf-8")
+
+        if len(parts) == 4 and parts[2] == "artifacts":
+            output_dir = os.path.join(job_dir, "outputs")
+            if os.path.isdir(output_dir) and parts[3] in os.listdir(output_dir):
+                return self._send_file(os.path.join(output_dir, parts[3]), "application/octet-stream")
+
+        self._send_json(404, {"error": "文件不存在"})
+
+
+# ===============================
+# ✅ 4️⃣ 启动
+# ===============================
+def main():
+    cfg = utils.load_rules_config().get("service", {})
+
+    parser = argparse.ArgumentParser(description="监管数据处理：本地 HTTP 任务服务")
+    parser.add_argument("--host", default=cfg.get("host", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=cfg.get("port", 8765))
+    parser.add_argument("--workers", type=int, default=cfg.get("workers", 2), help="工作进程数")
+    parser.add_argument("--max-queued", type=int, default=cfg.get("max_queued", 16), help="排队 + 运行中任务上限")
+    parser.add_argument("--jobs-dir", default=os.path.join(base_dir, cfg.get("jobs_dir", "service_jobs")))
+    args = parser.parse_args()
+
+    JobRequestHandler.manager = JobManager(args.jobs_dir, args.workers, args.max_queued)
+    server = ThreadingHTTPServer((args.host, args.port), JobRequestHandler)
+
+    print("\n==============================")
+    print(f"🚀 任务服务已启动：http://{args.host}:{args.port}")
+    print(f"   工作进程：{args.workers}，排队上限：{args.max_queued}")
+    print(f"📁 任务目录：{args.jobs_dir}")
+    print("==============================\n")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️ 正在停止服务...")
+    finally:
+        server.server_close()
+        JobRequestHandler.manager.shutdown()
+
+
+# ✅ 工作进程用 spawn 启动，会重新导入本文件：必须放在 __main__ 保护里
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,47 @@
+import datetime
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# ✅ 测试直接导入仓库根目录下的 utils.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _detail_rows(n: int, holder_col: str, name_col: str, date_col: str, extra: dict):
+    categories = [("生物制品", "抗体"), ("化学药品", "其他"), ("中药", "中成药")]
+    return pd.DataFrame([
+        {
+            name_col: f"药品{i % 5}",
+            "剂型": ["注射剂", "片剂"][i % 2],
+            holder_col: ["恒瑞医药股份有限公司", "百济神州", "Pfizer Inc."][i % 3],
+            "药品类别一": categories[i % 3][0],
+            "药品类别二": categories[i % 3][1],
+            "靶点": ["PD-1", "EGFR", None][i % 3],
+            "参考疾病领域": ["肿瘤", "感染;肿瘤", "免疫"][i % 3],
+            date_col: datetime.datetime(2025, 10, 1) + datetime.timedelta(days=i),
+            **extra,
+        }
+        for i in range(n)
+    ])
+
+
+@pytest.fixture
+def quarter_files(tmp_path):
+    """四个来源各一份的小型季度数据：{文件名: 路径}"""
+    folder = tmp_path / "2025_Q4"
+    folder.mkdir()
+
+    sheets = {
+        "CDE_IND_2025Q4.xlsx": ("数据详情", _detail_rows(12, "持证商", "通用名", "CDE承办日期", {"中国最高进度": "临床I期"})),
+        "CDE_NDA_2025Q4.xlsx": ("数据详情", _detail_rows(9, "持证商", "通用名", "CDE承办日期", {"中国最高阶段": "申报上市"})),
+        "NMPA_2025Q4.xlsx": ("数据详情", _detail_rows(8, "持证商(NMPA)", "通用名", "最新批准日期", {"批准文号": "国药准字"})),
+        "FDA_2025Q4.xlsx": ("目标药品", _detail_rows(7, "申请机构", "活性成分(中文)", "美国上市日期", {"美国最高状态": "上市"})),
+    }
+
+    paths = {}
+    for name, (sheet, df) in sheets.items():
+        paths[name] = folder / name
+        df.to_excel(paths[name], sheet_name=sheet, index=False)
+    return paths
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+
+pytest.importorskip("pyarrow")
+
+VALUES = np.array(["甲", "乙", "丙", "a", "b", None, np.nan, "nan", ""], dtype=object)
+
+
+@pytest.fixture
+def backends():
+    # chunk_rows 很小：多分块 + 合并字典的路径也会走到
+    return utils.PandasBackend(), utils.ArrowBackend(chunk_rows=7, max_workers=2)
+
+
+@pytest.mark.parametrize("dtype", [object, "str"])
+def test_factorize_and_group_codes(backends, dtype):
+    pandas_backend, arrow_backend = backends
+    rng = np.random.default_rng(0)
+
+    for _ in range(100):
+        n = int(rng.integers(0, 60))
+        col = pd.Series(rng.choice(VALUES, n), dtype=dtype)
+
+        codes_p, uniques_p = pandas_backend.factorize(col)
+        codes_a, uniques_a = arrow_backend.factorize(col)
+        np.testing.assert_array_equal(codes_p, codes_a)
+        pd.testing.assert_index_equal(uniques_p, uniques_a, exact=True)
+
+        df = pd.DataFrame({
+            "k1": col,
+            "k2": pd.Series(rng.choice(VALUES, n), dtype=dtype),
+            "k3": rng.integers(0, 3, n),
+        })
+        np.testing.assert_array_equal(
+            pandas_backend.group_codes(df, ["k1", "k2", "k3"]),
+            arrow_backend.group_codes(df, ["k1", "k2", "k3"])
+        )
+
+
+def test_mixed_types_fall_back(backends):
+    pandas_backend, arrow_backend = backends
+    col = pd.Series(["a", 1, "1", None, 2.5], dtype=object)
+
+    codes_p, uniques_p = pandas_backend.factorize(col)
+    codes_a, uniques_a = arrow_backend.factorize(col)
+    np.testing.assert_array_equal(codes_p, codes_a)
+    pd.testing.assert_index_equal(uniques_p, uniques_a)
+
+
+def test_left_join(backends):
+    pandas_backend, arrow_backend = backends
+    rng = np.random.default_rng(1)
+    df_map = utils.build_classify_mapping_from_json()
+    pairs = df_map[["药品类别一", "药品类别二"]].to_numpy()
+    keys = ["药品类别一", "药品类别二"]
+
+    for _ in range(30):
+        n = int(rng.integers(0, 80))
+        idx = rng.integers(0, len(pairs) + 3, n)
+        rows = [tuple(pairs[i]) if i < len(pairs) else ("未知", None) for i in idx]
+        df = pd.DataFrame(rows, columns=keys)
+        df["x"] = np.arange(n)
+        df.index = df.index + 5
+
+        pd.testing.assert_frame_equal(
+            pandas_backend.left_join(df, df_map, keys),
+            arrow_backend.left_join(df, df_map, keys)
+        )
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+import utils
+
+
+@pytest.fixture
+def saved(tmp_path):
+    """保存一个 IND 检查点，返回 (中间目录, 输入文件)"""
+    input_file = tmp_path / "ind.xlsx"
+    input_file.write_bytes(b"placeholder")
+
+    df = pd.DataFrame({"药品类别一": ["中药", "化学药品"], "类别(粗分)": ["TCM", "SMD"],
+                       "详细列（细分）": ["TCM", "SMD"], "参考疾病领域": ["肿瘤", "血液"], "靶点": ["KRAS", None]})
+    specs = utils.load_statistics_specs("IND")
+    counts = utils.compute_statistic_counts(df, specs)
+
+    checkpoint = utils.open_run_checkpoint(str(tmp_path), 2025, "Q4")
+    utils.save_source_checkpoint(checkpoint, "IND", str(input_file),
+                                 {"df": df, "stat_counts": counts, "stat_specs": specs})
+    return str(tmp_path), str(input_file)
+
+
+def test_resume_when_nothing_changed(saved):
+    intermediate_dir, input_file = saved
+    checkpoint = utils.open_run_checkpoint(intermediate_dir, 2025, "Q4")
+    res = utils.resume_source_checkpoint(checkpoint, "IND", input_file)
+
+    assert res is not None
+    assert len(res["df"]) == 2
+
+
+def test_template_change_invalidates_checkpoint(saved):
+    intermediate_dir, input_file = saved
+    template = utils.load_template_columns()
+    template["China IND"] = list(template["China IND"]) + ["新增列"]
+
+    with utils.config_overrides(template=template):
+        checkpoint = utils.open_run_checkpoint(intermediate_dir, 2025, "Q4")
+        assert utils.resume_source_checkpoint(checkpoint, "IND", input_file) is None
+
+
+def test_code_version_change_invalidates_checkpoint(saved, monkeypatch):
+    intermediate_dir, input_file = saved
+    monkeypatch.setattr(utils, "code_version", lambda: "other-build")
+
+    checkpoint = utils.open_run_checkpoint(intermediate_dir, 2025, "Q4")
+    assert utils.resume_source_checkpoint(checkpoint, "IND", input_file) is None
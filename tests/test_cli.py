@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+
+import cli
+import utils
+
+
+def _run(tmp_path, monkeypatch, *extra):
+    # 中间结果目录建在程序目录（base_dir）下：测试时换成临时目录
+    monkeypatch.setattr(cli, "base_dir", str(tmp_path))
+    summary_path = tmp_path / "summary.json"
+    code = cli.main(["--year", "2025", "--quarter", "Q4", "--summary", str(summary_path), *extra])
+    return code, json.loads(summary_path.read_text(encoding="utf-8"))
+
+
+def test_missing_quarter_folder_is_input_error(tmp_path, monkeypatch):
+    code, summary = _run(tmp_path, monkeypatch, "--quarter-folder", str(tmp_path / "没有这个目录"))
+
+    assert code == cli.EXIT_INPUT
+    assert "traceback" not in summary
+
+
+def test_pipeline_value_error_is_runtime_error(tmp_path, monkeypatch):
+    def broken_pipelines(**kwargs):
+        raise ValueError("cannot insert 序号, already exists")
+
+    monkeypatch.setattr(utils, "run_all_pipelines_and_save_intermediate", broken_pipelines)
+    code, summary = _run(tmp_path, monkeypatch, "--quarter-folder", str(tmp_path))
+
+    assert code == cli.EXIT_ERROR
+    assert summary["status"] == "failed"
+    assert "cannot insert 序号" in summary["traceback"]
+
+
+def test_watch_keeps_years_of_the_same_quarter_apart(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli, "base_dir", str(tmp_path))
+    for year in ["2024", "2025"]:
+        (tmp_path / f"{year}_Q4").mkdir()
+        (tmp_path / f"{year}_Q4" / "ind.xlsx").write_bytes(b"x")
+
+    calls = []
+    monkeypatch.setattr(cli, "run_once", lambda args: calls.append(cli.resolve_intermediate_dir(args)) or cli.EXIT_OK)
+
+    sleeps = []
+    def fake_sleep(seconds):
+        # 第一轮发现变化，第二轮处理，然后停止
+        sleeps.append(seconds)
+        if len(sleeps) == 2:
+            raise KeyboardInterrupt
+    monkeypatch.setattr(cli.time, "sleep", fake_sleep)
+
+    assert cli.main(["--watch", "--interval", "0", "--debounce", "0"]) == cli.EXIT_OK
+    assert sorted(calls) == [cli.intermediate_dir_for("Q4", 2024), cli.intermediate_dir_for("Q4", 2025)]
+    assert calls[0] != calls[1]
+
+
+def test_successful_run_writes_outputs_and_summary(tmp_path, monkeypatch, quarter_files):
+    # 程序目录换成临时目录：最终文件 / 中间结果都写在这里，模板从这里读取
+    shutil.copy(os.path.join(os.path.dirname(utils.__file__), "template_columns.json"), tmp_path)
+    folder = next(iter(quarter_files.values())).parent
+
+    code, summary = _run(tmp_path, monkeypatch, "--quarter-folder", str(folder), "--operator", "测试")
+
+    assert code == cli.EXIT_OK
+    assert summary["status"] == "ok"
+    assert set(summary["sources"]) == {"IND", "NDA", "FDA", "NMPA"}
+    assert all(info["status"] == "done" and info["rows"] > 0 for info in summary["sources"].values())
+    assert set(summary["stages"]) == {"pipelines", "export"}
+
+    outputs = summary["outputs"]
+    assert os.path.exists(outputs["final_excel"])
+    assert outputs["final_excel"].endswith("2025_Q4_测试_自存.xlsx")
+    for source, files in outputs["sources"].items():
+        assert len(files) == 2 and all(os.path.exists(f) for f in files)
@@ -0,0 +1,32 @@
+import pandas as pd
+
+import utils
+
+
+def _ind_detail():
+    keys = utils.get_dedup_rule("IND")["keys"]
+    df = pd.DataFrame({k: [f"{k}{i}" for i in range(3)] for k in keys})
+    df["类别(粗分)"] = ["小分子", "抗体", "小分子"]
+    return df, keys
+
+
+def test_same_quarter_across_years_shares_one_directory(tmp_path):
+    # {quarter}_intermediate 跨年份共用：2024 Q4 和 2025 Q4 的明细缓存在同一个目录
+    prev, keys = _ind_detail()
+    curr = prev.iloc[1:].copy()
+    utils.save_intermediate_df(prev, str(tmp_path), "2024_Q4_IND")
+    utils.save_intermediate_df(curr, str(tmp_path), "2025_Q4_IND")
+
+    deltas = utils.compare_quarters((2024, "Q4"), (2025, "Q4"), str(tmp_path), sources=["IND"])
+
+    assert list(deltas) == ["IND"]
+    assert len(deltas["IND"]["added"]) == 0
+    assert deltas["IND"]["removed"][keys].values.tolist() == prev.iloc[:1][keys].values.tolist()
+
+
+def test_missing_period_is_skipped(tmp_path):
+    df, _ = _ind_detail()
+    utils.save_intermediate_df(df, str(tmp_path), "2025_Q4_IND")
+
+    assert utils.load_intermediate_df(str(tmp_path), 2024, "Q4", "IND") is None
+    assert utils.compare_quarters((2024, "Q4"), (2025, "Q4"), str(tmp_path), sources=["IND"]) == {}
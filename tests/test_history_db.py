@@ -0,0 +1,25 @@
+import pandas as pd
+
+import utils
+
+
+def test_history_merge_matches_excel_merge(tmp_path):
+    # 同一份分类明细：一份写进 2025_Q4 自存文件的 Sheet，一份写进历史库
+    df = pd.DataFrame({
+        "通用名": ["阿司匹林", "布洛芬"],
+        "药品类别一": ["化学药品", "生物制品"],
+        "药品类别二": ["其他", "抗体"],
+        "靶点": ["COX", "PD-1"],
+        "参考疾病领域": ["肿瘤", "免疫"],
+    })
+    workbook = tmp_path / "2025_Q4_Kate_自存.xlsx"
+    df.to_excel(workbook, sheet_name="China IND", index=False)
+
+    db_path = str(tmp_path / "history.db")
+    utils.save_to_history_db(db_path, {"IND": df}, 2025, "Q4")
+
+    from_excel = utils.load_and_merge_by_sheet([str(workbook)], "IND")
+    from_db = utils.load_and_merge_from_history_db(db_path, "IND")
+
+    assert from_db["季度来源"].tolist() == from_excel["季度来源"].tolist() == ["Q4", "Q4"]
+    pd.testing.assert_frame_equal(from_db, from_excel, check_dtype=False)
@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+import utils
+
+SUFFIXES = utils.company_suffix_keys(utils.load_rules_config()["company_suffixes"])
+
+
+@pytest.mark.parametrize("value, key", [
+    ("Zinc", "zinc"),                         # Inc 前没有分隔符，不是后缀
+    ("Costco", "costco"),
+    ("Sinopharm Co", "sinopharm"),
+    ("Shionogi & Co., Ltd.", "shionogi"),
+    ("Pfizer,Inc", "pfizer"),
+    ("Bayer AG", "bayer"),
+    ("ＡＢＣ　制药有限公司", "abc制药"),
+    ("恒瑞医药集团", "恒瑞医药"),
+    ("集团", "集团"),                          # 整个取值就是后缀时保留
+    (None, ""),
+])
+def test_normalize_match_key(value, key):
+    assert utils.normalize_match_key(value, SUFFIXES) == key
+
+
+def test_clusters_ignore_suffix_and_width_but_not_word_prefix():
+    df = pd.DataFrame({
+        "通用名": ["A药", "A药", "A药", "Ａ药"],
+        "剂型": ["片剂"] * 4,
+        "持证商": ["Pfizer Inc.", "PFIZER", "Zinc", "Ｐｆｉｚｅｒ， Inc"],
+    })
+    cluster = utils.find_near_duplicate_clusters(
+        df, ["通用名", "剂型"], "持证商", suffixes=utils.load_rules_config()["company_suffixes"]
+    )
+
+    assert cluster[0] == cluster[1] == cluster[3]
+    assert cluster[2] != cluster[0]
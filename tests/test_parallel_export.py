@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+import utils
+
+
+def _sheets():
+    data = pd.DataFrame({
+        "a": [1, np.nan, np.inf, -np.inf, 2.5],
+        "b": ["x<&>\"", None, "中文", "", " lead"],
+        "c": [True, False, None, True, False],
+        "d": pd.to_datetime(["2024-01-02 03:04:05", None, "1999-12-31 00:00:00",
+                             "2024-02-29 00:00:00", "2000-01-01 12:00:00"]),
+    })
+    return {
+        "S&1": [(0, data, True), (8, pd.DataFrame([["【统计】"]]), False), (10, data.head(2), True)],
+        "第二页": [(0, pd.DataFrame({"数量": [3, 2]}), True)],
+    }
+
+
+def _write_openpyxl(path, sheets):
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for name, blocks in sheets.items():
+            for start_row, block, header in blocks:
+                block.to_excel(writer, sheet_name=name, startrow=start_row, index=False, header=header)
+
+
+def test_parallel_writer_matches_openpyxl(tmp_path):
+    sheets = _sheets()
+    utils.write_xlsx_parallel(tmp_path / "par.xlsx", sheets, max_workers=2)
+    _write_openpyxl(tmp_path / "seq.xlsx", sheets)
+
+    par = pd.read_excel(tmp_path / "par.xlsx", sheet_name=None, header=None)
+    seq = pd.read_excel(tmp_path / "seq.xlsx", sheet_name=None, header=None)
+    assert list(par) == list(seq)
+    for name in seq:
+        pd.testing.assert_frame_equal(par[name], seq[name])
+
+    # 单元格类型与日期格式也一致
+    wb_par, wb_seq = load_workbook(tmp_path / "par.xlsx"), load_workbook(tmp_path / "seq.xlsx")
+    for ws in wb_seq.worksheets:
+        for row_seq, row_par in zip(ws.iter_rows(), wb_par[ws.title].iter_rows()):
+            for x, y in zip(row_seq, row_par):
+                assert (x.value, type(x.value)) == (y.value, type(y.value))
+                if x.value is not None:
+                    assert x.number_format == y.number_format
+
+
+def test_illegal_xml_characters_are_stripped(tmp_path):
+    utils.write_xlsx_parallel(tmp_path / "par.xlsx", {"S": [(0, pd.DataFrame({"a": ["\x01ok"]}), True)]})
+
+    assert pd.read_excel(tmp_path / "par.xlsx")["a"].tolist() == ["ok"]
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+
+
+@pytest.mark.parametrize("col", [
+    pd.Series([np.nan, np.nan, np.nan]),
+    pd.Series([None, None], dtype=object),
+    pd.Series([], dtype=object),
+])
+def test_all_blank_column_returns_nat(col):
+    # 整列为空时 factorize 没有唯一值，不能再用 -1 去索引空数组
+    result, n_failed = utils.parse_date_column(col, "CDE承办日期")
+
+    assert n_failed == 0
+    assert result.dtype == "datetime64[ns]"
+    assert len(result) == len(col)
+    assert result.isna().all()
+
+
+def test_mixed_column_matches_to_datetime():
+    col = pd.Series(["2024-01-02", None, 45000, "不是日期", "2024-01-02"])
+    result, n_failed = utils.parse_date_column(col, "日期")
+
+    assert n_failed == 1
+    assert result.tolist() == [
+        pd.Timestamp("2024-01-02"), pd.NaT, pd.Timestamp("2023-03-15"), pd.NaT, pd.Timestamp("2024-01-02")
+    ]
+
+
+def test_all_blank_column_with_arrow_backend():
+    pytest.importorskip("pyarrow")
+    rules = {**utils.load_rules_config(), "backend": {"engine": "arrow"}}
+    with utils.config_overrides(rules=rules):
+        result, n_failed = utils.parse_date_column(pd.Series([None, None, None], dtype=object), "日期")
+
+    assert n_failed == 0
+    assert result.isna().all()
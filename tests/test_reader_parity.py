@@ -0,0 +1,132 @@
+import datetime
+
+import pytest
+from openpyxl import Workbook
+
+import utils
+
+
+@pytest.fixture
+def fixture_xlsx(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "数据详情"
+    ws.append(["通用名", "数量", "金额", "CDE承办日期", "备注"])
+    ws.append(["阿司匹林", 3, 1.5, datetime.datetime(2025, 10, 1), "中文备注"])
+    ws.append(["Ａｓｐｉｒｉｎ", 12, 2.25, datetime.datetime(2025, 11, 15, 8, 30), None])
+    ws.append([None, None, None, None, None])
+    ws.append(["布洛芬", 7, None, datetime.datetime(2025, 12, 31), "nan"])
+    ws.append(["", 0, -3.0, None, "  前后空格  "])
+
+    ws2 = wb.create_sheet("数据详情2")
+    ws2.append(["通用名", "数量"])
+    ws2.append(["续表", 1])
+
+    path = tmp_path / "fixture.xlsx"
+    wb.save(path)
+    return path
+
+
+def test_engines_read_identical_frames(fixture_xlsx):
+    pytest.importorskip("python_calamine")
+
+    report = utils.check_reader_parity(str(fixture_xlsx))
+
+    assert set(report) == {"数据详情", "数据详情2"}
+    assert all(diffs == [] for diffs in report.values()), report
+
+
+def test_auto_engine_keeps_small_files_on_openpyxl(fixture_xlsx):
+    assert utils.excel_reader_engine(str(fixture_xlsx), "openpyxl") == "openpyxl"
+    assert utils.excel_reader_engine(str(fixture_xlsx), "auto") == "openpyxl"
+
+
+def test_forced_calamine_reads_same_spillover_frame(fixture_xlsx):
+    pytest.importorskip("python_calamine")
+    rules = utils.load_rules_config()
+
+    frames = {}
+    for engine in ["openpyxl", "calamine"]:
+        with utils.config_overrides(rules={**rules, "reader": {"engine": engine}}):
+            frames[engine] = utils.read_excel_with_spillover(str(fixture_xlsx), "数据详情", max_workers=1)
+
+    assert utils.excel_reader_engine(str(fixture_xlsx), "calamine") == "calamine"
+    assert frames["openpyxl"].equals(frames["calamine"])
+    assert frames["openpyxl"].dtypes.equals(frames["calamine"].dtypes)
+
+
+def test_legacy_xls_always_uses_calamine_or_xlrd(monkeypatch):
+    monkeypatch.setattr(utils, "python_calamine", object())
+    assert utils.excel_reader_engine("导出.xls", engine="openpyxl") == "calamine"
+
+    monkeypatch.setattr(utils, "python_calamine", None)
+    monkeypatch.setattr(utils, "xlrd", object())
+    assert utils.excel_reader_engine("导出.XLS") == "xlrd"
+
+
+def test_unreadable_xls_is_reported_not_ignored(monkeypatch):
+    monkeypatch.setattr(utils, "python_calamine", None)
+    monkeypatch.setattr(utils, "xlrd", None)
+
+    with pytest.raises(utils.RegulatoryInputError, match="IND导出.xls"):
+        utils.match_regulatory_inputs([utils.InMemoryExcel("IND导出.xls", b"\xd0\xcf\x11\xe0")])
+
+
+def test_provenance_columns_are_opt_in(fixture_xlsx):
+    df = utils.read_excel_with_spillover(str(fixture_xlsx), "数据详情", max_workers=1)
+    assert not set(utils.PROVENANCE_COLUMNS) & set(df.columns)
+
+    rules = utils.load_rules_config()
+    rules["provenance_columns"] = True
+    with utils.config_overrides(rules=rules):
+        df = utils.read_excel_with_spillover(str(fixture_xlsx), "数据详情", max_workers=1)
+    assert df["来源文件"].unique().tolist() == ["fixture.xlsx"]
+    assert df["来源Sheet"].unique().tolist() == ["数据详情"]
+
+
+def test_provenance_never_overwrites_source_columns(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "数据详情"
+    ws.append(["通用名", "来源文件"])
+    ws.append(["阿司匹林", "原始系统"])
+    path = tmp_path / "own.xlsx"
+    wb.save(path)
+
+    rules = utils.load_rules_config()
+    rules["provenance_columns"] = True
+    with utils.config_overrides(rules=rules):
+        df = utils.read_excel_with_spillover(str(path), "数据详情", max_workers=1)
+    assert df["来源文件"].tolist() == ["原始系统"]
+    assert df["来源Sheet"].tolist() == ["数据详情"]
+
+
+def test_parse_cache_hashes_only_size_matching_candidates(fixture_xlsx, tmp_path, monkeypatch):
+    utils.clear_parse_cache()
+    other = tmp_path / "other.xlsx"
+    wb = Workbook()
+    wb.active.title = "数据详情"
+    wb.active.append(["通用名"])
+    wb.save(other)
+
+    try:
+        utils.preload_inputs({"IND": str(fixture_xlsx)})
+
+        hashed = []
+        digest = utils._content_digest
+        monkeypatch.setattr(utils, "_content_digest", lambda src: hashed.append(src) or digest(src))
+
+        # 文件名 / 大小对不上任何缓存项：不读取内容计算哈希
+        utils.read_excel_with_spillover(str(other), "数据详情", max_workers=1)
+        assert hashed == []
+
+        # 同名同大小但内容不同：计算哈希后不命中
+        data = bytearray(fixture_xlsx.read_bytes())
+        data[-30] ^= 1
+        changed = utils.InMemoryExcel("fixture.xlsx", bytes(data))
+        usecols = utils._planned_usecols("IND")
+        assert utils._parse_cache_get([changed], "数据详情", usecols) is None
+        assert hashed == [changed]
+        assert utils._parse_cache_get([str(fixture_xlsx)], "数据详情", usecols) is not None
+    finally:
+        utils.clear_parse_cache()
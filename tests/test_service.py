@@ -0,0 +1,65 @@
+import os
+import time
+
+import pytest
+
+import service
+
+
+def _manager(jobs_dir):
+    manager = service.JobManager(str(jobs_dir), workers=1, max_queued=2)
+    manager.executor.shutdown(wait=False)
+    return manager
+
+
+@pytest.mark.parametrize("files", [
+    [("", b"x")],
+    [("..", b"x")],
+    [(".", b"x")],
+    [("a.xlsx", b"1"), ("A.XLSX", b"2")],
+])
+def test_validate_upload_names_rejects_bad_names(files):
+    with pytest.raises(ValueError):
+        service.validate_upload_names(files)
+
+
+def test_validate_upload_names_accepts_distinct_names():
+    service.validate_upload_names([("a.xlsx", b"1"), ("b.xlsx", b"2")])
+
+
+def test_interrupted_jobs_are_failed_on_startup(tmp_path):
+    for job_id, state in [("job_queued", "queued"), ("job_running", "running"), ("job_done", "done")]:
+        job_dir = tmp_path / job_id
+        job_dir.mkdir()
+        service.update_job_status(str(job_dir), id=job_id, state=state,
+                                  stages={"read": {"status": "done"}, "export": {"status": "running"}})
+
+    _manager(tmp_path)
+
+    for job_id in ["job_queued", "job_running"]:
+        status = service.read_job_status(os.path.join(tmp_path, job_id))
+        assert status["state"] == "failed"
+        assert status["finished"]
+        assert status["stages"]["read"]["status"] == "done"
+        assert status["stages"]["export"]["status"] == "failed"
+    assert service.read_job_status(os.path.join(tmp_path, "job_done"))["state"] == "done"
+
+
+def test_job_runs_to_done_with_artifacts(tmp_path, quarter_files):
+    manager = service.JobManager(str(tmp_path / "jobs"), workers=1, max_queued=2)
+    try:
+        files = [(name, path.read_bytes()) for name, path in quarter_files.items()]
+        job_id = manager.submit(2025, "Q4", "测试", files)
+
+        deadline = time.time() + 300
+        status = service.read_job_status(manager.job_dir(job_id))
+        while status["state"] in ["queued", "running"] and time.time() < deadline:
+            time.sleep(0.2)
+            status = service.read_job_status(manager.job_dir(job_id))
+    finally:
+        manager.executor.shutdown(wait=True)
+
+    assert status["state"] == "done", status.get("error")
+    assert set(status["rows"]) == {"IND", "NDA", "FDA", "NMPA"}
+    assert all(info["status"] == "done" for info in status["stages"].values())
+    assert status["artifacts"] == ["2025_Q4_intermediate.zip", "2025_Q4_测试_自存.xlsx"]
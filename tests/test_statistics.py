@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+import utils
+
+
+@pytest.fixture
+def classified():
+    # 各取值数量互不相同，排序结果唯一
+    return pd.DataFrame({
+        "药品类别一": ["中药"] * 3 + ["化学药品"] * 2 + ["生物制品"],
+        "类别(粗分)": ["TCM"] * 3 + ["SMD"] * 2 + ["BIO"],
+        "详细列（细分）": ["TCM"] * 3 + ["SMD"] * 2 + ["Antibody"],
+        "参考疾病领域": ["感染;肿瘤", "肿瘤", "肿瘤", "血液", None, "感染"],
+        "靶点": ["KRAS", "KRAS", "KRAS", "JAK", "JAK", None],
+    })
+
+
+def _value_counts_table(df, col):
+    """原 step3 的写法：value_counts + Total 行"""
+    table = df[col].value_counts().reset_index()
+    table.columns = [col, "数量"]
+    total = pd.DataFrame({col: ["Total"], "数量": [table["数量"].sum()]})
+    return pd.concat([table, total], ignore_index=True)
+
+
+def test_step3_matches_value_counts(classified):
+    tables = utils.step3_print_statistics(classified, show=False)
+
+    for col, table in zip(["药品类别一", "类别(粗分)", "详细列（细分）"], tables):
+        pd.testing.assert_frame_equal(table, _value_counts_table(classified, col), check_dtype=False)
+
+
+def test_step4_matches_substring_counts(classified):
+    table = utils.step4_statistics_by_disease_area(classified, show=False)
+    mapping = utils.load_rules_config()["disease_area_mapping"]
+
+    expected = [
+        int(classified["参考疾病领域"].astype(str).str.contains(zh, na=False).sum()) for zh in mapping.values()
+    ]
+    assert table["疾病领域(英文)"].tolist() == list(mapping) + ["Total"]
+    assert table["数量"].tolist() == expected + [sum(expected)]
+
+
+def test_counts_are_mergeable(classified):
+    # 分两半计数再合并 = 整表一次计数（多季度汇总依赖这一点）
+    specs = utils.load_statistics_specs("IND")
+    whole = utils.compute_statistic_counts(classified, specs)
+    halves = [utils.compute_statistic_counts(part, specs) for part in (classified.iloc[:3], classified.iloc[3:])]
+
+    for spec in specs:
+        merged = utils.merge_statistic_counts([h[spec["key"]] for h in halves], spec)
+        if whole[spec["key"]] is None:
+            assert merged is None
+            continue
+        pd.testing.assert_frame_equal(
+            pd.DataFrame(merged).sort_index().sort_index(axis=1),
+            pd.DataFrame(whole[spec["key"]]).sort_index().sort_index(axis=1),
+            check_dtype=False, check_names=False,
+            check_index_type=False, check_column_type=False
+        )
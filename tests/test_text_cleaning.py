@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+import utils
+
+
+def test_canonicalize_keeps_company_names():
+    df = pd.DataFrame({
+        "持证商": ["Zinc", "Shionogi & Co., Ltd.", "  恒瑞医药股份有限公司 ", "ＡＢＣ制药", "nan"],
+    })
+    utils.canonicalize_text_columns(df)
+
+    assert df["持证商"].tolist()[:4] == ["Zinc", "Shionogi & Co., Ltd.", "恒瑞医药股份有限公司", "ABC制药"]
+    assert pd.isna(df["持证商"].iloc[4])
+
+
+def test_dedup_compares_trimmed_names_but_exports_originals():
+    df = pd.DataFrame({
+        "通用名": ["A药", "A药", "A药"],
+        "剂型": ["片剂", "片剂", "片剂"],
+        "持证商": ["恒瑞医药股份有限公司", "恒瑞医药", "Zinc"],
+        "CDE承办日期": pd.to_datetime(["2025-01-01", "2025-02-01", "2025-03-01"]),
+    })
+    keys = ["通用名", "剂型", "持证商"]
+    key_df = utils.dedup_match_keys(df, keys)
+
+    assert key_df["持证商"].tolist() == ["恒瑞医药", "恒瑞医药", "Zinc"]
+
+    out, _ = utils.dedup_by_keys(df, keys, order_by="CDE承办日期", keep="last", key_df=key_df)
+
+    assert out["持证商"].tolist() == ["恒瑞医药", "Zinc"]
+    assert len(utils.dedup_by_keys(df, keys)[0]) == 3
+
+
+def test_match_keys_disabled():
+    rules = {**utils.load_rules_config(), "text_cleaning": {"trim_company_suffixes": False}}
+    df = pd.DataFrame({"持证商": ["Pfizer Inc."], "通用名": [np.nan]})
+
+    assert utils.dedup_match_keys(df, ["通用名", "持证商"], rules) is None
@@ -1,11 +1,43 @@
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
 
+import io
 import os
+import datetime
+import itertools
+import re
 import sys
+import copy
+import time
 import json
+import hashlib
+import threading
+import contextvars
+import unicodedata
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from difflib import SequenceMatcher
+from functools import lru_cache
 from IPython.display import display
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # 可选依赖：未安装时只能使用 pandas 计算后端
+    pa = None
+
+try:
+    import python_calamine  # noqa: F401  （pd.read_excel(engine="calamine") 需要）
+except ImportError:  # 可选依赖：未安装时 Excel 只能用 openpyxl 读取
+    python_calamine = None
+
+try:
+    import xlrd  # noqa: F401  （没有 calamine 时读取旧版 .xls）
+except ImportError:  # 可选依赖：calamine / xlrd 都没有时 .xls 会被列为问题文件
+    xlrd = None
+
 def get_exe_base_dir():
     if getattr(sys, 'frozen', False):
         return os.path.dirname(sys.executable)
@@ -26,19 +58,43 @@ def run_all_pipelines_and_save_intermediate(
     quarter_folder: str,     # 例如 "Q4"
     year: int,
     quarter: str,            # "Q1" / "Q2" / "Q3" / "Q4"
-    save_dir: str
+    save_dir: str,
+    dedup_audit: bool = None,        # None → 读取 rules_config.json 的 dedup_audit
+    near_dedup_enabled: bool = None, # None → 读取 rules_config.json 的 near_dedup.enabled
+    column_projection: bool = None,  # None → 读取 rules_config.json 的 column_projection
+    history_db_path: str = None,     # None → 读取 rules_config.json 的 history_db.path（为空则不写）
+    resume: bool = False,            # True → 跳过上次已完成、且输入 / 规则未变的来源
+    preview: bool = False,           # True → 只做抽样预览（见 preview_inputs），不写任何文件
+    progress=None                    # progress(来源, 状态)：状态 = "running" / "done" / "resumed" / "skipped"
 ):
     """
     ✅ 最终统一输出规范版：
-    - 自动匹配 IND / NDA / FDA / NMPA 四个文件
+    - 自动匹配 IND / NDA / FDA / NMPA 四类文件（每类可有多个文件，读取后合并）
     - 分别跑四套流水线
     - ✅ 所有 output_file 和中间量，统一保存到：
         Q4_intermediate / Q3_intermediate 这种文件夹中
     - ✅ 防止任何文件互相覆盖
+    - ✅ 每个来源额外保存完整统计计数：{year}_{quarter}_{source}_统计计数.json
+      （用于 rollup_statistics 做年度 / 多年汇总）
+    - ✅ 配置了历史库时，明细与统计计数追加写入 SQLite（见 save_to_history_db）
+    - ✅ 每个来源完成后立即写检查点（明细缓存 + 统计计数 + {year}_{quarter}_checkpoint.json）；
+      resume=True 时从第一个未完成的来源继续，之后照常交给 align_and_export_to_self_template_by_json
+    - ✅ preview=True：每个来源只读取 preview.sample_rows 行跑完整链路，打印投影计数 / 未匹配分类 / 列覆盖率；
+      返回的 results 是样本明细，stats_dict 是投影后的统计表
     """
 
     import os
 
+    # ===== ✅ 抽样预览：不建目录、不写检查点 / 历史库 =====
+    if preview:
+        report = preview_inputs(
+            match_regulatory_files(quarter_folder), year, quarter,
+            near_dedup_enabled=near_dedup_enabled,
+            column_projection=column_projection
+        )
+        results = {source: p["df"] for source, p in report["previews"].items()}
+        return results, report["stats_dict"]
+
     # ===== ✅ 0️⃣ 统一中间目录命名 =====
     intermediate_dir = os.path.join(save_dir,f"{quarter}_intermediate")
 
@@ -64,6 +120,16 @@ def run_all_pipelines_and_save_intermediate(
 
     results = {}
     stats_dict = {}
+    pipeline_results = {}
+
+    checkpoint = open_run_checkpoint(
+        intermediate_dir, year, quarter,
+        options={
+            "dedup_audit": dedup_audit,
+            "near_dedup_enabled": near_dedup_enabled,
+            "column_projection": column_projection
+        }
+    )
 
     # =============================
     # ✅ 2️⃣ IND
@@ -71,23 +137,36 @@ def run_all_pipelines_and_save_intermediate(
     if ind_file:
         ind_out = os.path.join(intermediate_dir, f"{quarter}_IND_结果.xlsx")
 
-        res_ind = run_ind_nda_pipeline(
-            input_file=ind_file,
-            output_file=ind_out,
-            source="IND"
-        )
+        if progress is not None:
+            progress("IND", "running")
+
+        res_ind = resume_source_checkpoint(checkpoint, "IND", ind_file) if resume else None
+        resumed = res_ind is not None
+        if res_ind is None:
+            res_ind = run_ind_nda_pipeline(
+                input_file=ind_file,
+                output_file=ind_out,
+                source="IND",
+                dedup_audit=dedup_audit,
+                near_dedup_enabled=near_dedup_enabled,
+                column_projection=column_projection
+            )
+            save_source_checkpoint(checkpoint, "IND", ind_file, res_ind)
 
-        # save_intermediate_df(df_ind, intermediate_dir, f"{quarter}_IND")
         df_ind = res_ind["df"]
         
-        stats_dict["China IND"] = {
-            "【粗分类统计】": res_ind["stat_coarse"],
-            "【疾病领域统计】": res_ind["stat_disease"],
-            "【靶点统计】": res_ind["stat_target"]
-        }
+        stats_dict["China IND"] = stat_blocks(
+            res_ind["stat_tables"], res_ind["stat_specs"], title_field="template_title"
+        )
         results["IND"] = df_ind
+        pipeline_results["IND"] = res_ind
+
+        if progress is not None:
+            progress("IND", "resumed" if resumed else "done")
     else:
         print("⚠️ 未找到 IND 文件，已跳过")
+        if progress is not None:
+            progress("IND", "skipped")
 
     # =============================
     # ✅ 3️⃣ NDA
@@ -95,23 +174,36 @@ def run_all_pipelines_and_save_intermediate(
     if nda_file:
         nda_out = os.path.join(intermediate_dir, f"{quarter}_NDA_结果.xlsx")
 
-        res_nda = run_ind_nda_pipeline(
-            input_file=nda_file,
-            output_file=nda_out,
-            source="NDA"
-        )
+        if progress is not None:
+            progress("NDA", "running")
+
+        res_nda = resume_source_checkpoint(checkpoint, "NDA", nda_file) if resume else None
+        resumed = res_nda is not None
+        if res_nda is None:
+            res_nda = run_ind_nda_pipeline(
+                input_file=nda_file,
+                output_file=nda_out,
+                source="NDA",
+                dedup_audit=dedup_audit,
+                near_dedup_enabled=near_dedup_enabled,
+                column_projection=column_projection
+            )
+            save_source_checkpoint(checkpoint, "NDA", nda_file, res_nda)
 
-        # save_intermediate_df(df_nda, intermediate_dir, f"{quarter}_NDA")
         df_nda = res_nda["df"]
 
-        stats_dict["China NDA"] = {
-            "【粗分类统计】": res_nda["stat_coarse"],
-            "【疾病领域统计】": res_nda["stat_disease"],
-            "【靶点统计】": res_nda["stat_target"]
-        }
+        stats_dict["China NDA"] = stat_blocks(
+            res_nda["stat_tables"], res_nda["stat_specs"], title_field="template_title"
+        )
         results["NDA"] = df_nda
+        pipeline_results["NDA"] = res_nda
+
+        if progress is not None:
+            progress("NDA", "resumed" if resumed else "done")
     else:
         print("⚠️ 未找到 NDA 文件，已跳过")
+        if progress is not None:
+            progress("NDA", "skipped")
 
     # =============================
     # ✅ 4️⃣ FDA
@@ -119,114 +211,1515 @@ def run_all_pipelines_and_save_intermediate(
     if fda_file:
         fda_out = os.path.join(intermediate_dir, f"{quarter}_FDA_结果.xlsx")
 
-        res_fda = run_fda_pipeline(
-            input_file=fda_file,
-            output_file=fda_out
-        )
+        if progress is not None:
+            progress("FDA", "running")
+
+        res_fda = resume_source_checkpoint(checkpoint, "FDA", fda_file) if resume else None
+        resumed = res_fda is not None
+        if res_fda is None:
+            res_fda = run_fda_pipeline(
+                input_file=fda_file,
+                output_file=fda_out,
+                dedup_audit=dedup_audit,
+                near_dedup_enabled=near_dedup_enabled,
+                column_projection=column_projection
+            )
+            save_source_checkpoint(checkpoint, "FDA", fda_file, res_fda)
 
-        # save_intermediate_df(df_fda, intermediate_dir, f"{quarter}_FDA")
         df_fda = res_fda["df"]
 
-        stats_dict["FDA approved drugs"] = {
-            "【粗分类统计】": res_fda["stat_coarse"],
-            "【靶点统计】": res_fda["stat_target"]
+        stats_dict["FDA approved drugs"] = stat_blocks(
+            res_fda["stat_tables"], res_fda["stat_specs"], title_field="template_title"
+        )
+        results["FDA"] = df_fda
+        pipeline_results["FDA"] = res_fda
+
+        if progress is not None:
+            progress("FDA", "resumed" if resumed else "done")
+    else:
+        print("⚠️ 未找到 FDA 文件，已跳过")
+        if progress is not None:
+            progress("FDA", "skipped")
+
+    # =============================
+    # ✅ 5️⃣ NMPA
+    # =============================
+    if nmpa_file:
+        nmpa_out = os.path.join(intermediate_dir, f"{quarter}_NMPA_结果.xlsx")
+
+        if progress is not None:
+            progress("NMPA", "running")
+
+        res_nmpa = resume_source_checkpoint(checkpoint, "NMPA", nmpa_file) if resume else None
+        resumed = res_nmpa is not None
+        if res_nmpa is None:
+            res_nmpa = run_nmpa_quarter_pipeline(
+                input_file=nmpa_file,
+                output_file=nmpa_out,
+                year=year,
+                quarter=quarter,
+                dedup_audit=dedup_audit,
+                near_dedup_enabled=near_dedup_enabled,
+                column_projection=column_projection
+            )
+            save_source_checkpoint(checkpoint, "NMPA", nmpa_file, res_nmpa)
+
+        df_nmpa = res_nmpa["df"]
+
+        stats_dict["NMPA approved drugs"] = stat_blocks(
+            res_nmpa["stat_tables"], res_nmpa["stat_specs"], title_field="template_title"
+        )
+        results["NMPA"] = df_nmpa
+        pipeline_results["NMPA"] = res_nmpa
+
+        if progress is not None:
+            progress("NMPA", "resumed" if resumed else "done")
+    else:
+        print("⚠️ 未找到 NMPA 文件，已跳过")
+        if progress is not None:
+            progress("NMPA", "skipped")
+
+    # =============================
+    # ✅ 6️⃣ 历史库（可选）
+    # =============================
+    db_path = _history_db_path(history_db_path)
+    if db_path:
+        save_to_history_db(
+            db_path, results, year, quarter,
+            stat_counts={src: res["stat_counts"] for src, res in pipeline_results.items()},
+            stat_specs={src: res["stat_specs"] for src, res in pipeline_results.items()}
+        )
+
+    print("\n==============================")
+    print("✅ 四大监管流水线全部执行完成")
+    print(f"📁 所有结果 & 中间量统一保存在：{intermediate_dir}")
+    print("==============================\n")
+
+    return results,stats_dict
+
+def get_exe_base_dir():
+    """
+    ✅ 获取程序真实运行目录：
+    - PyInstaller 打包后 → dist/
+    - 源码运行 → utils.py 所在目录
+    """
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    else:
+        return os.path.dirname(os.path.abspath(__file__))
+
+
+# ===== ✅ 各监管来源的【表头签名】：按文件内容（而不是文件名）识别来源 =====
+# - sheet_name：step1 读取时使用的 Sheet
+# - required：step1 / step2 必须用到的列，缺一不可
+# - hints：该来源特有的列，用于区分表头相近的来源（如 IND / NDA）
+SOURCE_SIGNATURES = {
+    "IND": {
+        "sheet_name": "数据详情",
+        "required": ["通用名", "剂型", "持证商", "药品类别一", "药品类别二"],
+        "hints": ["CDE承办日期", "中国最高进度"],
+    },
+    "NDA": {
+        "sheet_name": "数据详情",
+        "required": ["通用名", "剂型", "持证商", "药品类别一", "药品类别二"],
+        "hints": ["CDE承办日期", "中国最高阶段", "审评结论", "审评时长(自然日)", "品种适应症"],
+    },
+    "FDA": {
+        "sheet_name": "目标药品",
+        "required": ["活性成分(中文)", "申请机构", "剂型", "药品类别一", "药品类别二"],
+        "hints": ["活性成分(英文)", "美国最高状态", "美国上市日期"],
+    },
+    "NMPA": {
+        "sheet_name": "数据详情",
+        "required": ["通用名", "剂型", "持证商(NMPA)", "最新批准日期", "药品类别一", "药品类别二"],
+        "hints": ["批准文号", "药品名称(NMPA)", "生产企业(NMPA)"],
+    },
+}
+
+# 旧版 .xls（BIFF 格式）：openpyxl 读不了，由 calamine 或 xlrd 读取（见 excel_reader_engine）
+LEGACY_EXCEL_SUFFIXES = (".xls",)
+EXCEL_SUFFIXES = (".xlsx", ".xlsm") + LEGACY_EXCEL_SUFFIXES
+
+
+def _filename_mentions_source(filename: str, source: str) -> bool:
+    """文件名中是否出现独立的来源标记（FINDINGS / ANDA 这种不算）"""
+    return re.search(rf"(?<![A-Z]){source}(?![A-Z])", filename.upper()) is not None
+
+
+def detect_regulatory_source(file_path: str):
+    """
+    ✅ 只读 Sheet 名 + 表头行，给文件打分判断属于哪个监管来源：
+    - 必需列全部命中的来源才算候选
+    - 候选之间按（命中的必需列 + 特征列数量）比较，再用文件名标记兜底
+    返回 dict：
+        source  → 识别出的来源（无法识别为 None）
+        missing → {来源: 缺失的必需列}（只列出“像但不完整”的来源）
+        problem → 需要人工处理的问题描述（没有则为 None）
+    """
+    file_path = as_excel_input(file_path)
+    filename = _excel_name(file_path)
+    headers = read_sheet_headers(file_path)
+
+    candidates = {}
+    missing = {}
+
+    for source, sig in SOURCE_SIGNATURES.items():
+        cols = headers.get(sig["sheet_name"])
+        if cols is None:
+            continue
+
+        cols = set(c.strip() for c in cols)
+        hit = [c for c in sig["required"] if c in cols]
+        lack = [c for c in sig["required"] if c not in cols]
+        hint_hit = sum(1 for c in sig["hints"] if c in cols)
+
+        if not lack:
+            candidates[source] = (
+                len(hit) + hint_hit,
+                _filename_mentions_source(filename, source)
+            )
+        elif len(hit) * 2 >= len(sig["required"]) or _filename_mentions_source(filename, source):
+            missing[source] = lack
+
+    result = {"source": None, "missing": missing, "problem": None}
+
+    if not candidates:
+        if missing:
+            detail = "；".join(f"{k} 缺少 {v}" for k, v in missing.items())
+            result["problem"] = f"表头不完整：{detail}（现有 Sheet：{list(headers)}）"
+        return result
+
+    ranked = sorted(candidates.items(), key=lambda kv: kv[1], reverse=True)
+    if len(ranked) > 1 and ranked[0][1] == ranked[1][1]:
+        tied = [k for k, v in ranked if v == ranked[0][1]]
+        result["problem"] = f"表头同时符合 {tied}，无法区分，请在文件名中注明来源"
+        return result
+
+    result["source"] = ranked[0][0]
+    return result
+
+
+class QuarterFolderNotFoundError(FileNotFoundError):
+    """季度文件夹不存在（输入问题，尚未开始解析数据）"""
+
+
+class RegulatoryInputError(ValueError):
+    """监管文件识别失败 / 来源不合法（输入问题，尚未开始解析数据）"""
+
+
+def match_regulatory_files(quarter_folder: str):
+    """
+    ✅ 永远从【程序所在目录】下面找 Q4 / Q1 / Q2 目录
+    ✅ 按表头内容识别 IND / NDA / FDA / NMPA（只读表头，不做全量解析）
+    ✅ 每个来源可以有任意多个文件（按地区 / 按月拆分的导出），返回 {来源: [路径, ...]}
+    ✅ 任何“像监管文件但列不全 / 无法区分”的情况，直接报错并给出完整清单
+    """
+    base_dir = get_exe_base_dir()
+    quarter_dir = os.path.join(base_dir, quarter_folder)
+
+    print(f"📁 实际搜索目录：{quarter_dir}")
+
+    if not os.path.exists(quarter_dir):
+        raise QuarterFolderNotFoundError(f"❌ 找不到季度文件夹：{quarter_dir}")
+
+    files = sorted(os.listdir(quarter_dir))
+
+    return _classify_excel_inputs(
+        os.path.join(quarter_dir, f) for f in files
+        if os.path.isfile(os.path.join(quarter_dir, f))
+    )
+
+
+def match_regulatory_inputs(inputs):
+    """
+    ✅ 内存版 match_regulatory_files（不经过任何目录 / get_exe_base_dir）：
+    - dict：{来源: 路径 / bytes / 文件对象 / 它们的列表} → 直接按给定来源使用
+    - list：[路径 / bytes / 文件对象, ...] → 与目录模式一样按表头识别来源
+    返回 {来源: [输入, ...]}（bytes / 文件对象已转换为 InMemoryExcel）
+    """
+    if isinstance(inputs, dict):
+        result = {"IND": [], "NDA": [], "FDA": [], "NMPA": []}
+        for source, items in inputs.items():
+            source = source.upper()
+            if source not in result:
+                raise RegulatoryInputError(f"❌ 未知来源：{source}（只能是 {list(result)}）")
+            result[source] = _as_input_list(items)
+        return result
+
+    return _classify_excel_inputs(as_excel_input(x) for x in inputs)
+
+
+def _classify_excel_inputs(items):
+    """按表头识别每个输入的来源；任何“像但不完整 / 无法区分”的文件汇总后一次性报错"""
+    result = {"IND": [], "NDA": [], "FDA": [], "NMPA": []}
+    problems = []
+
+    for item in items:
+        f = _excel_name(item)
+
+        if f.startswith("~$"):
+            continue
+
+        if not f.lower().endswith(EXCEL_SUFFIXES):
+            print(f"ℹ️ 非 Excel 文件，已忽略：{f}")
+            continue
+
+        try:
+            detected = detect_regulatory_source(item)
+        except Exception as e:
+            problems.append(f"{f}：无法读取表头（{e}）")
+            continue
+
+        source = detected["source"]
+
+        if detected["problem"]:
+            problems.append(f"{f}：{detected['problem']}")
+        elif source is None:
+            print(f"ℹ️ 未识别为任何监管来源，已忽略：{f}")
+        else:
+            result[source].append(item)
+
+    if problems:
+        report = "\n".join(f"   - {p}" for p in problems)
+        raise RegulatoryInputError(f"❌ 监管文件识别失败（尚未开始解析数据）：\n{report}")
+
+    print("✅ 匹配到的监管文件：")
+    for k, v in result.items():
+        if not v:
+            print(f"   {k}: None")
+        for path in v:
+            print(f"   {k}: {path.name if isinstance(path, InMemoryExcel) else path}")
+
+    return result
+
+def _parallel_map(func, items, max_workers=None):
+    """
+    ✅ 多进程并行执行 func(item)，按输入顺序返回结果：
+    - 只有 1 个任务 / max_workers=1 → 直接串行，不起进程池
+    - func 必须是模块顶层函数（需要可 pickle）
+    """
+    items = list(items)
+    if len(items) <= 1 or max_workers == 1:
+        return [func(x) for x in items]
+
+    workers = min(len(items), max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+
+# ===== ✅ 内存中的 Excel：与文件路径一样可以传给所有读取函数 =====
+# name → 显示 / 溯源用的文件名；data → 文件内容 bytes（可 pickle，能直接发给并行读取的子进程）
+InMemoryExcel = namedtuple("InMemoryExcel", ["name", "data"])
+
+
+def as_excel_input(obj, name: str = None):
+    """
+    ✅ 统一输入：
+    - 路径 / InMemoryExcel → 原样返回
+    - bytes / 文件对象（BytesIO、Streamlit 上传文件等）→ InMemoryExcel
+    """
+    if isinstance(obj, (str, os.PathLike, InMemoryExcel)):
+        return obj
+
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return InMemoryExcel(name or "内存文件.xlsx", bytes(obj))
+
+    if hasattr(obj, "getvalue"):
+        data = obj.getvalue()
+    elif hasattr(obj, "read"):
+        if hasattr(obj, "seek"):
+            obj.seek(0)
+        data = obj.read()
+    else:
+        raise TypeError(f"❌ 不支持的输入类型：{type(obj)}")
+
+    name = name or os.path.basename(str(getattr(obj, "name", "") or "")) or "内存文件.xlsx"
+    return InMemoryExcel(name, bytes(data))
+
+
+def _as_input_list(input_path):
+    """单个输入 或 输入列表 → [路径 / InMemoryExcel, ...]"""
+    single = (str, os.PathLike, InMemoryExcel, bytes, bytearray, memoryview)
+    if isinstance(input_path, single) or hasattr(input_path, "read"):
+        return [as_excel_input(input_path)]
+    return [as_excel_input(x) for x in input_path]
+
+
+def _excel_handle(src):
+    """交给 openpyxl / pd.read_excel 的对象：路径原样，内存文件每次给一个新的 BytesIO"""
+    return io.BytesIO(src.data) if isinstance(src, InMemoryExcel) else src
+
+
+def _excel_name(src):
+    return src.name if isinstance(src, InMemoryExcel) else os.path.basename(src)
+
+
+def _is_legacy_excel(src) -> bool:
+    return _excel_name(src).lower().endswith(LEGACY_EXCEL_SUFFIXES)
+
+
+def _legacy_excel_engine(src) -> str:
+    """旧版 .xls 的读取引擎：优先 calamine，其次 xlrd；都没有安装时报错（识别阶段会列为问题文件）"""
+    if python_calamine is not None:
+        return "calamine"
+    if xlrd is not None:
+        return "xlrd"
+    raise ImportError(
+        f"{_excel_name(src)} 是旧版 .xls 文件，需要安装 python-calamine 或 xlrd 才能读取（或另存为 .xlsx）"
+    )
+
+
+def _read_legacy_sheet_headers(input_path):
+    """旧版 .xls：用 pandas 只读每个 Sheet 的第一行"""
+    frames = pd.read_excel(_excel_handle(input_path), sheet_name=None, header=None, nrows=1,
+                           engine=_legacy_excel_engine(input_path))
+    headers = {}
+    for name, df in frames.items():
+        first_row = df.iloc[0].tolist() if len(df) else []
+        cols = ["" if pd.isna(v) else str(v) for v in first_row]
+        while cols and cols[-1] == "":
+            cols.pop()
+        headers[name] = cols
+    return headers
+
+
+def read_sheet_headers(input_path):
+    """
+    ✅ 只读取每个 Sheet 的第一行（表头），不解析数据区：
+    - openpyxl read_only 模式，按需流式读取（旧版 .xls 改用 calamine / xlrd）
+    - 返回 {sheet 名: [列名, ...]}，末尾的空单元格会被去掉
+    - input_path 可以是路径或 InMemoryExcel
+    """
+    if _is_legacy_excel(input_path):
+        return _read_legacy_sheet_headers(input_path)
+
+    wb = load_workbook(_excel_handle(input_path), read_only=True, data_only=True)
+    try:
+        headers = {}
+        for ws in wb.worksheets:
+            first_row = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            cols = ["" if v is None else str(v) for v in first_row]
+            while cols and cols[-1] == "":
+                cols.pop()
+            headers[ws.title] = cols
+        return headers
+    finally:
+        wb.close()
+
+
+def read_sheet_row_counts(input_path):
+    """
+    ✅ 每个 Sheet 的数据行数（不含表头），取自工作表自带的尺寸信息，不解析数据区
+    - 文件没有写尺寸信息时对应的值为 None（旧版 .xls 一律为 None）
+    """
+    if _is_legacy_excel(input_path):
+        return {name: None for name in read_sheet_headers(input_path)}
+
+    wb = load_workbook(_excel_handle(input_path), read_only=True, data_only=True)
+    try:
+        return {
+            ws.title: None if ws.max_row is None else max(ws.max_row - 1, 0)
+            for ws in wb.worksheets
         }
+    finally:
+        wb.close()
+
+
+def find_spillover_sheets(input_path, sheet_name: str):
+    """
+    ✅ 查找超出 Excel 行数上限后自动拆出的续表：
+    - 例如：数据详情 → 数据详情2 / 数据详情3 / 数据详情(4) ...
+    - 只接受与主 Sheet【表头完全一致】的续表，表头不同的会打印提示并跳过
+    - 返回 [主 Sheet, 续表1, 续表2, ...]（按编号排序）
+    """
+    headers = read_sheet_headers(input_path)
+
+    if sheet_name not in headers:
+        # 主 Sheet 都不存在 → 交给 read_excel 抛出原生错误
+        return [sheet_name]
+
+    pattern = re.compile(rf"^{re.escape(sheet_name)}\s*[_\-]?\s*[（(]?(\d+)[)）]?$")
+    base_header = headers[sheet_name]
+
+    spillover = []
+    for s, cols in headers.items():
+        if s == sheet_name:
+            continue
+        m = pattern.match(s.strip())
+        if not m:
+            continue
+        if cols != base_header:
+            print(f"⚠️ Sheet【{s}】名称像续表，但表头与【{sheet_name}】不一致，已跳过")
+            continue
+        spillover.append((int(m.group(1)), s))
+
+    return [sheet_name] + [s for _, s in sorted(spillover)]
+
+
+# ===============================
+# ✅ Excel 读取引擎（配置：rules_config.json → reader）
+# ===============================
+# - openpyxl：pandas 默认引擎，纯 Python，始终可用
+# - calamine：Rust 实现（pip install python-calamine），解析速度快数倍，可选
+# engine = "auto" 时：已安装 calamine 且文件 ≥ calamine_min_bytes 才用 calamine
+# （小文件两者耗时都只有几十毫秒，继续用 openpyxl）
+# 两个引擎读出的 DataFrame 应完全一致，可用 check_reader_parity 对具体文件核对
+# 旧版 .xls 不受 engine 配置影响：固定用 calamine，没有则用 xlrd
+
+EXCEL_READER_ENGINES = ["openpyxl", "calamine"]
+
+
+def _excel_size(src):
+    """文件大小（字节）；文件对象等无法得知时为 None"""
+    if isinstance(src, InMemoryExcel):
+        return len(src.data)
+    if isinstance(src, (str, os.PathLike)):
+        try:
+            return os.path.getsize(src)
+        except OSError:
+            return None
+    return None
+
+
+@lru_cache(maxsize=None)
+def _warn_no_calamine():
+    print("⚠️ rules_config.json 指定了 calamine 读取引擎，但未安装 python-calamine：改用 openpyxl")
+
+
+def excel_reader_engine(src, engine: str = None) -> str:
+    """
+    ✅ 选择 src 的读取引擎（交给 pd.read_excel 的 engine 参数）：
+    engine 为 None 时读 rules_config.json → reader.engine（openpyxl / calamine / auto）
+    """
+    cfg = load_rules_config().get("reader", {})
+    engine = engine or cfg.get("engine", "auto")
+
+    if engine not in EXCEL_READER_ENGINES + ["auto"]:
+        raise ValueError(f"❌ 未知 Excel 读取引擎：{engine}（只能是 openpyxl / calamine / auto）")
+
+    if _is_legacy_excel(src):
+        return _legacy_excel_engine(src)
+    if engine == "openpyxl":
+        return "openpyxl"
+    if python_calamine is None:
+        if engine == "calamine":
+            _warn_no_calamine()
+        return "openpyxl"
+    if engine == "auto":
+        size = _excel_size(src)
+        if size is None or size < cfg.get("calamine_min_bytes", 1048576):
+            return "openpyxl"
+    return "calamine"
+
+
+def check_reader_parity(input_path, sheet_name=None, engines=None) -> dict:
+    """
+    ✅ 用所有可用引擎读取同一文件，核对 DataFrame（值 + 列名 + dtype）是否完全一致：
+    - sheet_name 为 None → 所有 Sheet
+    - 返回 {sheet 名: [差异说明, ...]}，列表为空表示一致；未安装的引擎自动跳过
+    """
+    src = as_excel_input(input_path)
+    engines = [e for e in (engines or EXCEL_READER_ENGINES) if e == "openpyxl" or python_calamine is not None]
+    if len(engines) < 2:
+        print(f"⚠️ 可用的读取引擎只有 {engines}，无法对比")
+        return {}
+
+    sheets = [sheet_name] if sheet_name is not None else list(read_sheet_headers(src))
+    report = {}
+
+    for s in sheets:
+        frames = {e: pd.read_excel(_excel_handle(src), sheet_name=s, engine=e) for e in engines}
+        base_engine, base = engines[0], frames[engines[0]]
+        diffs = []
+
+        for e in engines[1:]:
+            df = frames[e]
+            if list(df.columns) != list(base.columns):
+                diffs.append(f"{e} 列名与 {base_engine} 不同")
+                continue
+            if len(df) != len(base):
+                diffs.append(f"{e} 行数 {len(df)} ≠ {base_engine} 行数 {len(base)}")
+                continue
+            for col in base.columns:
+                if df[col].dtype != base[col].dtype:
+                    diffs.append(f"{e} 列【{col}】dtype {df[col].dtype} ≠ {base[col].dtype}")
+                elif not df[col].equals(base[col]):
+                    diffs.append(f"{e} 列【{col}】取值与 {base_engine} 不同")
+
+        report[s] = diffs
+        status = "✅ 一致" if not diffs else f"❌ {len(diffs)} 处差异"
+        print(f"🔍 {_excel_name(src)} / {s}（{' vs '.join(engines)}）：{status}")
+        for d in diffs:
+            print(f"    - {d}")
+
+    return report
+
+
+# 读取时追加的溯源列（配置：rules_config.json → provenance_columns，默认关闭）
+# 打开后会一路带到 *_结果.xlsx / 明细缓存 / 历史库；源表已有同名列时不覆盖
+PROVENANCE_COLUMNS = ["来源文件", "来源Sheet"]
+
+
+def _add_provenance_columns(tasks, frames):
+    """给每个 (文件, Sheet) 的 DataFrame 追加溯源列；任何一个源表已有同名列时，该溯源列整体不追加"""
+    existing = [c for c in PROVENANCE_COLUMNS if any(c in f.columns for f in frames)]
+    for col in existing:
+        print(f"⚠️ 源表已有列【{col}】，不追加同名溯源列（保留原值）")
+
+    for (path, s, *_), f in zip(tasks, frames):
+        for col, value in zip(PROVENANCE_COLUMNS, [_excel_name(path), s]):
+            if col not in existing:
+                f[col] = value
+
+
+def _read_one_sheet(task):
+    """并行读取用的顶层函数：task = (文件路径, sheet 名, 需要的列 或 None, 最多读取行数 或 None, 读取引擎)"""
+    input_path, sheet_name, usecols, nrows, engine = task
+    if usecols is None:
+        return pd.read_excel(_excel_handle(input_path), sheet_name=sheet_name, nrows=nrows, engine=engine)
+
+    wanted = set(usecols)
+    return pd.read_excel(
+        _excel_handle(input_path), sheet_name=sheet_name, usecols=lambda c: c in wanted, nrows=nrows, engine=engine
+    )
+
+
+def read_excel_with_spillover(input_path, sheet_name: str, max_workers=None, usecols=None):
+    """
+    ✅ 读取一个或多个文件的主 Sheet + 所有同表头续表：
+    - input_path 可以是单个路径，也可以是路径列表（同一来源的多份导出）；
+      bytes / 文件对象 / InMemoryExcel 同样可以（见 as_excel_input）
+    - 所有 (文件, Sheet) 并行解析，再按文件顺序纵向拼接（在去重之前）
+    - rules_config.json → provenance_columns 为 true 时追加溯源列【来源文件】【来源Sheet】，
+      方便追查每一行来自哪里（源表已有同名列时不覆盖）
+    - usecols：只解析这些列（不存在的列自动忽略），见 plan_source_columns
+    - 处于 sample_reads(...) 中时只读取每个 (文件, Sheet) 的前若干行，见 preview_inputs
+    """
+    input_paths = _as_input_list(input_path)
+    sample = _READ_SAMPLE.get()
+    provenance = bool(load_rules_config().get("provenance_columns", False))
+
+    # ✅ 已被 preload_inputs 提前解析过（内容一致）→ 直接返回副本
+    cached = _parse_cache_get(input_paths, sheet_name, usecols, provenance) if sample is None else None
+    if cached is not None:
+        print(f"⚡ 【{sheet_name}】已提前解析，直接使用（{len(cached)} 行）")
+        return cached.copy()
+
+    tasks = []
+    for path in input_paths:
+        sheets = find_spillover_sheets(path, sheet_name)
+        if len(sheets) > 1:
+            print(f"📑 {_excel_name(path)} 检测到续表：{sheets[1:]}，将与【{sheet_name}】并行读取后合并")
+        # ✅ 引擎在主进程中选好再发给子进程（config_overrides 不会传到子进程）
+        engine = excel_reader_engine(path)
+        if engine != "openpyxl":
+            print(f"⚡ {_excel_name(path)} 使用 {engine} 引擎读取")
+        tasks.extend((path, s, usecols, None, engine) for s in sheets)
+
+    if len(input_paths) > 1:
+        print(f"📂 同一来源共 {len(input_paths)} 个文件，将并行读取后合并")
+
+    if sample is not None:
+        # ✅ 抽样：按 (文件, Sheet) 分层，每层读取相同的行数
+        nrows = -(-sample["rows"] // len(tasks))
+        tasks = [(path, s, cols, nrows, engine) for path, s, cols, _, engine in tasks]
+        print(f"🔎 抽样预览：【{sheet_name}】每个 Sheet 最多读取 {nrows} 行")
+
+    frames = _parallel_map(_read_one_sheet, tasks, max_workers=max_workers)
+
+    if sample is not None:
+        row_counts = {id(path): read_sheet_row_counts(path) for path in input_paths}
+        totals = [row_counts[id(path)].get(s) for path, s, *_ in tasks]
+        sampled = sum(len(f) for f in frames)
+        sample["reads"].append({
+            "sheet": sheet_name,
+            "sampled": sampled,
+            "total": None if None in totals else max(sum(totals), sampled)
+        })
+
+    if provenance:
+        _add_provenance_columns(tasks, frames)
+
+    if len(tasks) > 1:
+        for (path, s, *_), f in zip(tasks, frames):
+            print(f"    📌 {_excel_name(path)} / {s} 行数：{len(f)}")
+
+    if len(frames) == 1:
+        return frames[0]
+
+    return pd.concat(frames, ignore_index=True)
+
+
+# ===== ✅ 规则 / 模板的内存覆盖（只作用于当前线程 / 上下文，见 config_overrides）=====
+_CONFIG_OVERRIDES = contextvars.ContextVar("config_overrides", default={})
+
+
+@contextmanager
+def config_overrides(rules: dict = None, template: dict = None):
+    """
+    ✅ 在 with 块内用内存中的 dict 代替 rules_config.json / template_columns.json：
+        with config_overrides(rules=my_rules):
+            run_fda_pipeline(...)
+    不传（None）的一项仍然读取文件
+    """
+    current = dict(_CONFIG_OVERRIDES.get())
+    if rules is not None:
+        current["rules"] = rules
+    if template is not None:
+        current["template"] = template
+
+    token = _CONFIG_OVERRIDES.set(current)
+    try:
+        yield
+    finally:
+        _CONFIG_OVERRIDES.reset(token)
+
+
+# ===== ✅ 抽样读取（只作用于当前线程 / 上下文，见 sample_reads / preview_inputs）=====
+_READ_SAMPLE = contextvars.ContextVar("read_sample", default=None)
+
+
+@contextmanager
+def sample_reads(rows: int):
+    """
+    ✅ with 块内 read_excel_with_spillover 只读取前 rows 行（按 (文件, Sheet) 平均分配）
+    yield 一个 dict，"reads" 中记录每次读取的 {sheet, sampled, total}（total 未知为 None）
+    """
+    sample = {"rows": int(rows), "reads": []}
+    token = _READ_SAMPLE.set(sample)
+    try:
+        yield sample
+    finally:
+        _READ_SAMPLE.reset(token)
+
+
+# ===============================
+# ✅ 提前解析（上传后后台解析，点击运行时直接复用）
+# ===============================
+# 缓存键 = (文件名 + 大小 + 内容 sha1, Sheet, usecols, 是否追加溯源列)：同一份内容无论来自上传的 bytes
+# 还是保存到季度目录后的文件，都能命中。只有 preload_inputs 会写入缓存；
+# 读取时先按 (文件名, 大小) 粗筛，没有候选就不计算哈希（缓存非空时也不会给每次读取都加一遍 sha1）。
+# 缓存份数：rules_config.json → preload.cache_max_entries
+
+_PARSE_CACHE = OrderedDict()
+_PARSE_CACHE_LOCK = threading.Lock()
+
+
+def _content_digest(src):
+    """InMemoryExcel / 路径 → (文件名, 大小, 内容 sha1)"""
+    h = hashlib.sha1()
+    if isinstance(src, InMemoryExcel):
+        h.update(src.data)
+    else:
+        with open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return _excel_name(src), _excel_size(src), h.hexdigest()
+
+
+def _parse_cache_key(input_paths, sheet_name: str, usecols=None, provenance: bool = False):
+    return (
+        tuple(_content_digest(p) for p in input_paths),
+        sheet_name,
+        None if usecols is None else tuple(usecols),
+        provenance
+    )
+
+
+def _parse_cache_get(input_paths, sheet_name: str, usecols=None, provenance: bool = False):
+    """查提前解析的缓存；(文件名, 大小) 与任何缓存项都对不上时直接返回 None，不读文件内容"""
+    rest = (sheet_name, None if usecols is None else tuple(usecols), provenance)
+    sizes = tuple((_excel_name(p), _excel_size(p)) for p in input_paths)
+
+    with _PARSE_CACHE_LOCK:
+        maybe = any(
+            key[1:] == rest and tuple(f[:2] for f in key[0]) == sizes
+            for key in _PARSE_CACHE
+        )
+    if not maybe:
+        return None
+
+    key = _parse_cache_key(input_paths, sheet_name, usecols, provenance)
+    with _PARSE_CACHE_LOCK:
+        return _PARSE_CACHE.get(key)
+
+
+def preload_inputs(inputs, column_projection: bool = None, max_workers=1):
+    """
+    ✅ 提前解析：按表头识别来源后，用与流水线完全相同的 Sheet / usecols 读取并放入缓存
+    - inputs：同 match_regulatory_inputs（上传文件列表 / {来源: 文件}）
+    - 之后的 run_all_pipelines_and_save_intermediate / run_all_in_memory 读取同样内容时直接命中
+    - 缓存最多保留 preload.cache_max_entries 份，先进先出
+    - 默认 max_workers=1 串行读取：通常在后台线程中调用（Streamlit），不在线程里起进程池
+    返回 {来源: 行数}
+    """
+    file_map = match_regulatory_inputs(inputs)
+    rules = load_rules_config()
+    provenance = bool(rules.get("provenance_columns", False))
+    max_entries = rules.get("preload", {}).get("cache_max_entries", 8)
+
+    loaded = {}
+    for source, files in file_map.items():
+        if not files:
+            continue
+
+        sheet_name = SOURCE_SIGNATURES[source]["sheet_name"]
+        usecols = _planned_usecols(source, column_projection)
+        df = read_excel_with_spillover(files, sheet_name, max_workers=max_workers, usecols=usecols)
+
+        key = _parse_cache_key(files, sheet_name, usecols, provenance)
+        with _PARSE_CACHE_LOCK:
+            _PARSE_CACHE[key] = df
+            _PARSE_CACHE.move_to_end(key)
+            while len(_PARSE_CACHE) > max_entries:
+                _PARSE_CACHE.popitem(last=False)
+
+        loaded[source] = len(df)
+        print(f"⚡ {source} 已提前解析：{len(df)} 行")
+
+    return loaded
+
+
+def clear_parse_cache():
+    """✅ 清空提前解析的缓存"""
+    with _PARSE_CACHE_LOCK:
+        _PARSE_CACHE.clear()
+
+
+def load_rules_config(config_path: str = None):
+    """
+    ✅ 读取规则配置 rules_config.json（默认：程序同级目录）
+    ✅ 处于 config_overrides(rules=...) 中时直接返回内存中的规则（副本）
+    """
+    if config_path is None and "rules" in _CONFIG_OVERRIDES.get():
+        return copy.deepcopy(_CONFIG_OVERRIDES.get()["rules"])
+
+    if config_path is None:
+        config_path = os.path.join(get_base_dir(), "rules_config.json")
+
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"❌ 找不到规则配置文件：{config_path}")
+
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_dedup_rule(source: str, rules: dict = None):
+    """
+    ✅ 从 rules_config.json 的 dedup_rules 中取某个来源的去重规则：
+        keys     → 去重键
+        order_by → 判断“最新”的列（null 表示按文件顺序）
+        keep     → "last" 保留 order_by 最大的一条 / "first" 保留最小的一条
+    """
+    rules = rules if rules is not None else load_rules_config()
+    dedup_rules = rules.get("dedup_rules", {})
+
+    if source not in dedup_rules:
+        raise KeyError(f"❌ rules_config.json 的 dedup_rules 中没有来源：{source}")
+
+    return dedup_rules[source]
+
+
+# ===============================
+# ✅ 计算后端（配置：rules_config.json → backend）
+# ===============================
+# 去重分组、分类映射、统计计数、文本 / 日期规范化都建立在两个底层操作上：
+#   factorize(列)         → (codes, uniques)：按首次出现顺序编号，空值为 -1（同 pd.factorize）
+#   group_codes(df, keys) → 每行的分组编号：首次出现顺序，空值也算一组（同 groupby(sort=False, dropna=False).ngroup()）
+# 后端只替换这两步（以及基于它们的 left_join），选保留行、bincount、Top-K、Total 等都是共用的 numpy 代码，
+# 所以换后端不会改变任何输出。
+#   "pandas" → pd.factorize / groupby.ngroup（默认）
+#   "arrow"  → pyarrow.compute.dictionary_encode：按块多线程编码再合并字典（需要安装 pyarrow；
+#              只接管纯文本列，数字 / 日期 / 混合类型的列仍交给 pandas）
+#   "auto"   → 安装了 pyarrow 且行数 ≥ arrow_min_rows 时用 arrow，否则 pandas
+
+ARROW_CHUNK_ROWS = 1 << 17
+
+
+class PandasBackend:
+    name = "pandas"
+
+    def factorize(self, col: pd.Series):
+        return pd.factorize(col, use_na_sentinel=True)
+
+    def group_codes(self, df: pd.DataFrame, keys: list) -> np.ndarray:
+        return df.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+
+    def left_join(self, df: pd.DataFrame, right: pd.DataFrame, keys: list) -> pd.DataFrame:
+        return df.merge(right, on=keys, how="left")
+
+
+class ArrowBackend(PandasBackend):
+    name = "arrow"
+
+    def __init__(self, chunk_rows: int = ARROW_CHUNK_ROWS, max_workers: int = None):
+        self.chunk_rows = chunk_rows
+        self.max_workers = max_workers
+
+    def factorize(self, col: pd.Series):
+        try:
+            arr = pa.array(col, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return super().factorize(col)
+        if isinstance(arr, pa.ChunkedArray):
+            arr = arr.combine_chunks()
+        if not (pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type)):
+            return super().factorize(col)
+
+        # ✅ 每块各自编码（pyarrow 计算时释放 GIL，可以多线程）；单核 / 小列直接整列编码
+        workers = self.max_workers or os.cpu_count() or 1
+        if workers == 1 or len(arr) <= self.chunk_rows:
+            encoded = [pc.dictionary_encode(arr)]
+        else:
+            chunks = [arr.slice(i, self.chunk_rows) for i in range(0, len(arr), self.chunk_rows)]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                encoded = list(executor.map(pc.dictionary_encode, chunks))
+
+        # ✅ 合并字典：各块字典按块顺序拼接后再编码一次，顺序即全局首次出现顺序
+        merged = pc.dictionary_encode(pa.concat_arrays([e.dictionary for e in encoded]))
+        remap = merged.indices.to_numpy().astype("int64")
+
+        codes = np.empty(len(arr), dtype="int64")
+        offset, start = 0, 0
+        for e in encoded:
+            local = pc.fill_null(e.indices, -1).to_numpy().astype("int64")
+            part = codes[start:start + len(local)]
+            part[:] = -1
+            hit = local >= 0
+            part[hit] = remap[offset + local[hit]]
+            offset += len(e.dictionary)
+            start += len(local)
+
+        return codes, pd.Index(merged.dictionary.to_pylist(), dtype=col.dtype)
+
+    def group_codes(self, df: pd.DataFrame, keys: list) -> np.ndarray:
+        # 逐列编码后两两组合（空值 -1 → 0，作为单独一组），组合后的整数再按首次出现编号
+        codes = np.zeros(len(df), dtype="int64")
+        for key in keys:
+            key_codes, uniques = self.factorize(df[key])
+            codes = codes * (len(uniques) + 1) + (key_codes + 1)
+            codes = pd.factorize(codes)[0]
+        return codes
+
+    def left_join(self, df: pd.DataFrame, right: pd.DataFrame, keys: list) -> pd.DataFrame:
+        extra = [c for c in right.columns if c not in keys]
+        if right.duplicated(keys).any() or any(c in df.columns for c in extra):
+            return super().left_join(df, right, keys)
+
+        both = pd.concat([df[keys], right[keys]], ignore_index=True)
+        codes = self.group_codes(both, keys)
+        left_codes, right_codes = codes[:len(df)], codes[len(df):]
+
+        lookup = np.full(codes.max() + 1 if len(codes) else 0, -1, dtype="int64")
+        lookup[right_codes] = np.arange(len(right))
+        pos = lookup[left_codes]
+
+        out = df.reset_index(drop=True)
+        for c in extra:
+            out[c] = right[c].reset_index(drop=True).reindex(pos).set_axis(out.index)
+        return out
+
+
+_PANDAS_BACKEND = PandasBackend()
+
+
+@lru_cache(maxsize=None)
+def _arrow_backend():
+    return ArrowBackend()
+
+
+@lru_cache(maxsize=None)
+def _warn_no_pyarrow():
+    print("⚠️ rules_config.json 指定了 arrow 计算后端，但未安装 pyarrow：改用 pandas")
+
+
+def get_backend(n_rows: int = None, engine: str = None):
+    """
+    ✅ 选择计算后端：engine 为 None 时读 rules_config.json → backend.engine
+    "auto" 时只有 n_rows ≥ backend.arrow_min_rows 才用 arrow（小表的线程 / 转换开销不划算）
+    """
+    cfg = load_rules_config().get("backend", {})
+    engine = engine or cfg.get("engine", "pandas")
+
+    if engine not in ["pandas", "arrow", "auto"]:
+        raise ValueError(f"❌ 未知计算后端：{engine}（只能是 pandas / arrow / auto）")
+
+    if engine == "pandas":
+        return _PANDAS_BACKEND
+    if pa is None:
+        if engine == "arrow":
+            _warn_no_pyarrow()
+        return _PANDAS_BACKEND
+    if engine == "auto" and n_rows is not None and n_rows < cfg.get("arrow_min_rows", 200000):
+        return _PANDAS_BACKEND
+    return _arrow_backend()
+
+
+def _dedup_order_key(col: pd.Series) -> np.ndarray:
+    """
+    把 order_by 列转成可比较的 int64：
+    - 日期列：直接取纳秒整数，NaT 视为最大（与 sort_values 的 na_position='last' 一致）
+    - 其他列：按值做稠密排名，空值同样排在最后
+    """
+    if pd.api.types.is_datetime64_any_dtype(col):
+        values = col.to_numpy(dtype="datetime64[ns]").view("int64").copy()
+        values[col.isna().to_numpy()] = np.iinfo("int64").max
+        return values
+
+    return col.rank(method="dense", na_option="bottom").to_numpy(dtype="int64")
+
+
+def dedup_by_keys(
+    df: pd.DataFrame,
+    keys: list,
+    order_by: str = None,
+    keep: str = "last",
+    audit: bool = False,
+    key_df: pd.DataFrame = None
+):
+    """
+    ✅ 通用精确去重引擎（IND / NDA / NMPA / FDA 共用）：
+    1）按 keys 做哈希分组（计算后端的 group_codes，线性时间）
+       key_df 给定时按 key_df[keys] 分组（如公司名去后缀后的比较键，见 dedup_match_keys），
+       输出仍是 df 的原始行
+    2）每组选出一条保留行：
+        - keep="last"  → order_by 最大的一条，平局取文件中靠后的一条
+        - keep="first" → order_by 最小的一条，平局取文件中靠前的一条
+        - order_by=None → 直接按文件顺序取最后 / 第一条
+    3）只对“保留行号”排序（不排序整张宽表），最后 take 一次
+    ✅ 输出顺序：有 order_by 时按 order_by 升序，否则保持文件顺序
+    ✅ audit=True 时额外返回审计表：被删除的行 + 替代它们的保留行
+    返回 (去重后 df, 审计表 或 None)
+    """
+    if keep not in ["first", "last"]:
+        raise ValueError("❌ keep 只能是 'first' 或 'last'")
+
+    n = len(df)
+    positions = np.arange(n)
+    codes = get_backend(n).group_codes(df if key_df is None else key_df, keys)
+
+    order = positions if order_by is None else _dedup_order_key(df[order_by])
+    order_s = pd.Series(order, index=positions)
+
+    if keep == "last":
+        # 倒序后 idxmax 取到的是“最后一次出现”的最大值
+        winners = order_s.iloc[::-1].groupby(codes[::-1], sort=False).idxmax()
+    else:
+        winners = order_s.groupby(codes, sort=False).idxmin()
+
+    winner_pos = winners.to_numpy()
+    winner_pos = winner_pos[np.lexsort((winner_pos, order[winner_pos]))]
+
+    df_out = df.take(winner_pos).reset_index(drop=True)
+
+    if not audit:
+        return df_out, None
+
+    # ===== 审计表：每组“保留行”在前，“删除行”在后 =====
+    winner_of_code = np.zeros(codes.max() + 1 if n else 0, dtype="int64")
+    winner_of_code[winners.index.to_numpy()] = winners.to_numpy()
+
+    is_kept = np.zeros(n, dtype=bool)
+    is_kept[winner_pos] = True
+    touched = np.unique(codes[~is_kept])
+    rows = positions[np.isin(codes, touched)]
+    rows = rows[np.lexsort((rows, ~is_kept[rows], codes[rows]))]
+
+    audit_df = df.take(rows).reset_index(drop=True)
+    audit_df.insert(0, "审计_状态", np.where(is_kept[rows], "保留", "删除"))
+    audit_df.insert(1, "审计_原始行号", rows + 1)
+    audit_df.insert(2, "审计_保留行号", winner_of_code[codes[rows]] + 1)
+
+    return df_out, audit_df
+
+
+def _save_dedup_audit(audit_df, audit_path):
+    """审计表中有删除记录时，保存为单独的 xlsx"""
+    if audit_path is None or audit_df is None:
+        return
+
+    n_dropped = int((audit_df["审计_状态"] == "删除").sum())
+    if n_dropped == 0:
+        print("ℹ️ 没有被去重删除的记录，不生成审计表")
+        return
+
+    audit_df.to_excel(audit_path, index=False)
+    print(f"🧾 去重审计表已保存（删除 {n_dropped} 条）：{audit_path}")
+
+
+def _dedup_audit_path(output_file: str, dedup_audit: bool = None):
+    """流水线用：根据开关（None → 读配置 dedup_audit）生成审计表路径；output_file=None（纯内存）不生成"""
+    if output_file is None:
+        return None
+
+    if dedup_audit is None:
+        dedup_audit = bool(load_rules_config().get("dedup_audit", False))
+
+    if not dedup_audit:
+        return None
+
+    return os.path.splitext(output_file)[0] + "_去重审计.xlsx"
+
+
+def company_suffix_keys(suffixes) -> list:
+    """公司后缀 → NFKC + casefold，按长度从长到短（先匹配 Co., Ltd. 再匹配 Ltd.）"""
+    return sorted(
+        {unicodedata.normalize("NFKC", s).casefold() for s in suffixes if s},
+        key=len,
+        reverse=True
+    )
+
+
+def strip_company_suffixes(text: str, suffixes) -> str:
+    """
+    ✅ 反复去掉末尾的公司后缀（suffixes 需先经 company_suffix_keys 处理；匹配不区分大小写，
+    text 其余部分保持原样）：
+    - 中文后缀（有限公司 / 集团 ...）直接匹配
+    - 含英文字母的后缀（Inc / Co., Ltd. ...）前面必须是空白 / 逗号 / 句点，避免 Zinc → Z
+    - 去掉后缀后顺带去掉末尾残留的分隔符（空白 , . & - 等）；去完为空时不去
+    """
+    changed = True
+    while changed and text:
+        changed = False
+        folded = text.casefold()
+        for suffix in suffixes:
+            if not folded.endswith(suffix) or len(text) <= len(suffix):
+                continue
+            head = text[: len(text) - len(suffix)]
+            if re.search(r"[a-z]", suffix) and not re.search(r"[\s,.]$", head):
+                continue
+            head = head.rstrip(" ,.，、&-")
+            if head:
+                text = head
+                changed = True
+                break
+
+    return text
+
+
+def normalize_match_key(value, suffixes=()):
+    """
+    ✅ 生成用于“近似重复”比对的归一化键：
+    - NFKC：全角 → 半角（ＡＢＣ → ABC、（）→ ()）
+    - 忽略大小写
+    - 反复去掉末尾的公司后缀（有限公司 / Co., Ltd. / Inc. ...，按词边界，见 strip_company_suffixes）
+    - 最后再去掉空白和标点（必须在去后缀之后，否则 Zinc → z）
+    suffixes 需先经 company_suffix_keys 处理
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NA:
+        return ""
+
+    key = unicodedata.normalize("NFKC", str(value)).casefold().strip()
+    key = strip_company_suffixes(key, suffixes)
+    return re.sub(r"[\s\W_]+", "", key)
+
+
+def _normalize_column(col: pd.Series, suffixes=()) -> np.ndarray:
+    """只对唯一值做归一化，再按编码映射回整列"""
+    codes, uniques = get_backend(len(col)).factorize(col)
+    normalized = [normalize_match_key(u, suffixes) for u in uniques] + [""]
+    return np.asarray(normalized, dtype=object)[codes]
+
+
+def find_near_duplicate_clusters(
+    df: pd.DataFrame,
+    block_cols: list,
+    fuzzy_col: str,
+    suffixes=(),
+    threshold: float = 0.9,
+    max_block_size: int = 200
+) -> np.ndarray:
+    """
+    ✅ 分块（blocking）近似重复识别：
+    1）block_cols 归一化后完全相同的行放进同一个块（如：通用名 + 剂型）
+    2）块内对 fuzzy_col（如持证商）的不同归一化取值两两比较相似度，>= threshold 归为一簇
+    3）只在块内比较，整体开销接近线性；块内取值超过 max_block_size 时只做归一化精确匹配
+    返回每一行的簇编号（同簇 = 近似重复）
+    """
+    norm_suffixes = company_suffix_keys(suffixes)
+
+    keys = pd.DataFrame({
+        f"_b{i}": _normalize_column(df[c]) for i, c in enumerate(block_cols)
+    })
+    keys["_h"] = _normalize_column(df[fuzzy_col], norm_suffixes)
+
+    keys["_block"] = keys.groupby(list(keys.columns[:-1]), sort=False).ngroup()
+    pair_id = keys.groupby(["_block", "_h"], sort=False).ngroup().to_numpy()
+
+    pairs = keys[["_block", "_h"]].assign(_pair=pair_id).drop_duplicates("_pair")
+    parent = np.arange(pair_id.max() + 1 if len(pair_id) else 0)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for block, grp in pairs.groupby("_block", sort=False):
+        if len(grp) < 2:
+            continue
+        if len(grp) > max_block_size:
+            print(f"⚠️ 近似查重：块内取值 {len(grp)} 个，超过上限 {max_block_size}，该块只做精确匹配")
+            continue
+
+        names = grp["_h"].tolist()
+        ids = grp["_pair"].tolist()
+        for i in range(len(names)):
+            for j in range(i + 1, len(names)):
+                if not names[i] or not names[j]:
+                    continue
+                matcher = SequenceMatcher(None, names[i], names[j])
+                if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+                    continue
+                if matcher.ratio() >= threshold:
+                    parent[find(ids[i])] = find(ids[j])
+
+    return np.array([find(i) for i in pair_id], dtype="int64")
+
+
+def near_dedup(
+    df: pd.DataFrame,
+    source: str,
+    report_path: str = None,
+    rules: dict = None
+):
+    """
+    ✅ 精确去重之后的“近似重复”处理（配置：rules_config.json → near_dedup）：
+    - 分块键 = 该来源去重键中除持证商以外的列；持证商做相似度比对
+    - 找到的簇写入报告（report_path），并打印簇数量
+    - merge_policy：
+        "report" → 只出报告，不改数据
+        "merge"  → 每簇按该来源的去重规则只保留一条
+    """
+    rules = rules if rules is not None else load_rules_config()
+    cfg = rules.get("near_dedup", {})
+    rule = get_dedup_rule(source, rules)
+
+    holder_col = cfg.get("holder_cols", {}).get(source)
+    if holder_col is None or holder_col not in df.columns:
+        print(f"⚠️ 近似查重：{source} 未配置或缺少持证商列【{holder_col}】，已跳过")
+        return df
+
+    block_cols = [c for c in rule["keys"] if c != holder_col]
+    cluster = find_near_duplicate_clusters(
+        df,
+        block_cols=block_cols,
+        fuzzy_col=holder_col,
+        suffixes=rules.get("company_suffixes", []),
+        threshold=cfg.get("holder_similarity", 0.9),
+        max_block_size=cfg.get("max_block_size", 200)
+    )
+
+    sizes = pd.Series(cluster).map(pd.Series(cluster).value_counts()).to_numpy()
+    in_cluster = sizes > 1
+    n_clusters = len(np.unique(cluster[in_cluster]))
+
+    if n_clusters == 0:
+        print("✅ 近似查重：未发现近似重复记录")
+        return df
+
+    print(f"🔎 近似查重：发现 {n_clusters} 个近似重复簇，涉及 {int(in_cluster.sum())} 行")
+
+    if report_path is not None:
+        report = df[in_cluster].copy()
+        report.insert(0, "近似簇编号", pd.factorize(cluster[in_cluster])[0] + 1)
+        report = report.sort_values("近似簇编号", kind="stable")
+        report.to_excel(report_path, index=False)
+        print(f"🧾 近似重复报告已保存：{report_path}")
+
+    policy = cfg.get("merge_policy", "report")
+    if policy == "report":
+        return df
+    if policy != "merge":
+        raise ValueError(f"❌ near_dedup.merge_policy 只能是 'report' 或 'merge'，当前：{policy}")
+
+    order_by = rule["order_by"] if rule["order_by"] in df.columns else None
+    merged, _ = dedup_by_keys(
+        df.assign(_近似簇=cluster), ["_近似簇"], order_by=order_by, keep=rule["keep"]
+    )
+    print(f"✅ 近似查重（merge）：{len(df)} → {len(merged)} 行")
+
+    return merged.drop(columns=["_近似簇"])
+
+
+def _near_dedup_report_path(output_file: str, near_dedup_enabled: bool = None):
+    """
+    流水线用：根据开关（None → 读配置 near_dedup.enabled）生成近似重复报告路径
+    - 未启用 → None（step1 跳过近似查重）
+    - 启用但 output_file=None（纯内存）→ ""（照常查重 / 合并，只是不写报告）
+    """
+    if near_dedup_enabled is None:
+        near_dedup_enabled = bool(load_rules_config().get("near_dedup", {}).get("enabled", False))
+
+    if not near_dedup_enabled:
+        return None
+
+    if output_file is None:
+        return ""
+
+    return os.path.splitext(output_file)[0] + "_近似重复.xlsx"
+
+
+# ===== ✅ 日期解析：按“唯一值”逐一识别类型，再按格式批量转换 =====
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%Y/%m/%d",
+    "%Y.%m.%d",
+    "%Y%m%d",
+    "%Y年%m月%d日",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y/%m/%d %H:%M",
+]
+
+# Excel 序列号的合法范围：1900-01-01 ~ 9999-12-31
+EXCEL_SERIAL_MIN = 1
+EXCEL_SERIAL_MAX = 2958465
+EXCEL_EPOCH = "1899-12-30"
+
+
+def _excel_serial_or_none(value):
+    """数字 / 纯数字文本 → Excel 序列号（float），否则返回 None"""
+    if isinstance(value, (bool, np.bool_)):
+        return None
+
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        number = float(value)
+    elif isinstance(value, str) and re.fullmatch(r"\d{1,7}(\.\d+)?", value):
+        # 8 位纯数字更可能是 20250131 这种日期，交给格式解析
+        if len(value.split(".")[0]) == 8:
+            return None
+        number = float(value)
+    else:
+        return None
+
+    if np.isnan(number) or not (EXCEL_SERIAL_MIN <= number <= EXCEL_SERIAL_MAX):
+        return None
+
+    return number
+
+
+def parse_date_column(col: pd.Series, col_name: str = None):
+    """
+    ✅ 快速日期规范化（替代 pd.to_datetime(errors="coerce") 的逐元素回退）：
+    1）只处理唯一值（重复的日期文本只转换一次，结果按编码映射回整列）
+    2）datetime / Timestamp → 直接使用
+    3）Excel 序列号（数字或纯数字文本）→ 向量化换算（1899-12-30 + N 天）
+    4）文本 → 依次尝试 DATE_FORMATS 中的固定格式批量解析，剩余的才走通用解析
+    5）打印各类型数量和解析失败数
+    返回 (datetime64 Series, 解析失败的非空值个数)
+    """
+    col_name = col_name or col.name
+
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col, 0
+
+    codes, uniques = get_backend(len(col)).factorize(col)
+    uniques = list(uniques)
+    parsed = pd.Series(pd.NaT, index=range(len(uniques)), dtype="datetime64[ns]")
+
+    direct, serials, texts = {}, {}, {}
+    for i, v in enumerate(uniques):
+        if isinstance(v, (pd.Timestamp, np.datetime64)) or hasattr(v, "year"):
+            direct[i] = v
+            continue
+        serial = _excel_serial_or_none(v.strip() if isinstance(v, str) else v)
+        if serial is not None:
+            serials[i] = serial
+        elif isinstance(v, str) and v.strip():
+            texts[i] = v.strip()
+
+    if direct:
+        parsed[list(direct)] = pd.to_datetime(list(direct.values()), errors="coerce")
+
+    if serials:
+        parsed[list(serials)] = pd.to_datetime(
+            np.fromiter(serials.values(), dtype="float64"), unit="D", origin=EXCEL_EPOCH
+        )
+
+    matched_formats = []
+    remaining = pd.Series(texts, dtype=object)
+    for fmt in DATE_FORMATS:
+        if remaining.empty:
+            break
+        hit = pd.to_datetime(remaining, format=fmt, errors="coerce")
+        ok = hit.notna()
+        if ok.any():
+            matched_formats.append(fmt)
+            parsed[hit.index[ok]] = hit[ok]
+            remaining = remaining[~ok]
+
+    if not remaining.empty:
+        try:
+            hit = pd.to_datetime(remaining, errors="coerce", format="mixed")
+        except (TypeError, ValueError):
+            hit = remaining.map(lambda v: pd.to_datetime(v, errors="coerce"))
+        parsed[hit.index] = hit
+
+    # 末尾追加 NaT：编码 -1（空值）映射到它；整列为空（没有唯一值）时同样成立
+    values = np.append(parsed.to_numpy(), np.datetime64("NaT", "ns"))
+    result = pd.Series(values[codes], index=col.index, name=col.name)
+
+    n_failed = int((result.isna() & (codes != -1)).sum())
+
+    print(
+        f"📅 日期列【{col_name}】解析：日期 {len(direct)} 种 / Excel 序列号 {len(serials)} 种 / "
+        f"文本 {len(texts)} 种（命中格式：{matched_formats or '无'}）"
+    )
+    if n_failed:
+        print(f"⚠️ 日期列【{col_name}】有 {n_failed} 个非空值无法解析，已置为空")
+
+    return result, n_failed
+
+
+def _canonical_text(value, sentinels):
+    """单个取值的规范化：NFKC（全角→半角）+ 去首尾空白 + 占位符转空值"""
+    if not isinstance(value, str):
+        return value
+
+    text = unicodedata.normalize("NFKC", value).strip()
+    if text in sentinels:
+        return np.nan
+
+    return text
+
+
+def canonicalize_text_columns(df: pd.DataFrame, rules: dict = None) -> pd.DataFrame:
+    """
+    ✅ 读取后统一执行一次的文本规范化（配置：rules_config.json → text_cleaning）：
+    - "" / "nan" / "NaN" / "None" 等占位符 → 真正的空值
+    - 去首尾空白，NFKC 规范化（全角 → 半角）
+    ✅ 每列只处理唯一值，再按编码映射回整列；之后各步骤直接用 isna() 判断空值
+    ✅ 公司名保留原值导出；去公司后缀只用于去重比较，见 dedup_match_keys
+    ⚠️ 原地修改 df 的文本列，并返回 df
+    """
+    rules = rules if rules is not None else load_rules_config()
+    sentinels = set(rules.get("text_cleaning", {}).get("na_sentinels", ["", "nan", "NaN", "None"]))
+
+    backend = get_backend(len(df))
+    for c in df.columns:
+        col = df[c]
+        if not (pd.api.types.is_object_dtype(col) or pd.api.types.is_string_dtype(col)):
+            continue
+
+        codes, uniques = backend.factorize(col)
+        cleaned = [_canonical_text(u, sentinels) for u in uniques] + [np.nan]
+        df[c] = np.asarray(cleaned, dtype=object)[codes]
+
+    return df
+
+
+def dedup_match_keys(df: pd.DataFrame, keys: list, rules: dict = None):
+    """
+    ✅ 去重比较用的键列（交给 dedup_by_keys 的 key_df）：
+    - text_cleaning.trim_company_suffixes 打开时，company_cols 中的公司名比较前
+      去掉末尾公司后缀（按词边界，见 strip_company_suffixes）
+    - 其他键列原样比较
+    - 没有需要处理的列时返回 None（直接按 df[keys] 比较）
+    """
+    rules = rules if rules is not None else load_rules_config()
+    cfg = rules.get("text_cleaning", {})
+    if not cfg.get("trim_company_suffixes", False):
+        return None
+
+    company_cols = [c for c in keys if c in set(cfg.get("company_cols", []))]
+    if not company_cols:
+        return None
 
-        results["FDA"] = df_fda
-    else:
-        print("⚠️ 未找到 FDA 文件，已跳过")
+    suffixes = company_suffix_keys(rules.get("company_suffixes", []))
+    backend = get_backend(len(df))
+    key_df = df[keys].copy()
 
-    # =============================
-    # ✅ 5️⃣ NMPA
-    # =============================
-    if nmpa_file:
-        nmpa_out = os.path.join(intermediate_dir, f"{quarter}_NMPA_结果.xlsx")
+    for c in company_cols:
+        codes, uniques = backend.factorize(df[c])
+        trimmed = [strip_company_suffixes(u, suffixes) if isinstance(u, str) else u for u in uniques] + [np.nan]
+        key_df[c] = np.asarray(trimmed, dtype=object)[codes]
 
-        res_nmpa = run_nmpa_quarter_pipeline(
-            input_file=nmpa_file,
-            output_file=nmpa_out,
-            year=year,
-            quarter=quarter
-        )
+    return key_df
 
-        # save_intermediate_df(df_nmpa, intermediate_dir, f"{quarter}_NMPA")
-        df_nmpa = res_nmpa["df"]
 
-        stats_dict["NMPA approved drugs"] = {
-            "【粗分类统计】": res_nmpa["stat_coarse"],
-            "【疾病领域统计】": res_nmpa["stat_disease"],
-            "【靶点统计】": res_nmpa["stat_target"]
-        }
-        results["NMPA"] = df_nmpa
-    else:
-        print("⚠️ 未找到 NMPA 文件，已跳过")
+# ===== ✅ 各来源对应的最终模板 Sheet =====
+SOURCE_TEMPLATE_SHEETS = {
+    "IND": "China IND",
+    "NDA": "China NDA",
+    "FDA": "FDA approved drugs",
+    "NMPA": "NMPA approved drugs",
+}
 
-    print("\n==============================")
-    print("✅ 四大监管流水线全部执行完成")
-    print(f"📁 所有结果 & 中间量统一保存在：{intermediate_dir}")
-    print("==============================\n")
+# 分类 / 统计步骤会用到、但不一定出现在模板里的列
+WORKING_COLUMNS = ["药品类别一", "药品类别二", "靶点", "参考疾病领域"]
 
-    return results,stats_dict
 
-def get_exe_base_dir():
+def load_template_columns(template_json_path: str = None):
     """
-    ✅ 获取程序真实运行目录：
-    - PyInstaller 打包后 → dist/
-    - 源码运行 → utils.py 所在目录
+    ✅ 读取最终模板列配置 template_columns.json（默认：程序同级目录）
+    ✅ 处于 config_overrides(template=...) 中时直接返回内存中的模板
     """
-    if getattr(sys, 'frozen', False):
-        return os.path.dirname(sys.executable)
-    else:
-        return os.path.dirname(os.path.abspath(__file__))
+    if template_json_path is None and "template" in _CONFIG_OVERRIDES.get():
+        return copy.deepcopy(_CONFIG_OVERRIDES.get()["template"])
 
+    if template_json_path is None:
+        template_json_path = os.path.join(get_base_dir(), "template_columns.json")
 
-def match_regulatory_files(quarter_folder: str):
+    with open(template_json_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def plan_source_columns(source: str, template_json_path: str = None, rules: dict = None):
     """
-    ✅ 永远从【程序所在目录】下面找 Q4 / Q1 / Q2 目录
+    ✅ 列裁剪规划：某个来源真正需要读取的最小列集合
+        = 最终模板列（template_columns.json）
+        ∪ 表头签名必需列（SOURCE_SIGNATURES）
+        ∪ 去重键 / 排序列 / 近似查重持证商列（rules_config.json）
+        ∪ 分类与统计用列（WORKING_COLUMNS）+ 溯源列
+    其余列在读取时直接跳过，不再跟着 merge / sort / copy 一路传递
     """
-    base_dir = get_exe_base_dir()
-    quarter_dir = os.path.join(base_dir, quarter_folder)
-
-    print(f"📁 实际搜索目录：{quarter_dir}")
+    rules = rules if rules is not None else load_rules_config()
+    template = load_template_columns(template_json_path)
+    rule = get_dedup_rule(source, rules)
 
-    if not os.path.exists(quarter_dir):
-        raise FileNotFoundError(f"❌ 找不到季度文件夹：{quarter_dir}")
+    cols = list(template.get(SOURCE_TEMPLATE_SHEETS[source], []))
+    cols += SOURCE_SIGNATURES[source]["required"]
+    cols += rule["keys"] + [rule["order_by"]]
+    cols.append(rules.get("near_dedup", {}).get("holder_cols", {}).get(source))
+    cols += WORKING_COLUMNS + PROVENANCE_COLUMNS
 
-    files = os.listdir(quarter_dir)
+    return list(dict.fromkeys(c for c in cols if c))
 
-    result = {"IND": None, "NDA": None, "FDA": None, "NMPA": None}
 
-    for f in files:
-        f_upper = f.upper()
-        full_path = os.path.join(quarter_dir, f)
+def _planned_usecols(source: str, column_projection: bool = None):
+    """流水线用：根据开关（None → 读配置 column_projection）返回 usecols 或 None"""
+    if column_projection is None:
+        column_projection = bool(load_rules_config().get("column_projection", False))
 
-        if "IND" in f_upper:
-            result["IND"] = full_path
-        elif "NDA" in f_upper:
-            result["NDA"] = full_path
-        elif "FDA" in f_upper:
-            result["FDA"] = full_path
-        elif "NMPA" in f_upper:
-            result["NMPA"] = full_path
+    if not column_projection:
+        return None
 
-    print("✅ 匹配到的监管文件：")
-    for k, v in result.items():
-        print(f"   {k}: {v}")
+    usecols = plan_source_columns(source)
+    print(f"🧮 列裁剪：{source} 只读取 {len(usecols)} 个用得到的列")
+    return usecols
 
-    return result
 
 def step1_dedup_only_keep_latest_NDA_IND(
     input_path: str,
     sheet_name: str = "数据详情",
-    date_col: str = "CDE承办日期",
+    date_col: str = None,
+    source: str = "IND",
+    audit_path: str = None,
+    near_dedup_path: str = None,
+    usecols: list = None,
 ):
-    df = pd.read_excel(input_path, sheet_name=sheet_name)
+    df = read_excel_with_spillover(input_path, sheet_name=sheet_name, usecols=usecols)
+    df = canonicalize_text_columns(df)
 
     print("✅ 原始数据行数：", len(df))
     # display(df.head())
 
-    # ===== 去重键，先检查是否存在 =====
-    dedup_cols = ["通用名", "剂型", "持证商"]
+    # ===== 去重键（来自 rules_config.json），先检查是否存在 =====
+    rule = get_dedup_rule(source)
+    dedup_cols = rule["keys"]
+    date_col = date_col or rule["order_by"]
     missing = [c for c in dedup_cols if c not in df.columns]
 
     if missing:
@@ -236,17 +1729,28 @@ def step1_dedup_only_keep_latest_NDA_IND(
         # 这里直接返回原表，不做任何修改（连序号都不加）
         return df
 
-    # ===== ✅ 情况 1：存在日期列 → 按日期排序后保留最新 =====
+    # ===== ✅ 情况 1：存在日期列 → 每组保留日期最新的一条 =====
     if date_col in df.columns:
-        print(f"✅ 使用日期列【{date_col}】进行排序去重（保留最新）")
-        df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
-        df = df.sort_values(by=date_col)
-        df = df.drop_duplicates(subset=dedup_cols, keep="last").copy()
+        print(f"✅ 使用日期列【{date_col}】进行去重（保留最新）")
+        df[date_col], _ = parse_date_column(df[date_col])
+        df, audit_df = dedup_by_keys(
+            df, dedup_cols, order_by=date_col, keep=rule["keep"], audit=audit_path is not None,
+            key_df=dedup_match_keys(df, dedup_cols)
+        )
 
     # ===== ✅ 情况 2：不存在日期列 → 直接按原顺序保留最后一行 =====
     else:
         print(f"⚠️ 未发现日期列【{date_col}】，改为直接保留最后一条记录")
-        df = df.drop_duplicates(subset=dedup_cols, keep="last").copy()
+        df, audit_df = dedup_by_keys(
+            df, dedup_cols, order_by=None, keep=rule["keep"], audit=audit_path is not None,
+            key_df=dedup_match_keys(df, dedup_cols)
+        )
+
+    _save_dedup_audit(audit_df, audit_path)
+
+    # ===== ✅ 近似重复（可选：全角/半角、大小写、公司后缀差异）=====
+    if near_dedup_path is not None:
+        df = near_dedup(df, source, report_path=near_dedup_path or None)
 
     # ===== ✅ 删除【受理号】=====
     if "受理号" in df.columns:
@@ -350,7 +1854,10 @@ def step1_nmpa_filter_by_quarter(
     drug_name_col: str = "通用名",
     dosage_col: str = "剂型",          # ⭐ 新增字段：用于去重
     year: int = None,
-    quarter: str = "Q4"
+    quarter: str = "Q4",
+    audit_path: str = None,
+    near_dedup_path: str = None,
+    usecols: list = None
 ):
     """
     NMPA 专用（按自然季度筛选）：
@@ -365,8 +1872,9 @@ def step1_nmpa_filter_by_quarter(
     if quarter not in ["Q1", "Q2", "Q3", "Q4"]:
         raise ValueError("❌ quarter 只能是：'Q1', 'Q2', 'Q3', 'Q4'")
 
-    # ===== 1️⃣ 读取 =====
-    df = pd.read_excel(input_path, sheet_name=sheet_name)
+    # ===== 1️⃣ 读取（按 usecols 裁剪列）+ 文本规范化 =====
+    df = read_excel_with_spillover(input_path, sheet_name=sheet_name, usecols=usecols)
+    df = canonicalize_text_columns(df)
     print("✅ NMPA 原始数据行数：", len(df))
 
     # ===== 2️⃣ 检查字段 =====
@@ -377,7 +1885,7 @@ def step1_nmpa_filter_by_quarter(
             )
 
     # ===== 3️⃣ 时间格式处理 =====
-    df[approval_date_col] = pd.to_datetime(df[approval_date_col], errors="coerce")
+    df[approval_date_col], _ = parse_date_column(df[approval_date_col])
 
     # ===== 4️⃣ 计算季度起止 =====
     if quarter == "Q1":
@@ -422,16 +1930,24 @@ def step1_nmpa_filter_by_quarter(
     # )
 
     # print(f"✅ NMPA 按【通用名 + 剂型】添加序号后行数：{len(df_q)}")
-    # ===== 6️⃣ ⭐ 按【通用名 + 剂型 + 持证商(NMPA)】去重，保留第一条 =====
-    dedup_cols = [drug_name_col, dosage_col, "持证商(NMPA)"]
+    # ===== 6️⃣ ⭐ 按【通用名 + 剂型 + 持证商(NMPA)】去重，保留最早批准的一条 =====
+    rule = get_dedup_rule("NMPA")
+    dedup_cols = rule["keys"]
 
     before = len(df_q)
 
-    df_q = (
-        df_q.sort_values(approval_date_col)  # 如需要保持时间顺序
-            .drop_duplicates(subset=dedup_cols, keep="first")
-            .reset_index(drop=True)
+    df_q, audit_df = dedup_by_keys(
+        df_q,
+        dedup_cols,
+        order_by=rule["order_by"],
+        keep=rule["keep"],
+        audit=audit_path is not None,
+        key_df=dedup_match_keys(df_q, dedup_cols)
     )
+    _save_dedup_audit(audit_df, audit_path)
+
+    if near_dedup_path is not None:
+        df_q = near_dedup(df_q, "NMPA", report_path=near_dedup_path or None)
 
     after = len(df_q)
     print(f"✅ NMPA 去重完成：删除 {before - after} 条重复记录（基于 {dedup_cols}）")
@@ -474,16 +1990,22 @@ def step1_nmpa_filter_by_quarter(
 def step1_fda_dedup_and_add_id(
     input_path: str,
     sheet_name: str = "目标药品",
-    dedup_cols=["活性成分(中文)", "申请机构","剂型"]
+    dedup_cols=None,
+    audit_path: str = None,
+    near_dedup_path: str = None,
+    usecols: list = None
 ):
     """
     FDA 专用（最新规则）：
     1）读取【目标药品】sheet
-    2）按【活性成分（中文） + 持证商(NMPA)】去重（保留最后一条）
+    2）按 rules_config.json 中 FDA 的去重键去重（默认：活性成分(中文) + 申请机构 + 剂型，保留最后一条）
     3）按最终顺序添加【序号】
     """
+    rule = get_dedup_rule("FDA")
+    dedup_cols = dedup_cols or rule["keys"]
 
-    df = pd.read_excel(input_path, sheet_name=sheet_name)
+    df = read_excel_with_spillover(input_path, sheet_name=sheet_name, usecols=usecols)
+    df = canonicalize_text_columns(df)
 
     print("✅ FDA 原始数据行数：", len(df))
 
@@ -496,10 +2018,21 @@ def step1_fda_dedup_and_add_id(
         )
 
     # ===== 2️⃣ 去重（保留最后一条记录）=====
-    df_dedup = df.drop_duplicates(subset=dedup_cols, keep="last").copy()
+    df_dedup, audit_df = dedup_by_keys(
+        df,
+        dedup_cols,
+        order_by=rule["order_by"],
+        keep=rule["keep"],
+        audit=audit_path is not None,
+        key_df=dedup_match_keys(df, dedup_cols)
+    )
+    _save_dedup_audit(audit_df, audit_path)
 
     print(f"🔁 FDA 按 {dedup_cols} 去重后行数：{len(df_dedup)}")
 
+    if near_dedup_path is not None:
+        df_dedup = near_dedup(df_dedup, "FDA", report_path=near_dedup_path or None)
+
     # ===== 3️⃣ 添加序号 =====
     df_dedup.insert(0, "序号", range(1, len(df_dedup) + 1))
 
@@ -533,13 +2066,7 @@ def build_classify_mapping_from_json():
     """
     ✅ 自动从程序同级目录读取 rules_config.json
     """
-    config_path = os.path.join(get_base_dir(), "rules_config.json")
-
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"❌ 找不到规则配置文件：{config_path}")
-
-    with open(config_path, "r", encoding="utf-8") as f:
-        config = json.load(f)
+    config = load_rules_config()
 
     mapping_data = config["classification_mapping"]
     df_map = pd.DataFrame(mapping_data)
@@ -551,15 +2078,14 @@ def step2_add_class_and_save(
     df_map,
     output_classified_path: str
 ):
-    df_with_class = df.merge(
+    df_with_class = get_backend(len(df)).left_join(
+        df,
         df_map,
-        on=["药品类别一", "药品类别二"],
-        how="left"
+        ["药品类别一", "药品类别二"]
     )
-    col = df_with_class["类别(粗分)"].astype(str).str.strip()
-    missing = df_with_class[
-    df_with_class["类别(粗分)"].astype(str).str.strip().isin(["", "nan", "NaN", "None"])
-    ]
+    # ✅ 读取后已统一做过文本规范化，未匹配 = 空值
+    col_missing = df_with_class["类别(粗分)"].isna()
+    missing = df_with_class[col_missing]
 
     
     
@@ -586,19 +2112,19 @@ def step2_add_class_and_save(
         # display(missing[["药品类别一", "药品类别二"]].drop_duplicates())
     else:
         print("✅ 所有记录已成功匹配分类")
-    df_with_class.loc[col.isin(["", "nan", "NaN", "None"]), "类别(粗分)"] = "Others"
+    df_with_class.loc[col_missing, "类别(粗分)"] = "Others"
     # display(df_with_class.head())
     # ========== 给细分类补 Others ==========
-    fine_col = df_with_class["详细列（细分）"].astype(str).str.strip()
-
     df_with_class.loc[
-        fine_col.isin(["", "nan", "NaN", "None"]),
+        df_with_class["详细列（细分）"].isna(),
         "详细列（细分）"
     ] = "Others"
     # ======================================
-    # ✅ 只保存这一份
-    df_with_class.to_excel(output_classified_path, index=False)
-    print(f"✅ 分类明细表已保存：{output_classified_path}")
+    # ✅ 只保存这一份（output_classified_path=None → 纯内存，不写文件）
+    if output_classified_path is not None:
+        df_with_class.to_excel(output_classified_path, index=False)
+        print(f"✅ 分类明细表已保存：{output_classified_path}")
+
 
     return df_with_class
 
@@ -661,256 +2187,818 @@ def step2_add_class_and_save(
 
 #     return stat_cat1, stat_coarse, stat_fine
 
-def step3_print_statistics(df, show: bool = True):
+# ===============================
+# ✅ 声明式统计引擎（配置：rules_config.json → statistics）
+# ===============================
+# 每一项统计是一条 spec：
+#   key            → 结果字典中的名字（stat_coarse / stat_target ...）
+#   title          → 写入【所有统计汇总】时的区块标题
+#   template_title → 写入最终自存模板时的标题（不填则不进模板）
+#   dimension      → 统计的列
+#   kind           → "counts"（默认，按取值计数）/ "keywords"（按关键词包含计数，如疾病领域）
+#                    / "crosstab"（rows × dimension 交叉计数）
+#   rows           → crosstab 的行维度（如 类别(粗分)）
+#   column_kind    → crosstab 的列按 "counts" 还是 "keywords" 统计
+#   valid_if_any   → 只统计这些列不全为空的行
+#   fill_empty     → 有效行中 dimension 为空时归入的取值（如 "others"）
+#   top_k / others_label → 只保留前 K 个，其余合并为 others
+#   total          → 末尾追加 Total 行
+#   missing        → 列不存在时："empty" 返回空表，否则返回 None
+#   sources        → 只对这些来源计算（不填 = 所有来源）
+
+
+def load_statistics_specs(source: str = None, rules: dict = None, column_overrides: dict = None):
+    """
+    ✅ 读取统计配置；给定 source 时过滤掉不适用于该来源的统计
+    ✅ column_overrides：{默认列名: 实际列名}，用于流水线传入的 disease_col / target_col
+    """
+    rules = rules if rules is not None else load_rules_config()
+    column_overrides = column_overrides or {}
+
+    specs = []
+    for spec in rules.get("statistics", []):
+        if source is not None and source not in spec.get("sources", [source]):
+            continue
+        spec = dict(spec)
+        spec["dimension"] = column_overrides.get(spec["dimension"], spec["dimension"])
+        if "rows" in spec:
+            spec["rows"] = column_overrides.get(spec["rows"], spec["rows"])
+        if "valid_if_any" in spec:
+            spec["valid_if_any"] = [column_overrides.get(c, c) for c in spec["valid_if_any"]]
+        specs.append(spec)
+
+    return specs
+
 
-    def add_total_row(stat_df, name_col="类别", count_col="数量"):
-        total_value = stat_df[count_col].sum()
-        total_row = pd.DataFrame({
-            name_col: ["Total"],
-            count_col: [total_value]
+def _factorize_for_spec(df, spec, cache, column: str = None):
+    """同一列 + 同一过滤条件只 factorize 一次（靶点 Top-K、明细、交叉表共用）"""
+    column = column or spec["dimension"]
+    valid_cols = tuple(c for c in spec.get("valid_if_any", ()) if c in df.columns)
+    cache_key = (column, valid_cols)
+
+    if cache_key not in cache:
+        backend = cache.setdefault("backend", get_backend(len(df)))
+        col = df[column]
+        if valid_cols:
+            mask_key = ("valid_if_any", valid_cols)
+            if mask_key not in cache:
+                cache[mask_key] = df[list(valid_cols)].notna().any(axis=1).to_numpy()
+            col = col[cache[mask_key]]
+        cache[cache_key] = backend.factorize(col)
+
+    return cache[cache_key]
+
+
+def _count_crosstab(df, spec, rules, cache):
+    """
+    ✅ rows × dimension 的完整交叉计数（一次 bincount，不截断 Top-K）
+    - 列顺序与单维统计一致（数量降序），保证 Top-K 取到同一批取值
+    - keywords：先算 行 × 唯一取值 的计数，再乘以 唯一取值 × 关键词 的命中矩阵
+    - rows 为空的行不计入
+    """
+    if spec["rows"] not in df.columns or spec["dimension"] not in df.columns:
+        return None
+
+    column_kind = spec.get("column_kind", "counts")
+    col_counts = count_statistic(df, dict(spec, kind=column_kind), rules, cache)
+
+    row_codes, row_uniques = _factorize_for_spec(df, spec, cache, column=spec["rows"])
+    col_codes, col_uniques = _factorize_for_spec(df, spec, cache)
+    labels = list(col_uniques)
+
+    if column_kind == "counts" and spec.get("fill_empty") is not None:
+        fill = spec["fill_empty"]
+        empty = col_codes < 0
+        if empty.any():
+            if fill not in labels:
+                labels.append(fill)
+            col_codes = np.where(empty, labels.index(fill), col_codes)
+
+    n_rows, n_cols = len(row_uniques), len(labels)
+    ok = (row_codes >= 0) & (col_codes >= 0)
+    matrix = np.bincount(
+        row_codes[ok] * n_cols + col_codes[ok],
+        minlength=n_rows * n_cols
+    ).reshape(n_rows, n_cols)
+
+    if column_kind == "keywords":
+        keywords = list(rules[spec["mapping"]].values())
+        hits = np.array(
+            [[kw in str(u) for kw in keywords] for u in labels],
+            dtype="int64"
+        ).reshape(n_cols, len(keywords))
+        matrix = matrix @ hits
+        labels = list(rules[spec["mapping"]])
+
+    table = pd.DataFrame(
+        matrix,
+        index=pd.Index(list(row_uniques), dtype=object),
+        columns=pd.Index(labels, dtype=object),
+        dtype="int64"
+    )[list(col_counts.index)]
+
+    row_order = np.argsort(-table.to_numpy().sum(axis=1), kind="stable")
+    return table.iloc[row_order]
+
+
+def _finalize_crosstab(counts, spec):
+    """✅ 交叉表导出：列 Top-K + others、Total 行 / 列，行维度作为第一列"""
+    rows_label = spec.get("rows_label", spec["rows"])
+
+    if counts is None:
+        if spec.get("missing") == "empty":
+            return pd.DataFrame(columns=[rows_label])
+        return None
+
+    table = counts.copy()
+
+    top_k = spec.get("top_k")
+    if top_k and table.shape[1] > top_k:
+        others_label = spec.get("others_label", "others")
+        others = table.iloc[:, top_k:].sum(axis=1)
+        table = table.iloc[:, :top_k].copy()
+        if others_label in table.columns:
+            table[others_label] += others
+        else:
+            table[others_label] = others
+
+    if spec.get("total"):
+        table["Total"] = table.sum(axis=1)
+        table.loc["Total"] = table.sum(axis=0)
+
+    table.index.name = rows_label
+    return table.reset_index()
+
+
+def count_statistic(df, spec, rules: dict = None, _cache: dict = None):
+    """
+    ✅ 计算一项统计的【完整计数】（不截断 Top-K、不加 Total，可以直接相加合并）
+    返回 pd.Series：index = 取值（keywords 为映射的键），按数量降序，平局按首次出现顺序
+    crosstab 返回 DataFrame（index = rows 取值，columns = dimension 取值）
+    列不存在时返回 None
+    """
+    _cache = _cache if _cache is not None else {}
+
+    if spec.get("kind", "counts") == "crosstab":
+        rules = rules if rules is not None else load_rules_config()
+        return _count_crosstab(df, spec, rules, _cache)
+
+    if spec["dimension"] not in df.columns:
+        return None
+
+    codes, uniques = _factorize_for_spec(df, spec, _cache)
+    per_unique = np.bincount(codes[codes >= 0], minlength=len(uniques))
+
+    if spec.get("kind", "counts") == "keywords":
+        rules = rules if rules is not None else load_rules_config()
+        texts = [str(u) for u in uniques]
+        counts = {}
+        for label, keyword in rules[spec["mapping"]].items():
+            hit = np.fromiter((keyword in t for t in texts), dtype=bool, count=len(texts))
+            counts[label] = int(per_unique[hit].sum())
+        return pd.Series(counts, dtype="int64")
+
+    labels = list(uniques)
+    fill = spec.get("fill_empty")
+    n_empty = int((codes < 0).sum())
+
+    if fill is not None and n_empty:
+        if fill in labels:
+            per_unique[labels.index(fill)] += n_empty
+        else:
+            # 插到“第一次出现空值”的位置，保持与 fillna + value_counts 一致的顺序
+            first_empty = int(np.argmax(codes < 0))
+            at = int(codes[:first_empty].max()) + 1 if first_empty else 0
+            labels.insert(at, fill)
+            per_unique = np.insert(per_unique, at, n_empty)
+
+    order = np.argsort(-per_unique, kind="stable")
+    return pd.Series(
+        per_unique[order],
+        index=pd.Index([labels[i] for i in order], dtype=object),
+        dtype="int64"
+    )
+
+
+def finalize_statistic(counts, spec, rules: dict = None):
+    """
+    ✅ 把完整计数整理成导出用的统计表：Top-K + others、Total 行、列名
+    """
+    if spec.get("kind", "counts") == "crosstab":
+        return _finalize_crosstab(counts, spec)
+
+    label = spec.get("label", spec["dimension"])
+
+    if counts is None:
+        if spec.get("missing") == "empty":
+            return pd.DataFrame(columns=[label, "数量"])
+        return None
+
+    if spec.get("kind", "counts") == "keywords":
+        rules = rules if rules is not None else load_rules_config()
+        mapping = rules[spec["mapping"]]
+        name_col, keyword_col = spec.get("columns", [label, "关键词"])
+        table = pd.DataFrame({
+            name_col: list(counts.index),
+            keyword_col: [mapping[k] for k in counts.index],
+            "数量": counts.to_numpy()
         })
-        return pd.concat([stat_df, total_row], ignore_index=True)
+        if spec.get("total"):
+            table.loc[len(table)] = ["Total", "Total", table["数量"].sum()]
+        return table
 
-    stat_cat1 = None
-    stat_coarse = None
-    stat_fine = None
+    table = pd.DataFrame({label: list(counts.index), "数量": counts.to_numpy()})
 
-    # ===============================
-    # ✅ 一、按【药品类别一】统计
-    # ===============================
-    if "药品类别一" in df.columns:
-        stat_cat1 = df["药品类别一"].value_counts().reset_index()
-        stat_cat1.columns = ["药品类别一", "数量"]
-        stat_cat1 = add_total_row(stat_cat1, "药品类别一", "数量")
+    if table.empty and spec.get("missing") == "empty":
+        return table
 
-        if show:
-            print("✅ 一、按【药品类别一】统计：")
-            display(stat_cat1)
-    else:
-        if show:
-            print("⚠️ 跳过【药品类别一】统计：当前 DataFrame 中不存在该列")
+    top_k = spec.get("top_k")
+    if top_k and len(table) > top_k:
+        others = table["数量"].iloc[top_k:].sum()
+        table = table.head(top_k).copy()
+        table.loc[len(table)] = [spec.get("others_label", "others"), others]
 
-    # ===============================
-    # ✅ 二、按【粗分类】统计
-    # ===============================
-    if "类别(粗分)" in df.columns:
-        stat_coarse = df["类别(粗分)"].value_counts().reset_index()
-        stat_coarse.columns = ["类别(粗分)", "数量"]
-        stat_coarse = add_total_row(stat_coarse, "类别(粗分)", "数量")
+    if spec.get("total"):
+        table.loc[len(table)] = ["Total", table["数量"].sum()]
 
-        if show:
-            print("✅ 二、按【粗分类】统计：")
-            display(stat_coarse)
-    else:
-        if show:
-            print("⚠️ 跳过【粗分类】统计：当前 DataFrame 中不存在列【类别(粗分)】")
+    return table
 
-    # ===============================
-    # ✅ 三、按【细分类】统计
-    # ===============================
-    if "详细列（细分）" in df.columns:
-        stat_fine = df["详细列（细分）"].value_counts().reset_index()
-        stat_fine.columns = ["详细列（细分）", "数量"]
-        stat_fine = add_total_row(stat_fine, "详细列（细分）", "数量")
+
+def compute_statistic_counts(df, specs, rules: dict = None):
+    """✅ 一次遍历：按 specs 计算所有统计的完整计数，返回 {key: Series 或 None}"""
+    rules = rules if rules is not None else load_rules_config()
+    cache = {}
+    return {spec["key"]: count_statistic(df, spec, rules, cache) for spec in specs}
+
+
+def compute_statistics(df, source: str = None, specs: list = None, rules: dict = None, show: bool = False):
+    """
+    ✅ 声明式统计入口：
+    - specs 默认来自 rules_config.json → statistics（按 source 过滤）
+    - 每列只 factorize 一次，所有统计表在同一轮中算完
+    - 返回 {key: 统计表}，表结构与原 step3 / step4 / step5 一致
+    """
+    rules = rules if rules is not None else load_rules_config()
+    specs = specs if specs is not None else load_statistics_specs(source, rules)
+
+    counts = compute_statistic_counts(df, specs, rules)
+
+    return finalize_statistics(counts, specs, rules, show=show, columns=df.columns)
+
+
+def finalize_statistics(counts: dict, specs: list, rules: dict = None, show: bool = False, columns=None):
+    """
+    ✅ 把 {key: 完整计数} 整理成 {key: 统计表}
+    - 既用于单季度（compute_statistics），也用于多季度汇总（rollup_statistics）
+    - columns：原始 DataFrame 的列，仅用于提示缺失的列
+    """
+    rules = rules if rules is not None else load_rules_config()
+
+    tables = {}
+    for spec in specs:
+        table = finalize_statistic(counts.get(spec["key"]), spec, rules)
+        tables[spec["key"]] = table
 
         if show:
-            print("✅ 三、按【细分类】统计：")
-            display(stat_fine)
-    else:
-        if show:
-            print("⚠️ 跳过【细分类】统计：当前 DataFrame 中不存在列【详细列（细分）】")
+            title = spec.get("title", spec["key"])
+            if table is None:
+                cols = [c for c in (spec.get("rows"), spec["dimension"]) if c]
+                if columns is not None:
+                    cols = [c for c in cols if c not in columns]
+                print(f"⚠️ 跳过{title}：当前 DataFrame 中不存在列【{'、'.join(cols)}】")
 
-    return stat_cat1, stat_coarse, stat_fine
+            else:
+                print(f"✅ {title}")
+                display(table)
 
-# def build_disease_area_mapping():
-#     return {
-#         "Oncology": "肿瘤",
-#         "Hematology": "血液",
-#         "Infectious": "感染",
-#         "Respiratory": "呼吸",
-#         "Gastrointestinal": "消化",
-#         "Dermatology": "皮肤",
-#         "Rare disease": "罕见疾病",
-#         "Immunology": "免疫",
-#         "Other": "其他"
-#     }
+    return tables
 
-def load_disease_area_mapping_from_json():
-    config_path = os.path.join(get_base_dir(), "rules_config.json")
 
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"❌ 找不到规则配置文件：{config_path}")
+# ===============================
+# ✅ 可合并的统计计数（按季度落盘 → 年度 / 多年汇总）
+# ===============================
+# 每个季度、每个来源写一个小 JSON：{year}_{quarter}_{source}_统计计数.json
+# 里面保存 specs 和【完整计数】（未截断 Top-K、未加 Total），
+# 汇总时直接相加后再 finalize，不需要重新读取 Excel。
 
-    with open(config_path, "r", encoding="utf-8") as f:
-        config = json.load(f)
+STAT_COUNTS_SUFFIX = "_统计计数.json"
 
-    return config["disease_area_mapping"]
 
-def step4_statistics_by_disease_area(df, disease_col: str = "参考疾病领域", show: bool = True):
+def _json_value(x):
+    """numpy 标量 → Python 原生类型，保证可写入 JSON"""
+    return x.item() if isinstance(x, np.generic) else x
+
+
+def _encode_counts(counts):
+    """Series / 交叉表 DataFrame / None → 可 JSON 序列化的 dict"""
+    if counts is None:
+        return None
+
+    if isinstance(counts, pd.DataFrame):
+        return {
+            "index": [_json_value(x) for x in counts.index],
+            "columns": [_json_value(x) for x in counts.columns],
+            "values": counts.to_numpy().tolist()
+        }
+
+    return {
+        "index": [_json_value(x) for x in counts.index],
+        "values": counts.to_numpy().tolist()
+    }
+
+
+def _decode_counts(data):
+    if data is None:
+        return None
+
+    index = pd.Index(data["index"], dtype=object)
+
+    if "columns" in data:
+        return pd.DataFrame(
+            np.asarray(data["values"], dtype="int64").reshape(len(data["index"]), len(data["columns"])),
+            index=index,
+            columns=pd.Index(data["columns"], dtype=object)
+        )
+
+    return pd.Series(np.asarray(data["values"], dtype="int64"), index=index, dtype="int64")
+
+
+def _stat_counts_payload(counts: dict, specs: list, source: str, year=None, quarter=None):
+    return {
+        "source": source,
+        "year": year,
+        "quarter": quarter,
+        "specs": specs,
+        "counts": {key: _encode_counts(c) for key, c in counts.items()}
+    }
+
+
+def save_stat_counts(path: str, counts: dict, specs: list, source: str, year=None, quarter=None):
+    """✅ 把一个来源的完整计数写成 JSON 旁路文件"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(_stat_counts_payload(counts, specs, source, year, quarter), f, ensure_ascii=False)
+
+    print(f"📁 统计计数已保存：{path}")
+
+
+def load_stat_counts(path: str):
+    """✅ 读取 save_stat_counts 写出的文件，counts 还原为 Series / DataFrame"""
+    with open(path, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+
+    payload["counts"] = {key: _decode_counts(c) for key, c in payload["counts"].items()}
+    return payload
+
 
-    mapping = load_disease_area_mapping_from_json()
+def _stable_desc(labels: list, totals):
+    """按数量降序，平局保持 labels 原有顺序（与 value_counts 一致）"""
+    order = np.argsort(-np.asarray(totals), kind="stable")
+    return [labels[i] for i in order]
 
-    if disease_col not in df.columns:
+
+def merge_statistic_counts(counts_list: list, spec: dict):
+    """
+    ✅ 把多个季度的同一项完整计数相加
+    - 取值按首次出现的顺序合并（先传入的季度在前），再按数量降序；平局保持该顺序
+    - keywords（以及列为 keywords 的交叉表）保持映射顺序，不排序
+    """
+    counts_list = [c for c in counts_list if c is not None]
+    if not counts_list:
+        return None
+
+    kind = spec.get("kind", "counts")
+
+    if kind == "crosstab":
+        rows = list(dict.fromkeys(x for c in counts_list for x in c.index))
+        cols = list(dict.fromkeys(x for c in counts_list for x in c.columns))
+        total = sum(c.reindex(index=rows, columns=cols, fill_value=0) for c in counts_list)
+
+        if spec.get("column_kind", "counts") == "counts":
+            cols = _stable_desc(cols, total.to_numpy().sum(axis=0))
+        rows = _stable_desc(rows, total.to_numpy().sum(axis=1))
+
+        return total.loc[rows, cols].astype("int64")
+
+    labels = list(dict.fromkeys(x for c in counts_list for x in c.index))
+    total = sum(c.reindex(labels, fill_value=0) for c in counts_list)
+
+    if kind == "keywords":
+        return total.astype("int64")
+
+    return total.loc[_stable_desc(labels, total.to_numpy())].astype("int64")
+
+
+def _iter_stat_count_files(paths):
+    """paths 可以是文件或文件夹（文件夹会递归查找 *_统计计数.json）"""
+    if isinstance(paths, str):
+        paths = [paths]
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in sorted(os.walk(path)):
+                for name in sorted(files):
+                    if name.endswith(STAT_COUNTS_SUFFIX):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def rollup_statistics(paths, sources: list = None, title_field: str = "template_title",
+                      rules: dict = None, show: bool = False):
+    """
+    ✅ 年度 / 多年统计：把各季度的统计计数文件相加，再生成统计表
+    - paths：文件或文件夹（如多个季度的 *_intermediate 目录，或它们的上级目录）
+    - 同一 (year, quarter, source) 出现多次时只取最后一个，避免重复计数
+    - 返回 stats_dict：{模板 Sheet 名: {标题: 统计表}}，可直接传给
+      align_and_export_to_self_template_by_json 或 save_stat_blocks_to_one_sheet
+    """
+    rules = rules if rules is not None else load_rules_config()
+
+    by_period = {}
+    for path in _iter_stat_count_files(paths):
+        payload = load_stat_counts(path)
+        if sources is not None and payload["source"] not in sources:
+            continue
+        period = (payload["source"], payload.get("year"), payload.get("quarter"))
+        if period in by_period:
+            print(f"⚠️ 重复的统计计数（{period}），使用：{path}")
+        by_period[period] = payload
+
+    stats_dict = {}
+    for source in SOURCE_TEMPLATE_SHEETS:
+        payloads = [
+            p for (src, _, _), p in sorted(
+                by_period.items(), key=lambda kv: (str(kv[0][1]), str(kv[0][2]))
+            )
+            if src == source
+        ]
+        if not payloads:
+            continue
+
+        specs = payloads[-1]["specs"]
+        counts = {
+            spec["key"]: merge_statistic_counts(
+                [p["counts"].get(spec["key"]) for p in payloads], spec
+            )
+            for spec in specs
+        }
+
+        periods = "、".join(f"{p.get('year')}{p.get('quarter')}" for p in payloads)
         if show:
-            print(f"⚠️ 跳过疾病领域统计：找不到列【{disease_col}】")
+            print(f"\n✅ {source} 汇总季度：{periods}")
+
+        tables = finalize_statistics(counts, specs, rules, show=show)
+        stats_dict[SOURCE_TEMPLATE_SHEETS[source]] = stat_blocks(tables, specs, title_field=title_field)
+
+    return stats_dict
+
+
+# ===============================
+# ✅ 季度环比（新增 / 删除 / 变更）
+# ===============================
+# run_all 会把每个来源的分类明细缓存为 {year}_{quarter}_{source}_明细.pkl，
+# 环比直接读缓存，不再重新解析 Excel。
+
+INTERMEDIATE_DF_SUFFIX = "_明细.pkl"
+
+
+def save_intermediate_df(df, intermediate_dir: str, name: str):
+    """✅ 缓存分类明细（pickle，保留 dtype），返回路径"""
+    path = os.path.join(intermediate_dir, f"{name}{INTERMEDIATE_DF_SUFFIX}")
+    df.to_pickle(path)
+    print(f"📁 明细缓存已保存：{path}")
+    return path
+
+
+def load_intermediate_df(intermediate_dir: str, year: int, quarter: str, source: str):
+    """
+    ✅ 读取某年某季度某来源的明细缓存（{year}_{quarter}_{source}_明细.pkl）
+    - {quarter}_intermediate 目录跨年份共用，必须按年份 + 季度精确定位
+    - 找不到返回 None
+    """
+    path = os.path.join(intermediate_dir, f"{year}_{quarter}_{source}{INTERMEDIATE_DF_SUFFIX}")
+
+    if not os.path.exists(path):
         return None
 
-    stat_rows = []
+    return pd.read_pickle(path)
 
-    for eng, zh in mapping.items():
-        count = df[disease_col].astype(str).str.contains(zh, na=False).sum()
-        stat_rows.append([eng, zh, count])
 
-    stat_df = pd.DataFrame(
-        stat_rows,
-        columns=["疾病领域(英文)", "疾病领域(中文)", "数量"]
+def compute_quarter_delta(df_prev, df_curr, source: str, rules: dict = None):
+    """
+    ✅ 两个季度的明细按该来源的去重键做哈希连接（线性时间）：
+    - added   → 本季有、上季没有的行（本季的完整行）
+    - removed → 上季有、本季没有的行（上季的完整行）
+    - changed → 两季都有但内容不同：去重键 + 变化列 + 各比较列的 _上季 / _本季
+    - summary → 按 group_col（默认 类别(粗分)）统计 新增 / 删除 / 变更 数量 + Total
+    比较时忽略 quarter_delta.ignore_columns（序号、来源文件等每季都会变的列）
+    """
+    rules = rules if rules is not None else load_rules_config()
+    keys = get_dedup_rule(source, rules)["keys"]
+    cfg = rules.get("quarter_delta", {})
+    group_col = cfg.get("group_col", "类别(粗分)")
+    ignore = set(cfg.get("ignore_columns", [])) | set(keys)
+
+    for name, df in [("上季", df_prev), ("本季", df_curr)]:
+        missing = [k for k in keys if k not in df.columns]
+        if missing:
+            raise ValueError(f"❌ {source} {name}明细缺少去重键列：{missing}")
+
+    def _positions(df, name):
+        pos = df[keys].assign(**{f"_{name}_pos": np.arange(len(df))})
+        dup = pos.duplicated(keys, keep="last")
+        if dup.any():
+            print(f"⚠️ {source} {name}有 {int(dup.sum())} 行去重键重复，按最后一行比较")
+            pos = pos[~dup.to_numpy()]
+        return pos
+
+    joined = _positions(df_prev, "上季").merge(
+        _positions(df_curr, "本季"), on=keys, how="outer", indicator=True
     )
 
-    total_value = stat_df["数量"].sum()
-    total_row = pd.DataFrame([["Total", "Total", total_value]],
-                             columns=stat_df.columns)
-    stat_df = pd.concat([stat_df, total_row], ignore_index=True)
+    added_pos = joined.loc[joined["_merge"] == "right_only", "_本季_pos"].astype("int64").to_numpy()
+    removed_pos = joined.loc[joined["_merge"] == "left_only", "_上季_pos"].astype("int64").to_numpy()
+    added = df_curr.iloc[added_pos]
+    removed = df_prev.iloc[removed_pos]
+
+    both = joined[joined["_merge"] == "both"]
+    prev_pos = both["_上季_pos"].astype("int64").to_numpy()
+    curr_pos = both["_本季_pos"].astype("int64").to_numpy()
+
+    compare_cols = [c for c in df_curr.columns if c in df_prev.columns and c not in ignore]
+    diff = np.zeros((len(both), len(compare_cols)), dtype=bool)
+    for j, col in enumerate(compare_cols):
+        a = df_prev[col].iloc[prev_pos].reset_index(drop=True)
+        b = df_curr[col].iloc[curr_pos].reset_index(drop=True)
+        same = (a.astype(object) == b.astype(object)).fillna(False).to_numpy(dtype=bool)
+        diff[:, j] = ~(same | (a.isna() & b.isna()).to_numpy())
+
+    is_changed = diff.any(axis=1)
+    changed = df_curr[keys].iloc[curr_pos[is_changed]].reset_index(drop=True)
+    changed["变化列"] = ["、".join(c for c, d in zip(compare_cols, row) if d) for row in diff[is_changed]]
+    for col in compare_cols:
+        changed[f"{col}_上季"] = df_prev[col].iloc[prev_pos[is_changed]].to_numpy()
+        changed[f"{col}_本季"] = df_curr[col].iloc[curr_pos[is_changed]].to_numpy()
+
+    def _group_counts(df, pos):
+        if group_col not in df.columns:
+            return pd.Series(dtype="int64")
+        return df[group_col].iloc[pos].astype(object).fillna("（空）").value_counts(sort=False)
+
+    summary = pd.concat(
+        {
+            "新增": _group_counts(df_curr, added_pos),
+            "删除": _group_counts(df_prev, removed_pos),
+            "变更": _group_counts(df_curr, curr_pos[is_changed]),
+        },
+        axis=1
+    ).fillna(0).astype("int64")
+
+    summary.index.name = group_col
+    summary.loc["Total"] = [len(added), len(removed), int(is_changed.sum())]
+    summary = summary.reset_index()
+
+    print(
+        f"✅ {source} 环比：新增 {len(added)} 行，删除 {len(removed)} 行，"
+        f"变更 {int(is_changed.sum())} 行（对比 {len(compare_cols)} 列）"
+    )
 
-    if show:
-        print("✅ 按【参考疾病领域】统计结果：")
-        display(stat_df)
+    return {
+        "added": added.reset_index(drop=True),
+        "removed": removed.reset_index(drop=True),
+        "changed": changed,
+        "summary": summary
+    }
 
-    return stat_df
 
-# def step5_statistics_by_target(df, target_col: str = "靶点", show: bool = True):
+def save_quarter_delta(deltas: dict, output_file: str):
+    """✅ 环比结果写入一个 Excel：每个来源 4 个 Sheet（汇总 / 新增 / 删除 / 变更）"""
+    sheet_names = {"summary": "汇总", "added": "新增", "removed": "删除", "changed": "变更"}
 
-#     if target_col not in df.columns:
-#         if show:
-#             print(f"⚠️ 跳过靶点统计：当前 DataFrame 中不存在列【{target_col}】")
-#         return (
-#             pd.DataFrame(columns=["靶点", "数量"]),
-#             pd.DataFrame(columns=["靶点", "数量"])
-#         )
+    with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
+        for source, delta in deltas.items():
+            for key, label in sheet_names.items():
+                delta[key].to_excel(writer, sheet_name=f"{source}_{label}", index=False)
 
-#     s = (
-#         df[target_col]
-#         .astype(str)
-#         .fillna("")
-#         .str.strip()
-#     )
+    print(f"📁 环比结果已保存：{output_file}")
 
-#     s = s[s != ""]
 
-#     if s.empty:
-#         if show:
-#             print("⚠️ 靶点列为空或仅包含空值，返回空统计表。")
-#         return (
-#             pd.DataFrame(columns=["靶点", "数量"]),
-#             pd.DataFrame(columns=["靶点", "数量"])
-#         )
+def compare_quarters(prev_period: tuple, curr_period: tuple, prev_intermediate_dir: str,
+                     curr_intermediate_dir: str = None, sources: list = None,
+                     output_file: str = None, rules: dict = None):
+    """
+    ✅ 对比两个季度（run_all 生成的明细缓存），返回 {source: delta}
+    - prev_period / curr_period：(year, quarter)，如 (2024, "Q4") / (2025, "Q4")
+    - curr_intermediate_dir 省略时与 prev_intermediate_dir 相同（同季度跨年对比共用一个目录）
+    - 只读明细缓存，不重新解析 Excel
+    - 任一季度缺少某来源的缓存时跳过该来源
+    - 给定 output_file 时写出环比 Excel
+    """
+    rules = rules if rules is not None else load_rules_config()
+    sources = sources or list(SOURCE_TEMPLATE_SHEETS)
+    curr_intermediate_dir = curr_intermediate_dir or prev_intermediate_dir
+
+    deltas = {}
+    for source in sources:
+        df_prev = load_intermediate_df(prev_intermediate_dir, *prev_period, source)
+        df_curr = load_intermediate_df(curr_intermediate_dir, *curr_period, source)
+
+        if df_prev is None or df_curr is None:
+            print(f"⚠️ {source} 缺少 {prev_period[0]} {prev_period[1]} 或 "
+                  f"{curr_period[0]} {curr_period[1]} 的明细缓存，已跳过环比")
+            continue
+
+        deltas[source] = compute_quarter_delta(df_prev, df_curr, source, rules)
+
+    if output_file and deltas:
+        save_quarter_delta(deltas, output_file)
+
+    return deltas
+
+
+# ===============================
+# ✅ 检查点 / 断点续跑
+# ===============================
+# 每个来源跑完立刻落盘：明细缓存（*_明细.pkl）+ 统计计数（*_统计计数.json），
+# 并在 {year}_{quarter}_checkpoint.json 中记录输入文件指纹（路径 + 大小 + 修改时间）、
+# 运行选项、rules_config.json / template_columns.json 的哈希和代码版本。
+# 续跑时全部一致才复用，否则重跑该来源（列投影默认开启，明细缓存依赖模板列）。
+
+def _input_fingerprint(input_file):
+    """输入文件（单个路径或路径列表）→ [[绝对路径, 大小, 修改时间ns], ...]"""
+    paths = [input_file] if isinstance(input_file, str) else list(input_file)
+    fingerprint = []
+    for path in paths:
+        st = os.stat(path)
+        fingerprint.append([os.path.abspath(path), st.st_size, st.st_mtime_ns])
+    return fingerprint
+
+
+def _rules_hash(rules: dict = None):
+    rules = rules if rules is not None else load_rules_config()
+    raw = json.dumps(rules, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def open_run_checkpoint(intermediate_dir: str, year: int, quarter: str, options: dict = None):
+    """✅ 打开（或新建）本季度的检查点清单"""
+    path = os.path.join(intermediate_dir, f"{year}_{quarter}_checkpoint.json")
+
+    sources = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            sources = json.load(f).get("sources", {})
+
+    rules_hash, template_hash = config_hashes()
+
+    return {
+        "path": path,
+        "dir": intermediate_dir,
+        "year": year,
+        "quarter": quarter,
+        "options": options or {},
+        "rules_hash": rules_hash,
+        "template_hash": template_hash,
+        "code_version": code_version(),
+        "sources": sources
+    }
+
+
+def _write_checkpoint_manifest(checkpoint: dict):
+    """先写临时文件再替换，中途失败不会留下半个 JSON"""
+    tmp_path = checkpoint["path"] + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"year": checkpoint["year"], "quarter": checkpoint["quarter"],
+                   "sources": checkpoint["sources"]}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, checkpoint["path"])
+
+
+def save_source_checkpoint(checkpoint: dict, source: str, input_file, res: dict):
+    """✅ 某个来源跑完后：保存明细缓存 + 统计计数，并在清单中标记为已完成"""
+    year, quarter = checkpoint["year"], checkpoint["quarter"]
+
+    counts_path = os.path.join(checkpoint["dir"], f"{year}_{quarter}_{source}{STAT_COUNTS_SUFFIX}")
+    save_stat_counts(counts_path, res["stat_counts"], res["stat_specs"], source, year, quarter)
+    df_path = save_intermediate_df(res["df"], checkpoint["dir"], f"{year}_{quarter}_{source}")
+
+    checkpoint["sources"][source] = {
+        "inputs": _input_fingerprint(input_file),
+        "options": checkpoint["options"],
+        "rules_hash": checkpoint["rules_hash"],
+        "template_hash": checkpoint["template_hash"],
+        "code_version": checkpoint["code_version"],
+        "df": os.path.basename(df_path),
+        "stat_counts": os.path.basename(counts_path)
+    }
+    _write_checkpoint_manifest(checkpoint)
+    print(f"💾 检查点已更新：{source}")
+
+
+def resume_source_checkpoint(checkpoint: dict, source: str, input_file):
+    """
+    ✅ 尝试从检查点恢复某个来源，返回与流水线相同结构的结果；不可复用时返回 None
+    统计表由保存的完整计数重新 finalize 得到，与重跑结果一致
+    """
+    entry = checkpoint["sources"].get(source)
+    if not entry:
+        return None
+
+    if (entry.get("inputs") != _input_fingerprint(input_file)
+            or entry.get("options") != checkpoint["options"]
+            or entry.get("rules_hash") != checkpoint["rules_hash"]
+            or entry.get("template_hash") != checkpoint["template_hash"]
+            or entry.get("code_version") != checkpoint["code_version"]):
+        print(f"🔁 {source} 输入文件 / 选项 / 规则 / 模板 / 代码版本已变化，重新计算")
+        return None
+
+    df_path = os.path.join(checkpoint["dir"], entry["df"])
+    counts_path = os.path.join(checkpoint["dir"], entry["stat_counts"])
+    if not (os.path.exists(df_path) and os.path.exists(counts_path)):
+        return None
+
+    payload = load_stat_counts(counts_path)
+    stat_specs = payload["specs"]
+    stat_counts = payload["counts"]
+    stat_tables = finalize_statistics(stat_counts, stat_specs)
+
+    print(f"⏩ {source} 已从检查点恢复，跳过计算")
+
+    return {
+        "df": pd.read_pickle(df_path),
+        "stat_tables": stat_tables,
+        "stat_counts": stat_counts,
+        "stat_specs": stat_specs,
+        **{key: stat_tables.get(key) for key in
+           ["stat_cat1", "stat_coarse", "stat_fine", "stat_disease", "stat_target"]}
+    }
 
-#     vc = s.value_counts()
-#     detail_df = vc.reset_index()
-#     detail_df.columns = ["靶点", "数量"]
 
-#     top_k = 10
-#     top_df = detail_df.head(top_k).copy()
-#     others_count = detail_df["数量"].iloc[top_k:].sum()
+def stat_blocks(stat_tables: dict, specs: list, title_field: str = "title"):
+    """
+    ✅ 按 specs 顺序把统计表整理成 {标题: 表}：
+    - title_field="title"          → 写入【所有统计汇总】
+    - title_field="template_title" → 写入最终自存模板（没有该字段的统计不输出）
+    """
+    return {
+        spec[title_field]: stat_tables.get(spec["key"])
+        for spec in specs
+        if spec.get(title_field)
+    }
 
-#     summary_rows = []
 
-#     for _, row in top_df.iterrows():
-#         summary_rows.append([row["靶点"], row["数量"]])
+def _stat_spec(key: str, column_overrides: dict = None, **override):
+    """取配置中的某一项统计，并覆盖部分字段（供 step3 / step4 / step5 兼容接口使用）"""
+    for spec in load_statistics_specs(column_overrides=column_overrides):
+        if spec["key"] == key:
+            spec.update(override)
+            return spec
+    raise KeyError(f"❌ rules_config.json 的 statistics 中没有：{key}")
 
-#     if others_count > 0:
-#         summary_rows.append(["others", others_count])
 
-#     summary_df = pd.DataFrame(summary_rows, columns=["靶点", "数量"])
+def step3_print_statistics(df, show: bool = True):
+    """药品类别一 / 粗分 / 细分 计数（等价于统计引擎中的对应三项）"""
+    specs = [_stat_spec("stat_cat1"), _stat_spec("stat_coarse"), _stat_spec("stat_fine")]
+    tables = compute_statistics(df, specs=specs, show=show)
 
-#     total_row = pd.DataFrame(
-#         [["Total", summary_df["数量"].sum()]],
-#         columns=["靶点", "数量"]
-#     )
-#     summary_df = pd.concat([summary_df, total_row], ignore_index=True)
+    return tables["stat_cat1"], tables["stat_coarse"], tables["stat_fine"]
 
-#     if show:
-#         print("✅ 按【靶点】统计结果（Top10 + others）：")
-#         display(summary_df)
 
-#     return detail_df, summary_df
-def step5_statistics_by_target(df, target_col: str = "靶点", show: bool = True):
+# def build_disease_area_mapping():
+#     return {
+#         "Oncology": "肿瘤",
+#         "Hematology": "血液",
+#         "Infectious": "感染",
+#         "Respiratory": "呼吸",
+#         "Gastrointestinal": "消化",
+#         "Dermatology": "皮肤",
+#         "Rare disease": "罕见疾病",
+#         "Immunology": "免疫",
+#         "Other": "其他"
+#     }
 
-    if target_col not in df.columns:
-        if show:
-            print(f"⚠️ 跳过：不存在列【{target_col}】")
-        empty = pd.DataFrame(columns=["靶点", "数量"])
-        return empty, empty
+def load_disease_area_mapping_from_json():
+    config = load_rules_config()
 
-    # 三列用于判断空值
-    cols_check = [target_col, "药品类别一", "药品类别二"]
+    return config["disease_area_mapping"]
 
-    for col in cols_check:
-        if col not in df.columns:
-            raise KeyError(f"❌ DataFrame 缺少必要列：{col}")
-
-    # 统一清洗
-    cleaned = df[cols_check].astype(str).apply(lambda c: c.str.strip())
-    empty_vals = ["", "nan", "NaN", "None"]
-
-    # === 判断三列是否全部为空 ===
-    mask_all_empty = cleaned.apply(lambda row: all(v in empty_vals for v in row), axis=1)
-
-    # -------------------------------
-    # ✅（新增）打印总行数、有效靶点行数
-    # -------------------------------
-    total_rows = len(df)
-    rows_no_target = mask_all_empty.sum()
-    rows_valid = total_rows - rows_no_target
-
-    if show:
-        print("📊 靶点统计基础信息：")
-        print(f"  • 总行数：{total_rows}")
-        print(f"  • 三列皆为空 → 无有效靶点 的行数：{rows_no_target}")
-        print(f"  • 进入靶点统计的有效行数：{rows_valid}")
-        print("-" * 50)
-
-    # 过滤有效
-    # === 修复：靶点为空但行有效的也归入 Others ===
-
-    valid_df = df[~mask_all_empty].copy()
-    valid_df[target_col] = valid_df[target_col].astype(str).str.strip()
-    valid_df.loc[
-        valid_df[target_col].isin(["", "nan", "NaN", "None"]),
-        target_col
-    ] = "others"
-
-    if valid_df.empty:
-        if show:
-            print("⚠️ 没有任何有效靶点信息，返回空表")
-        empty = pd.DataFrame(columns=["靶点", "数量"])
-        return empty, empty
-
-    # 使用靶点列
-    s = valid_df[target_col].astype(str).str.strip()
-    s = s[~s.isin(empty_vals)]
-
-    # value_counts
-    vc = s.value_counts()
-    detail_df = vc.rename_axis("靶点").reset_index(name="数量")
-
-    # Top10 + others
-    top_k = 10
-    if len(detail_df) > top_k:
-        top_df = detail_df.head(top_k)
-        others_count = detail_df["数量"].iloc[top_k:].sum()
-        summary_df = pd.concat(
-            [top_df, pd.DataFrame([["others", others_count]], columns=["靶点", "数量"])]
-        )
-    else:
-        summary_df = detail_df.copy()
 
-    # 添加 Total 行
-    summary_df.loc[len(summary_df)] = ["Total", summary_df["数量"].sum()]
+def step4_statistics_by_disease_area(df, disease_col: str = "参考疾病领域", show: bool = True):
+    """参考疾病领域关键词计数（等价于统计引擎中的 stat_disease）"""
+    spec = _stat_spec("stat_disease", column_overrides={"参考疾病领域": disease_col})
+
+    return compute_statistics(df, specs=[spec], show=show)["stat_disease"]
 
-    if show:
-        display(summary_df)
 
-    return detail_df, summary_df
+def step5_statistics_by_target(df, target_col: str = "靶点", show: bool = True):
+    """靶点全量明细 + Top-K / others（等价于统计引擎中的 detail_target / stat_target）"""
+    overrides = {"靶点": target_col}
+    specs = [
+        _stat_spec("detail_target", column_overrides=overrides, label="靶点"),
+        _stat_spec("stat_target", column_overrides=overrides, label="靶点"),
+    ]
+    tables = compute_statistics(df, specs=specs, show=show)
+
+    return tables["detail_target"], tables["stat_target"]
 
 # def step5_statistics_by_target(df, target_col: str = "靶点", show: bool = True):
 
@@ -976,8 +3064,29 @@ def save_all_stats_to_one_sheet(
     ✅ 自动跳过 None 或空 DataFrame
     ✅ 使用 overlay 模式，避免重复写入时报错
     """
+    save_stat_blocks_to_one_sheet(
+        output_file,
+        {
+            "【统计一：药品类别一】": stat_cat1,
+            "【统计二：粗分类】": stat_coarse,
+            "【统计三：细分类】": stat_fine,
+            "【统计四：疾病领域】": stat_disease_area,
+            "【统计五：靶点 Top10 + Others】": summary_target,
+            "【统计六：靶点全量明细】": detail_target,
+        },
+        sheet_name=sheet_name
+    )
 
-    import pandas as pd
+
+def save_stat_blocks_to_one_sheet(output_file, blocks: dict, sheet_name="所有统计汇总"):
+    """
+    ✅ 把 {标题: 统计表} 按顺序逐块写入同一个 Sheet（统计引擎的输出直接可用）
+    ✅ 自动跳过 None 或空 DataFrame
+    ✅ 使用 overlay 模式，避免重复写入时报错
+    ✅ output_file=None（纯内存运行）→ 不写文件
+    """
+    if output_file is None:
+        return
 
     with pd.ExcelWriter(
         output_file,
@@ -985,60 +3094,91 @@ def save_all_stats_to_one_sheet(
         mode="a",
         if_sheet_exists="overlay"   # ✅ 允许多次写同一 Sheet
     ) as writer:
+        _write_stat_blocks(writer, blocks, sheet_name)
 
-        start_row = 0
-
-        def write_block(title, df_block, start_row):
-            """
-            ✅ 安全写入单个区块：
-            - df_block 为 None 或空表 → 自动跳过
-            - 返回新的 start_row
-            """
-
-            if df_block is None:
-                print(f"⚠️ 跳过区块（None）：{title}")
-                return start_row
-
-            if isinstance(df_block, pd.DataFrame) and df_block.empty:
-                print(f"⚠️ 跳过区块（空表）：{title}")
-                return start_row
-
-            # ===== 标题（单独一行）=====
-            title_df = pd.DataFrame([[title]])
-            title_df.to_excel(
-                writer,
-                sheet_name=sheet_name,
-                startrow=start_row,
-                startcol=0,
-                index=False,
-                header=False
-            )
+    print(f"✅ 所有可用的统计结果已合并保存到同一个 Sheet：{sheet_name}")
 
-            # ===== 数据表 =====
-            df_block.to_excel(
-                writer,
-                sheet_name=sheet_name,
-                startrow=start_row + 2,  # 标题下面空一行
-                startcol=0,
-                index=False
-            )
 
-            # ✅ 返回下一个 block 的起始行
-            return start_row + len(df_block) + 5
+def _write_stat_blocks(writer, blocks: dict, sheet_name: str):
+    """在已打开的 ExcelWriter 中逐块写入 {标题: 统计表}"""
+    start_row = 0
+
+    def write_block(title, df_block, start_row):
+        """
+        ✅ 安全写入单个区块：
+        - df_block 为 None 或空表 → 自动跳过
+        - 返回新的 start_row
+        """
+
+        if df_block is None:
+            print(f"⚠️ 跳过区块（None）：{title}")
+            return start_row
+
+        if isinstance(df_block, pd.DataFrame) and df_block.empty:
+            print(f"⚠️ 跳过区块（空表）：{title}")
+            return start_row
+
+        # ===== 标题（单独一行）=====
+        title_df = pd.DataFrame([[title]])
+        title_df.to_excel(
+            writer,
+            sheet_name=sheet_name,
+            startrow=start_row,
+            startcol=0,
+            index=False,
+            header=False
+        )
+
+        # ===== 数据表 =====
+        df_block.to_excel(
+            writer,
+            sheet_name=sheet_name,
+            startrow=start_row + 2,  # 标题下面空一行
+            startcol=0,
+            index=False
+        )
+
+        # ✅ 返回下一个 block 的起始行
+        return start_row + len(df_block) + 5
+
+    # ===== ✅ 依次写入各个统计块（全部是安全写入）=====
+    for title, df_block in blocks.items():
+        start_row = write_block(title, df_block, start_row)
 
-        # ===== ✅ 依次写入各个统计块（全部是安全写入）=====
-        start_row = write_block("【统计一：药品类别一】", stat_cat1, start_row)
-        start_row = write_block("【统计二：粗分类】", stat_coarse, start_row)
-        start_row = write_block("【统计三：细分类】", stat_fine, start_row)
-        start_row = write_block("【统计四：疾病领域】", stat_disease_area, start_row)
-        start_row = write_block("【统计五：靶点 Top10 + Others】", summary_target, start_row)
-        start_row = write_block("【统计六：靶点全量明细】", detail_target, start_row)
 
-    print(f"✅ 所有可用的 Step 3–5 统计结果已合并保存到同一个 Sheet：{sheet_name}")
+def export_source_workbook(df, blocks: dict, output, summary_sheet_name="所有统计汇总"):
+    """
+    ✅ 一次写出单个来源的结果文件（分类明细 + 所有统计汇总），结构与流水线的 *_结果.xlsx 一致
+    ✅ output 可以是路径，也可以是 BytesIO 等文件对象
+    """
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False)
+        _write_stat_blocks(writer, blocks, summary_sheet_name)
+
 
 
 ############### 多季度合并 ############3
 
+# 多季度合并时每类 Sheet 保留的列（Excel 读取与历史库查询共用）
+MERGE_KEEP_COLUMNS = {
+    "FDA": ["通用名", "剂型", "集团", "药品类别一", "药品类别二", "靶点", "季度来源"],
+    "NMPA": ["通用名", "药品类别一", "靶点", "季度来源"],
+    "IND": ["通用名", "药品类别一", "药品类别二", "靶点", "参考疾病领域", "季度来源"],
+    "NDA": ["通用名", "药品类别一", "药品类别二", "靶点", "参考疾病领域", "季度来源"],
+}
+
+def quarter_source_label(text: str) -> str:
+    """
+    ✅【季度来源】的取值（Excel 合并与历史库合并共用）：
+    文本（文件名 / 历史库中的季度）中出现的第一个 Q1–Q4（按 Q1 → Q4 的顺序检查），否则为“未知季度”
+    """
+    text = str(text).upper()
+    for quarter in ["Q1", "Q2", "Q3", "Q4"]:
+        if quarter in text:
+            return quarter
+    return "未知季度"
+
+
 def load_and_merge_by_sheet(
     q_files: list,        # ["Q1.xlsx", "Q2.xlsx", "Q3.xlsx", "Q4.xlsx"]
     sheet_keyword: str    # "FDA" / "NMPA" / "IND" / "NDA"
@@ -1058,7 +3198,7 @@ def load_and_merge_by_sheet(
 
     for f in q_files:
         # ===== ✅ 1️⃣ 自动查找包含关键词的 sheet =====
-        xl = pd.ExcelFile(f, engine="openpyxl")
+        xl = pd.ExcelFile(f, engine=excel_reader_engine(f))
         matched_sheets = [
             s for s in xl.sheet_names
             if sheet_keyword.lower() in s.lower()
@@ -1072,10 +3212,8 @@ def load_and_merge_by_sheet(
         print(f"\n✅ 文件 {f} 使用 Sheet: {sheet_name}")
 
         # ===== ✅ 2️⃣ 无表头读取，用于“定位真实表头行” =====
-        df_raw = pd.read_excel(
-            f,
+        df_raw = xl.parse(
             sheet_name=sheet_name,
-            engine="openpyxl",
             header=None
         )
 
@@ -1099,7 +3237,7 @@ def load_and_merge_by_sheet(
             df = df.reset_index(drop=True)
         else:
             print(f"    ⚠️ 未在前 10 行中检测到【药品类别一/二】，退回默认读取方式")
-            df = pd.read_excel(f, sheet_name=sheet_name, engine="openpyxl")
+            df = xl.parse(sheet_name=sheet_name)
 
         # ✅✅✅ 第一次剔除“全为空”的行（表头修复后）
         before_drop = df.shape[0]
@@ -1111,18 +3249,8 @@ def load_and_merge_by_sheet(
         print(f"    📌 表头修复后有效行数：{df.shape[0]}")
 
         # ===== ✅ 3️⃣ 标记季度来源 Q1-Q4 =====
-        fname = os.path.basename(f).upper()
-
-        if "Q1" in fname:
-            quarter = "Q1"
-        elif "Q2" in fname:
-            quarter = "Q2"
-        elif "Q3" in fname:
-            quarter = "Q3"
-        elif "Q4" in fname:
-            quarter = "Q4"
-        else:
-            quarter = "未知季度"
+        quarter = quarter_source_label(os.path.basename(f))
+        if quarter == "未知季度":
             print(f"⚠️ 无法从文件名识别季度：{f}")
 
         df["季度来源"] = quarter
@@ -1131,19 +3259,8 @@ def load_and_merge_by_sheet(
         print(f"    📌 添加季度来源后行数：{df.shape[0]}")
 
         # ===== ✅ 4️⃣ 按 Sheet 类型裁剪列（最终口径） =====
-        keyword_upper = sheet_keyword.upper()
-
-        if keyword_upper == "FDA":
-            base_keep_cols = ["通用名", "剂型", "集团", "药品类别一", "药品类别二", "靶点", "季度来源"]
-
-        elif keyword_upper == "NMPA":
-            base_keep_cols = ["通用名", "药品类别一", "靶点", "季度来源"]
+        base_keep_cols = MERGE_KEEP_COLUMNS.get(sheet_keyword.upper(), [])
 
-        elif keyword_upper in ["IND", "NDA"]:
-            base_keep_cols = ["通用名", "药品类别一", "药品类别二", "靶点", "参考疾病领域", "季度来源"]
-
-        else:
-            base_keep_cols = []
 
         if base_keep_cols:
             keep_cols = [c for c in base_keep_cols if c in df.columns]
@@ -1175,6 +3292,207 @@ def load_and_merge_by_sheet(
     return df_all
 
 
+# ===============================
+# ✅ 本地历史库（SQLite，标准库 sqlite3，无需额外依赖）
+# ===============================
+# records    → 每季度每来源的分类明细：year / quarter / source + 常用查询列（有索引）+ data（整行 JSON）
+# stat_counts→ 每季度每来源的完整统计计数（与 *_统计计数.json 同格式）
+# 同一 (year, quarter, source) 重复写入时先删除旧数据，保证重跑不会重复计数。
+
+HISTORY_COLUMNS = [
+    "通用名", "剂型", "持证商", "集团",
+    "药品类别一", "药品类别二", "靶点", "参考疾病领域", "类别(粗分)", "详细列（细分）"
+]
+
+HISTORY_INDEX_COLUMNS = ["通用名", "持证商", "靶点"]
+
+
+def _history_column_map(source: str, rules: dict = None):
+    """{历史库列名: 该来源的实际列名}：FDA 的通用名 / 持证商 分别来自 活性成分(中文) / 申请机构"""
+    rules = rules if rules is not None else load_rules_config()
+    cfg = rules.get("history_db", {})
+
+    col_map = {c: c for c in HISTORY_COLUMNS}
+    col_map["通用名"] = cfg.get("name_cols", {}).get(source, "通用名")
+    col_map["持证商"] = cfg.get("holder_cols", {}).get(source, "持证商")
+
+    return col_map
+
+
+def _history_db_path(history_db_path: str = None):
+    """None → 读取 rules_config.json 的 history_db.path；仍为空则不写历史库"""
+    if history_db_path is None:
+        history_db_path = load_rules_config().get("history_db", {}).get("path")
+    return history_db_path or None
+
+
+def connect_history_db(db_path: str):
+    """✅ 打开（必要时创建）历史库，建表 + 建索引"""
+    import sqlite3
+
+    conn = sqlite3.connect(db_path)
+    cols_sql = ", ".join(f'"{c}" TEXT' for c in HISTORY_COLUMNS)
+
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS records (
+            year INTEGER NOT NULL,
+            quarter TEXT NOT NULL,
+            source TEXT NOT NULL,
+            {cols_sql},
+            data TEXT
+        );
+        CREATE TABLE IF NOT EXISTS stat_counts (
+            year INTEGER NOT NULL,
+            quarter TEXT NOT NULL,
+            source TEXT NOT NULL,
+            key TEXT NOT NULL,
+            spec TEXT,
+            counts TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_records_period ON records (source, year, quarter);
+        CREATE INDEX IF NOT EXISTS idx_stat_counts_period ON stat_counts (source, year, quarter);
+    """)
+    for col in HISTORY_INDEX_COLUMNS:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_records_{col}" ON records ("{col}")')
+
+    return conn
+
+
+def _history_rows(df, source: str, year: int, quarter: str, rules: dict = None):
+    """分类明细 → records 表的行（索引列取字符串，整行转 JSON 存入 data）"""
+    col_map = _history_column_map(source, rules)
+
+    indexed = {}
+    for col, src_col in col_map.items():
+        if src_col in df.columns:
+            values = df[src_col].astype(object)
+            indexed[col] = values.where(values.notna(), None).map(lambda v: None if v is None else str(v)).tolist()
+        else:
+            indexed[col] = [None] * len(df)
+
+    data = [
+        json.dumps(r, ensure_ascii=False)
+        for r in json.loads(df.to_json(orient="records", date_format="iso", force_ascii=False))
+    ]
+
+    return [
+        (int(year), quarter, source, *(indexed[c][i] for c in HISTORY_COLUMNS), data[i])
+        for i in range(len(df))
+    ]
+
+
+def save_to_history_db(db_path: str, results: dict, year: int, quarter: str,
+                       stat_counts: dict = None, stat_specs: dict = None, rules: dict = None):
+    """
+    ✅ 把一次运行的结果追加写入历史库
+    - results：{source: 分类明细 df}（即 run_all 返回的 results）
+    - stat_counts / stat_specs：{source: 完整计数} / {source: specs}（可选）
+    - 同一 (year, quarter, source) 先删后写，在一个事务中完成
+    """
+    rules = rules if rules is not None else load_rules_config()
+    stat_counts = stat_counts or {}
+    stat_specs = stat_specs or {}
+
+    placeholders = ", ".join(["?"] * (len(HISTORY_COLUMNS) + 4))
+    cols_sql = ", ".join(f'"{c}"' for c in HISTORY_COLUMNS)
+
+    conn = connect_history_db(db_path)
+    try:
+        with conn:
+            for source, df in results.items():
+                if df is None:
+                    continue
+
+                period = (source, int(year), quarter)
+                conn.execute("DELETE FROM records WHERE source = ? AND year = ? AND quarter = ?", period)
+                conn.execute("DELETE FROM stat_counts WHERE source = ? AND year = ? AND quarter = ?", period)
+
+                conn.executemany(
+                    f"INSERT INTO records (year, quarter, source, {cols_sql}, data) VALUES ({placeholders})",
+                    _history_rows(df, source, year, quarter, rules)
+                )
+
+                specs = {s["key"]: s for s in stat_specs.get(source, [])}
+                conn.executemany(
+                    "INSERT INTO stat_counts (year, quarter, source, key, spec, counts) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (int(year), quarter, source, key,
+                         json.dumps(specs.get(key), ensure_ascii=False),
+                         json.dumps(_encode_counts(counts), ensure_ascii=False))
+                        for key, counts in stat_counts.get(source, {}).items()
+                    ]
+                )
+
+                print(f"    ✅ 历史库写入 {source} {year}{quarter}：{len(df)} 行")
+    finally:
+        conn.close()
+
+    print(f"📁 历史库：{db_path}")
+
+
+def query_history_db(db_path: str, sql: str, params=()):
+    """✅ 在历史库上执行任意 SQL，返回 DataFrame"""
+    conn = connect_history_db(db_path)
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+
+def find_in_history_db(db_path: str, column: str, value: str):
+    """
+    ✅ 某个取值（如某持证商）出现过的所有 季度 × 来源 及行数
+    column 只能是建了索引的列：通用名 / 持证商 / 靶点
+    """
+    if column not in HISTORY_INDEX_COLUMNS:
+        raise ValueError(f"❌ column 只能是：{HISTORY_INDEX_COLUMNS}")
+
+    return query_history_db(
+        db_path,
+        f'SELECT year, quarter, source, COUNT(*) AS 行数 FROM records WHERE "{column}" = ? '
+        "GROUP BY year, quarter, source ORDER BY year, quarter, source",
+        (value,)
+    )
+
+
+def load_and_merge_from_history_db(db_path: str, sheet_keyword: str, years: list = None, quarters: list = None):
+    """
+    ✅ load_and_merge_by_sheet 的 SQL 版：直接从历史库取多个季度的数据，不再读 Excel
+    - 返回列与 load_and_merge_by_sheet 一致（含【季度来源】，取值同样由 quarter_source_label 给出）
+    - years / quarters 可选过滤
+    """
+    source = sheet_keyword.upper()
+    keep_cols = MERGE_KEEP_COLUMNS.get(source, [])
+    data_cols = [c for c in keep_cols if c != "季度来源"] or HISTORY_COLUMNS
+
+    sql = "SELECT quarter AS \"季度来源\", " + ", ".join(f'"{c}"' for c in data_cols) + \
+          " FROM records WHERE source = ?"
+    params = [source]
+
+    if years:
+        sql += f" AND year IN ({', '.join(['?'] * len(years))})"
+        params += [int(y) for y in years]
+    if quarters:
+        sql += f" AND quarter IN ({', '.join(['?'] * len(quarters))})"
+        params += list(quarters)
+
+    sql += " ORDER BY year, quarter, rowid"
+
+    df_all = query_history_db(db_path, sql, params)
+    if df_all.empty:
+        raise ValueError(f"❌ 历史库中没有【{sheet_keyword}】的数据")
+
+    df_all["季度来源"] = df_all["季度来源"].map(quarter_source_label)
+
+    df_all = df_all[[c for c in keep_cols if c in df_all.columns] or list(df_all.columns)]
+
+    print(f"\n✅ 已从历史库合并 {sheet_keyword}")
+    print(f"✅ 合并后总有效行数：{df_all.shape[0]}")
+
+    return df_all
+
+
+
 #################### 单个季度数据处理封装 ####################
 
 #  NMPA
@@ -1188,17 +3506,18 @@ def run_nmpa_quarter_pipeline(
     drug_name_col: str = "通用名",
     disease_col: str = "参考疾病领域",
     target_col: str = "靶点",
-    summary_sheet_name: str = "所有统计汇总"
+    summary_sheet_name: str = "所有统计汇总",
+    dedup_audit: bool = None,
+    near_dedup_enabled: bool = None,
+    column_projection: bool = None
 ):
     """
     ✅ NMPA 最近一季度“全自动统计流水线”：
     1️⃣ 最近一季度批准 + 同药同序号
     2️⃣ 分类映射
     3️⃣ 保存分类明细表
-    4️⃣ 药品类别一 / 粗分 / 细分 统计
-    5️⃣ 参考疾病领域统计
-    6️⃣ 靶点 Top10 + Others 统计
-    7️⃣ 所有统计结果写入同一 Sheet
+    4️⃣ 统计引擎一轮算完：药品类别一 / 粗分 / 细分 / 参考疾病领域 / 靶点 Top10 + Others
+    5️⃣ 所有统计结果写入同一 Sheet
 
     ✅ 你只需要传：input_file, output_file, year, quarter
     """
@@ -1214,7 +3533,10 @@ def run_nmpa_quarter_pipeline(
         approval_date_col=approval_date_col,
         drug_name_col=drug_name_col,
         year=year,
-        quarter=quarter
+        quarter=quarter,
+        audit_path=_dedup_audit_path(output_file, dedup_audit),
+        near_dedup_path=_near_dedup_report_path(output_file, near_dedup_enabled),
+        usecols=_planned_usecols("NMPA", column_projection)
     )
 
     # ===== 2️⃣ 构建分类规则 =====
@@ -1227,45 +3549,35 @@ def run_nmpa_quarter_pipeline(
         output_classified_path=output_file
     )
 
-    # ===== 4️⃣ ✅ 分类统计（药品类别一 / 粗分 / 细分）=====
-    stat_cat1, stat_coarse, stat_fine = step3_print_statistics(df_with_class)
-
-    # ===== 5️⃣ ✅ 疾病领域统计 =====
-    stat_disease_area = step4_statistics_by_disease_area(
-        df_with_class,
-        disease_col=disease_col
-    )
-
-    # ===== 6️⃣ ✅ 靶点 Top10 + Others =====
-    detail_target, summary_target = step5_statistics_by_target(
-        df_with_class,
-        target_col=target_col
+    # ===== 4️⃣ ✅ 全部统计（rules_config.json → statistics，一轮算完）=====
+    stat_specs = load_statistics_specs(
+        "NMPA", column_overrides={"参考疾病领域": disease_col, "靶点": target_col}
     )
+    stat_counts = compute_statistic_counts(df_with_class, stat_specs)
+    stat_tables = finalize_statistics(stat_counts, stat_specs, show=True, columns=df_with_class.columns)
 
-    # ===== 7️⃣ ✅ 所有统计结果合并写入同一个 Sheet =====
-    save_all_stats_to_one_sheet(
-        output_file=output_file,
-        stat_cat1=stat_cat1,
-        stat_coarse=stat_coarse,
-        stat_fine=stat_fine,
-        stat_disease_area=stat_disease_area,
-        summary_target=summary_target,
-        detail_target=detail_target,
+    # ===== 5️⃣ ✅ 所有统计结果合并写入同一个 Sheet =====
+    save_stat_blocks_to_one_sheet(
+        output_file,
+        stat_blocks(stat_tables, stat_specs),
         sheet_name=summary_sheet_name
     )
 
     print("\n===============================")
     print("✅ NMPA 最近一季度统计流水线执行完成！")
-    print(f"📁 结果文件：{output_file}")
+    print(f"📁 结果文件：{output_file or '（纯内存运行，未写文件）'}")
     print("===============================\n")
 
     return {
     "df": df_with_class,
-    "stat_cat1": stat_cat1,
-    "stat_coarse":stat_coarse,
-    "stat_fine":stat_fine,
-    "stat_disease": stat_disease_area,
-    "stat_target": summary_target
+    "stat_cat1": stat_tables.get("stat_cat1"),
+    "stat_coarse": stat_tables.get("stat_coarse"),
+    "stat_fine": stat_tables.get("stat_fine"),
+    "stat_disease": stat_tables.get("stat_disease"),
+    "stat_target": stat_tables.get("stat_target"),
+    "stat_tables": stat_tables,
+    "stat_counts": stat_counts,
+    "stat_specs": stat_specs
 }
 
 
@@ -1275,18 +3587,20 @@ def run_fda_pipeline(
     output_file: str,
     sheet_name: str = "目标药品",
     target_col: str = "靶点",
-    summary_sheet_name: str = "所有统计汇总"
+    summary_sheet_name: str = "所有统计汇总",
+    dedup_audit: bool = None,
+    near_dedup_enabled: bool = None,
+    column_projection: bool = None
 ):
     """
     ✅ FDA 全自动统计流水线：
     1️⃣ 目标药品去重 + 加序号
     2️⃣ 分类映射
     3️⃣ 保存分类明细表
-    4️⃣ 药品类别一 / 粗分 / 细分 统计
-    5️⃣ 靶点 Top10 + Others 统计
-    6️⃣ 所有统计结果写入同一 Sheet
+    4️⃣ 统计引擎一轮算完：药品类别一 / 粗分 / 细分 / 靶点 Top10 + Others
+    5️⃣ 所有统计结果写入同一 Sheet
 
-    ✅ FDA 不做疾病领域统计（自动传 None）
+    ✅ FDA 不做疾病领域统计（statistics 配置中 stat_disease 不含 FDA）
     """
 
     print("\n===============================")
@@ -1296,7 +3610,10 @@ def run_fda_pipeline(
     # ===== 1️⃣ FDA：目标药品去重 + 加序号 =====
     df_dedup = step1_fda_dedup_and_add_id(
         input_path=input_file,
-        sheet_name=sheet_name
+        sheet_name=sheet_name,
+        audit_path=_dedup_audit_path(output_file, dedup_audit),
+        near_dedup_path=_near_dedup_report_path(output_file, near_dedup_enabled),
+        usecols=_planned_usecols("FDA", column_projection)
     )
 
     # ===== 2️⃣ 构建分类规则 =====
@@ -1309,39 +3626,35 @@ def run_fda_pipeline(
         output_classified_path=output_file
     )
 
-    # ===== 4️⃣ ✅ 分类统计（药品类别一 / 粗分 / 细分）=====
-    stat_cat1, stat_coarse, stat_fine = step3_print_statistics(df_with_class)
-
-    # ===== 5️⃣ ✅ 靶点 Top10 + Others =====
-    detail_target, summary_target = step5_statistics_by_target(
-        df_with_class,
-        target_col=target_col
+    # ===== 4️⃣ ✅ 全部统计（rules_config.json → statistics，一轮算完）=====
+    stat_specs = load_statistics_specs(
+        "FDA", column_overrides={"靶点": target_col}
     )
+    stat_counts = compute_statistic_counts(df_with_class, stat_specs)
+    stat_tables = finalize_statistics(stat_counts, stat_specs, show=True, columns=df_with_class.columns)
 
-    # ===== 6️⃣ ✅ 所有统计结果合并写入同一个 Sheet =====
-    save_all_stats_to_one_sheet(
-        output_file=output_file,
-        stat_cat1=stat_cat1,
-        stat_coarse=stat_coarse,
-        stat_fine=stat_fine,
-        stat_disease_area=None,      # ✅ FDA 无疾病领域
-        summary_target=summary_target,
-        detail_target=detail_target,
+    # ===== 5️⃣ ✅ 所有统计结果合并写入同一个 Sheet =====
+    save_stat_blocks_to_one_sheet(
+        output_file,
+        stat_blocks(stat_tables, stat_specs),
         sheet_name=summary_sheet_name
     )
 
     print("\n===============================")
     print("✅ FDA 统计流水线执行完成！")
-    print(f"📁 结果文件：{output_file}")
+    print(f"📁 结果文件：{output_file or '（纯内存运行，未写文件）'}")
     print("===============================\n")
 
     return {
     "df": df_with_class,
-    "stat_cat1": stat_cat1,
-    "stat_coarse":stat_coarse,
-    "stat_fine":stat_fine,
-    "stat_disease": None,
-    "stat_target": summary_target
+    "stat_cat1": stat_tables.get("stat_cat1"),
+    "stat_coarse": stat_tables.get("stat_coarse"),
+    "stat_fine": stat_tables.get("stat_fine"),
+    "stat_disease": stat_tables.get("stat_disease"),
+    "stat_target": stat_tables.get("stat_target"),
+    "stat_tables": stat_tables,
+    "stat_counts": stat_counts,
+    "stat_specs": stat_specs
 }
 
 def run_ind_nda_pipeline(
@@ -1350,17 +3663,18 @@ def run_ind_nda_pipeline(
     source: str,   # "IND" 或 "NDA"
     disease_col: str = "参考疾病领域",
     target_col: str = "靶点",
-    summary_sheet_name: str = "所有统计汇总"
+    summary_sheet_name: str = "所有统计汇总",
+    dedup_audit: bool = None,
+    near_dedup_enabled: bool = None,
+    column_projection: bool = None
 ):
     """
     ✅ IND / NDA 通用全自动统计流水线：
     1️⃣ 去重（通用名 + 剂型 + 持证商，保留最新）
     2️⃣ 分类映射
     3️⃣ 保存分类明细表
-    4️⃣ 药品类别一 / 粗分 / 细分 统计
-    5️⃣ 参考疾病领域统计
-    6️⃣ 靶点 Top10 + Others
-    7️⃣ 所有统计结果写入同一 Sheet
+    4️⃣ 统计引擎一轮算完：药品类别一 / 粗分 / 细分 / 参考疾病领域 / 靶点 Top10 + Others
+    5️⃣ 所有统计结果写入同一 Sheet
 
     ✅ source 只能是："IND" 或 "NDA"
     """
@@ -1373,13 +3687,23 @@ def run_ind_nda_pipeline(
     print(f"🚀 开始执行 {source} 统计流水线")
     print("===============================\n")
 
-    if isinstance(input_file, str):
-        # ===== 1️⃣ 去重（仅内存中） =====
+    if not isinstance(input_file, pd.DataFrame):
+        # ===== 1️⃣ 去重（仅内存中；input_file 可为单个路径或路径列表） =====
         df_dedup = step1_dedup_only_keep_latest_NDA_IND(
-            input_path=input_file
+            input_path=input_file,
+            source=source,
+            audit_path=_dedup_audit_path(output_file, dedup_audit),
+            near_dedup_path=_near_dedup_report_path(output_file, near_dedup_enabled),
+            usecols=_planned_usecols(source, column_projection)
         )
     else:
-        df_dedup=input_file
+        # 已是内存中的表：先裁掉用不到的列，再复制 + 规范化
+        usecols = _planned_usecols(source, column_projection)
+        if usecols is None:
+            df_in = input_file.copy()
+        else:
+            df_in = input_file[[c for c in input_file.columns if c in set(usecols)]]
+        df_dedup = canonicalize_text_columns(df_in)
 
     # ===== 2️⃣ 构建分类规则 =====
     df_map = build_classify_mapping_from_json()
@@ -1391,49 +3715,250 @@ def run_ind_nda_pipeline(
         output_classified_path=output_file
     )
 
-    # ===== 4️⃣ ✅ 分类统计（药品类别一 / 粗分 / 细分）=====
-    stat_cat1, stat_coarse, stat_fine = step3_print_statistics(df_with_class)
-
-    # ===== 5️⃣ ✅ 疾病领域统计 =====
-    stat_disease_area = step4_statistics_by_disease_area(
-        df_with_class,
-        disease_col=disease_col
-    )
-
-    # ===== 6️⃣ ✅ 靶点 Top10 + Others =====
-    detail_target, summary_target = step5_statistics_by_target(
-        df_with_class,
-        target_col=target_col
+    # ===== 4️⃣ ✅ 全部统计（rules_config.json → statistics，一轮算完）=====
+    stat_specs = load_statistics_specs(
+        source, column_overrides={"参考疾病领域": disease_col, "靶点": target_col}
     )
+    stat_counts = compute_statistic_counts(df_with_class, stat_specs)
+    stat_tables = finalize_statistics(stat_counts, stat_specs, show=True, columns=df_with_class.columns)
 
-    # ===== 7️⃣ ✅ 所有统计结果合并写入同一个 Sheet =====
-    save_all_stats_to_one_sheet(
-        output_file=output_file,
-        stat_cat1=stat_cat1,
-        stat_coarse=stat_coarse,
-        stat_fine=stat_fine,
-        stat_disease_area=stat_disease_area,
-        summary_target=summary_target,
-        detail_target=detail_target,
+    # ===== 5️⃣ ✅ 所有统计结果合并写入同一个 Sheet =====
+    save_stat_blocks_to_one_sheet(
+        output_file,
+        stat_blocks(stat_tables, stat_specs),
         sheet_name=summary_sheet_name
     )
 
     print("\n===============================")
     print(f"✅ {source} 统计流水线执行完成！")
-    print(f"📁 结果文件：{output_file}")
+    print(f"📁 结果文件：{output_file or '（纯内存运行，未写文件）'}")
     print("===============================\n")
 
     return {
     "df": df_with_class,
-    "stat_cat1": stat_cat1,
-    "stat_coarse":stat_coarse,
-    "stat_fine":stat_fine,
-    "stat_disease": stat_disease_area,
-    "stat_target": summary_target
+    "stat_cat1": stat_tables.get("stat_cat1"),
+    "stat_coarse": stat_tables.get("stat_coarse"),
+    "stat_fine": stat_tables.get("stat_fine"),
+    "stat_disease": stat_tables.get("stat_disease"),
+    "stat_target": stat_tables.get("stat_target"),
+    "stat_tables": stat_tables,
+    "stat_counts": stat_counts,
+    "stat_specs": stat_specs
 }
 
 
 
+# ===============================
+# ✅ 并行按 Sheet 生成 xlsx（配置：rules_config.json → export.parallel_sheets）
+# ===============================
+# xlsx 中每个 Sheet 是独立的 XML 部件：各 Sheet 的 XML（明细 + 统计区块）在子进程中并行生成，
+# 最后一次性打包成 zip。文本一律写成 inlineStr，不需要跨 Sheet 的共享字符串表；
+# 日期写成 Excel 序列号 + 与 pandas / openpyxl 相同的 YYYY-MM-DD HH:MM:SS 格式；
+# 数字与 openpyxl 一样按 %.16g 写出（1.0 → 1，读回同为整数）。
+# 只写数据本身（不含列宽 / 冻结窗格等格式），读回的值与 openpyxl 写法完全一致。
+
+XLSX_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+XLSX_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+XLSX_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+XLSX_DATETIME_STYLE = 1
+XLSX_DATE_STYLE = 2
+_XML_ILLEGAL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_EXCEL_EPOCH = pd.Timestamp(EXCEL_EPOCH)
+
+
+def _xml_escape(text: str) -> str:
+    text = _XML_ILLEGAL_CHARS.sub("", text)
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+def _xlsx_column_letters(n: int) -> list:
+    letters = []
+    for i in range(n):
+        name, i = "", i + 1
+        while i:
+            i, rem = divmod(i - 1, 26)
+            name = chr(65 + rem) + name
+        letters.append(name)
+    return letters
+
+
+def _xlsx_cell(ref: str, value) -> str:
+    """单个单元格的 XML；空值 / 空字符串不写（与 pandas.to_excel + openpyxl 一致）"""
+    if value is None or (not isinstance(value, str) and pd.api.types.is_scalar(value) and pd.isna(value)):
+        return ""
+    if isinstance(value, str) and not value:
+        return ""
+
+    if isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, np.integer)):
+        return f'<c r="{ref}"><v>{int(value)}</v></c>'
+    if isinstance(value, (float, np.floating)):
+        if np.isinf(value):
+            value = "inf" if value > 0 else "-inf"
+        else:
+            return f'<c r="{ref}"><v>{float(value):.16g}</v></c>'
+    elif isinstance(value, (pd.Timestamp, np.datetime64, datetime.datetime)):
+        serial = (pd.Timestamp(value) - _EXCEL_EPOCH) / pd.Timedelta(days=1)
+        return f'<c r="{ref}" s="{XLSX_DATETIME_STYLE}"><v>{serial:.16g}</v></c>'
+    elif isinstance(value, datetime.date):
+        serial = (pd.Timestamp(value) - _EXCEL_EPOCH).days
+        return f'<c r="{ref}" s="{XLSX_DATE_STYLE}"><v>{serial}</v></c>'
+
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{_xml_escape(str(value))}</t></is></c>'
+
+
+def _render_sheet_xml(blocks: list) -> bytes:
+    """
+    并行用的顶层函数：blocks = [(起始行, DataFrame, 是否写表头), ...]（起始行从 0 开始，互不重叠）
+    返回该 Sheet 的 worksheet XML
+    """
+    parts = [f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{XLSX_NS}"><sheetData>']
+
+    for start_row, df, header in blocks:
+        letters = _xlsx_column_letters(df.shape[1])
+        rows = df.itertuples(index=False, name=None)
+        if header:
+            rows = itertools.chain([tuple(df.columns)], rows)
+
+        for r, values in enumerate(rows, start=start_row + 1):
+            cells = "".join(_xlsx_cell(f"{col}{r}", v) for col, v in zip(letters, values))
+            parts.append(f'<row r="{r}">{cells}</row>')
+
+    parts.append("</sheetData></worksheet>")
+    return "".join(parts).encode("utf-8")
+
+
+def write_xlsx_parallel(output, sheets: dict, max_workers=None):
+    """
+    ✅ {sheet 名: [(起始行, DataFrame, 是否写表头), ...]} → xlsx
+    output 可以是路径或 BytesIO 等文件对象
+    """
+    import zipfile
+
+    names = list(sheets)
+    sheet_xml = _parallel_map(_render_sheet_xml, [sheets[n] for n in names], max_workers=max_workers)
+
+    content_types = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(names) + 1)
+    )
+    workbook_sheets = "".join(
+        f'<sheet name="{_xml_escape(n)}" sheetId="{i}" r:id="rId{i}"/>' for i, n in enumerate(names, start=1)
+    )
+    workbook_rels = "".join(
+        f'<Relationship Id="rId{i}" Type="{XLSX_REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(names) + 1)
+    )
+    header = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        zf.writestr("[Content_Types].xml", header +
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f'{content_types}</Types>')
+        zf.writestr("_rels/.rels", header +
+            f'<Relationships xmlns="{XLSX_PKG_REL_NS}">'
+            f'<Relationship Id="rId1" Type="{XLSX_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>')
+        zf.writestr("xl/workbook.xml", header +
+            f'<workbook xmlns="{XLSX_NS}" xmlns:r="{XLSX_REL_NS}"><sheets>{workbook_sheets}</sheets></workbook>')
+        zf.writestr("xl/_rels/workbook.xml.rels", header +
+            f'<Relationships xmlns="{XLSX_PKG_REL_NS}">{workbook_rels}'
+            f'<Relationship Id="rId{len(names) + 1}" Type="{XLSX_REL_NS}/styles" Target="styles.xml"/>'
+            '</Relationships>')
+        zf.writestr("xl/styles.xml", header +
+            f'<styleSheet xmlns="{XLSX_NS}">'
+            '<numFmts count="2"><numFmt numFmtId="164" formatCode="YYYY-MM-DD HH:MM:SS"/>'
+            '<numFmt numFmtId="165" formatCode="YYYY-MM-DD"/></numFmts>'
+            '<fonts count="1"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts>'
+            '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+            '<fill><patternFill patternType="gray125"/></fill></fills>'
+            '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+            '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+            '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+            '</styleSheet>')
+        for i, xml in enumerate(sheet_xml, start=1):
+            zf.writestr(f"xl/worksheets/sheet{i}.xml", xml)
+
+
+def _self_template_sheets(template_cols_map: dict, sheet_map: dict, stats_dict: dict) -> dict:
+    """
+    ✅ 按模板对齐 + 排版：{sheet 名: [(起始行, DataFrame, 是否写表头), ...]}
+    openpyxl 写法与并行 XML 写法共用同一份排版
+    """
+    sheets = {}
+    for sheet_name, df_new in sheet_map.items():
+
+        print(f"\n✅ 正在处理 Sheet：{sheet_name}")
+
+        if df_new is None:
+            print(f"⚠️ 本次没有 {sheet_name} 的数据，已跳过")
+            continue
+
+        # ===== ✅ 1️⃣ 从 JSON 读取标准列结构 =====
+        template_cols = template_cols_map.get(sheet_name)
+
+        if not template_cols:
+            print(f"⚠️ JSON 中未找到该 Sheet 的列模板：{sheet_name}，已跳过")
+            continue
+
+        print("    🔹 模板列名（来自 JSON）：", template_cols)
+
+        # ===== ✅ 2️⃣ 按模板列构造对齐后的 DataFrame =====
+        aligned_data = {}
+        n_rows = len(df_new)
+
+        for col in template_cols:
+            if col in df_new.columns:
+                # 模板列名在新数据中也存在 → 直接用
+                aligned_data[col] = df_new[col].values
+
+            elif col == "类型" and "类别(粗分)" in df_new.columns:
+                # ✅ 特殊规则：模板需要【类型】，用中间 df 的【类别(粗分)】来填
+                print("    🔁 列【类型】使用中间数据列【类别(粗分)】进行填充")
+                aligned_data[col] = df_new["类别(粗分)"].values
+
+            else:
+                # 模板有，但新 df 没有，补空
+                aligned_data[col] = [pd.NA] * n_rows
+
+        df_aligned = pd.DataFrame(aligned_data, columns=template_cols)
+
+        print(f"    ✅ 列对齐完成，最终列数：{len(df_aligned.columns)}")
+        print(f"    ✅ 数据行数：{len(df_aligned)}")
+
+        # ===== ✅ 3️⃣ 主数据 =====
+        blocks = [(0, df_aligned, True)]
+
+        start_row = len(df_aligned) + 3  # 空两行再写统计
+
+        # ===== ✅ 4️⃣ 追加统计表（标题一行，空一行，再写表）=====
+        stat_pack = stats_dict.get(sheet_name, {})
+
+        for title, stat_df in stat_pack.items():
+            if stat_df is None or stat_df.empty:
+                continue
+
+            blocks.append((start_row, pd.DataFrame([[title]]), False))
+            blocks.append((start_row + 2, stat_df, True))
+
+            start_row += len(stat_df) + 4
+
+        sheets[sheet_name] = blocks
+
+    return sheets
+
+
 def align_and_export_to_self_template_by_json(
     template_json_path: str,         # ✅ 你保存的 template_columns.json
     output_excel_path: str,          # 新导出的结果 Excel
@@ -1441,7 +3966,8 @@ def align_and_export_to_self_template_by_json(
     df_fda: pd.DataFrame,
     df_ind: pd.DataFrame,
     df_nda: pd.DataFrame,
-    stats_dict: dict                 # 每类对应的统计结果
+    stats_dict: dict,                # 每类对应的统计结果
+    parallel: bool = None            # None → 读取 rules_config.json 的 export.parallel_sheets
 ):
     """
     ✅ 功能（JSON 驱动最终版）：
@@ -1452,11 +3978,17 @@ def align_and_export_to_self_template_by_json(
     ✅ 特别规则：
        - 如果模板中有列【类型】，且中间 df 中有【类别(粗分)】列，
          则自动用【类别(粗分)】填充【类型】
+    ✅ parallel=True：各 Sheet 在子进程中并行生成 XML，再一次性打包（见 write_xlsx_parallel）
     """
 
-    # ===== ✅ 0️⃣ 读取 JSON 模板列配置 =====
-    with open(template_json_path, "r", encoding="utf-8") as f:
-        template_cols_map = json.load(f)
+    # ===== ✅ 0️⃣ 读取 JSON 模板列配置（也可以直接传入 {Sheet: [列]} dict）=====
+    if isinstance(template_json_path, dict):
+        template_cols_map = template_json_path
+    else:
+        template_cols_map = load_template_columns(template_json_path)
+
+    if parallel is None:
+        parallel = bool(load_rules_config().get("export", {}).get("parallel_sheets", False))
 
     sheet_map = {
         "NMPA approved drugs": df_nmpa,
@@ -1465,87 +3997,331 @@ def align_and_export_to_self_template_by_json(
         "China NDA": df_nda,
     }
 
-    # ✅ 确保输出目录存在
-    save_dir = os.path.dirname(output_excel_path)
-    if save_dir:
-        os.makedirs(save_dir, exist_ok=True)
+    # ✅ 确保输出目录存在（output_excel_path 也可以是 BytesIO 等文件对象）
+    if isinstance(output_excel_path, (str, os.PathLike)):
+        save_dir = os.path.dirname(output_excel_path)
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+
+    sheets = _self_template_sheets(template_cols_map, sheet_map, stats_dict)
+
+    if parallel:
+        print(f"\n⚡ 并行生成 {len(sheets)} 个 Sheet 的 XML 并打包...")
+        write_xlsx_parallel(output_excel_path, sheets)
+    else:
+        with pd.ExcelWriter(output_excel_path, engine="openpyxl") as writer:
+            for sheet_name, blocks in sheets.items():
+                for start_row, block, header in blocks:
+                    block.to_excel(
+                        writer,
+                        sheet_name=sheet_name,
+                        startrow=start_row,
+                        index=False,
+                        header=header
+                    )
+                print(f"    ✅ {sheet_name} 写入完成")
+
+    print("\n===============================")
+    print("✅ 已完全按【JSON 模板结构】导出新版本")
+    print(f"📁 输出文件：{output_excel_path}")
+    if not isinstance(template_json_path, dict):
+        print(f"📌 模板来源：{template_json_path}")
+    print("===============================\n")
+
+
+# ===============================
+# ✅ 纯内存 API（无目录约定、无强制落盘）
+# ===============================
+
+def run_source_pipeline(source: str, input_file, output_file: str = None, year: int = None,
+                        quarter: str = None, **options):
+    """
+    ✅ 按来源分派到对应流水线（IND / NDA → run_ind_nda_pipeline，FDA，NMPA 需要 year / quarter）
+    options 原样传给流水线（dedup_audit / near_dedup_enabled / column_projection 等）
+    """
+    source = source.upper()
 
-    with pd.ExcelWriter(output_excel_path, engine="openpyxl") as writer:
-        for sheet_name, df_new in sheet_map.items():
+    if source in ["IND", "NDA"]:
+        return run_ind_nda_pipeline(input_file=input_file, output_file=output_file, source=source, **options)
+    if source == "FDA":
+        return run_fda_pipeline(input_file=input_file, output_file=output_file, **options)
+    if source == "NMPA":
+        if year is None or quarter is None:
+            raise ValueError("❌ NMPA 流水线需要 year 和 quarter")
+        return run_nmpa_quarter_pipeline(
+            input_file=input_file, output_file=output_file, year=year, quarter=quarter, **options
+        )
 
-            print(f"\n✅ 正在处理 Sheet：{sheet_name}")
+    raise ValueError(f"❌ 未知来源：{source}")
 
-            # ===== ✅ 1️⃣ 从 JSON 读取标准列结构 =====
-            template_cols = template_cols_map.get(sheet_name)
 
-            if not template_cols:
-                print(f"⚠️ JSON 中未找到该 Sheet 的列模板：{sheet_name}，已跳过")
+def run_all_in_memory(
+    inputs,
+    year: int,
+    quarter: str,
+    rules: dict = None,
+    template: dict = None,
+    serialize: bool = False,
+    column_projection: bool = None,
+    near_dedup_enabled: bool = None,
+    progress=None
+):
+    """
+    ✅ 纯内存版 run_all：
+    - inputs：{来源: bytes / 文件对象 / 路径（或它们的列表）}，
+              或不分来源的列表（按表头自动识别，同 match_regulatory_files）
+    - rules / template：内存中的规则 / 模板 dict（不传则读取程序目录下的 json）
+    - 不写任何中间文件；去重审计表、近似重复报告这类“只落盘”的产物不生成
+    - serialize=True 时额外返回 BytesIO：
+        outputs["final"]    → 最终自存模板（同 align_and_export_to_self_template_by_json）
+        outputs[来源]       → 各来源结果文件（分类明细 + 所有统计汇总）
+    - progress(来源, 状态)：每个来源开始 / 结束时回调，状态 = "running" / "done" / "skipped"
+    返回 {"results", "stats_dict", "pipeline_results", "outputs"}
+    """
+    with config_overrides(rules=rules, template=template):
+        file_map = match_regulatory_inputs(inputs)
+
+        results = {}
+        stats_dict = {}
+        pipeline_results = {}
+
+        for source in ["IND", "NDA", "FDA", "NMPA"]:
+            if not file_map.get(source):
+                print(f"⚠️ 未提供 {source} 文件，已跳过")
+                if progress is not None:
+                    progress(source, "skipped")
                 continue
 
-            print("    🔹 模板列名（来自 JSON）：", template_cols)
+            if progress is not None:
+                progress(source, "running")
+
+            res = run_source_pipeline(
+                source, file_map[source], None, year, quarter,
+                column_projection=column_projection,
+                near_dedup_enabled=near_dedup_enabled
+            )
+
+            if progress is not None:
+                progress(source, "done")
+
+            results[source] = res["df"]
+            pipeline_results[source] = res
+            stats_dict[SOURCE_TEMPLATE_SHEETS[source]] = stat_blocks(
+                res["stat_tables"], res["stat_specs"], title_field="template_title"
+            )
 
-            # ===== ✅ 2️⃣ 按模板列构造对齐后的 DataFrame =====
-            aligned_data = {}
-            n_rows = len(df_new)
+        outputs = {}
+        if serialize:
+            outputs["final"] = io.BytesIO()
+            align_and_export_to_self_template_by_json(
+                template_json_path=load_template_columns(),
+                output_excel_path=outputs["final"],
+                df_nmpa=results.get("NMPA"),
+                df_fda=results.get("FDA"),
+                df_ind=results.get("IND"),
+                df_nda=results.get("NDA"),
+                stats_dict=stats_dict
+            )
+
+            for source, res in pipeline_results.items():
+                outputs[source] = io.BytesIO()
+                export_source_workbook(res["df"], stat_blocks(res["stat_tables"], res["stat_specs"]), outputs[source])
 
-            for col in template_cols:
-                if col in df_new.columns:
-                    # 模板列名在新数据中也存在 → 直接用
-                    aligned_data[col] = df_new[col].values
+            for buf in outputs.values():
+                buf.seek(0)
+
+    return {
+        "results": results,
+        "stats_dict": stats_dict,
+        "pipeline_results": pipeline_results,
+        "outputs": outputs
+    }
 
-                elif col == "类型" and "类别(粗分)" in df_new.columns:
-                    # ✅ 特殊规则：模板需要【类型】，用中间 df 的【类别(粗分)】来填
-                    print("    🔁 列【类型】使用中间数据列【类别(粗分)】进行填充")
-                    aligned_data[col] = df_new["类别(粗分)"].values
 
-                else:
-                    # 模板有，但新 df 没有，补空
-                    aligned_data[col] = [pd.NA] * n_rows
+def export_results_zip(pipeline_results: dict, year: int, quarter: str) -> bytes:
+    """
+    ✅ 把内存中的各来源结果打包成 zip（结构与 run_all 的 {quarter}_intermediate 目录一致）：
+        {quarter}_{source}_结果.xlsx + {year}_{quarter}_{source}_统计计数.json
+    """
+    import zipfile
 
-            df_aligned = pd.DataFrame(aligned_data, columns=template_cols)
+    folder = f"{quarter}_intermediate"
+    buf = io.BytesIO()
 
-            print(f"    ✅ 列对齐完成，最终列数：{len(df_aligned.columns)}")
-            print(f"    ✅ 数据行数：{len(df_aligned)}")
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for source, res in pipeline_results.items():
+            workbook = io.BytesIO()
+            export_source_workbook(res["df"], stat_blocks(res["stat_tables"], res["stat_specs"]), workbook)
+            zf.writestr(f"{folder}/{quarter}_{source}_结果.xlsx", workbook.getvalue())
 
-            # ===== ✅ 3️⃣ 写入主数据 =====
-            df_aligned.to_excel(
-                writer,
-                sheet_name=sheet_name,
-                index=False,
-                startrow=0
+            payload = _stat_counts_payload(res["stat_counts"], res["stat_specs"], source, year, quarter)
+            zf.writestr(
+                f"{folder}/{year}_{quarter}_{source}{STAT_COUNTS_SUFFIX}",
+                json.dumps(payload, ensure_ascii=False)
             )
 
-            start_row = len(df_aligned) + 3  # 空两行再写统计
+    return buf.getvalue()
 
-            # ===== ✅ 4️⃣ 追加统计表 =====
-            stat_pack = stats_dict.get(sheet_name, {})
 
-            for title, stat_df in stat_pack.items():
-                if stat_df is None or stat_df.empty:
-                    continue
+@lru_cache(maxsize=None)
+def code_version() -> str:
+    """
+    ✅ 当前处理代码的版本指纹（缓存键 / 检查点用）：
+    - 源码运行 → utils.py 内容的 sha1
+    - 打包运行 → 可执行文件的大小 + 修改时间
+    - 只在首次调用时计算：常驻进程（--watch / 服务）运行期间改了 utils.py，
+      记录的仍是已加载代码的版本，不会把旧代码算出的结果标成新版本
+    """
+    if getattr(sys, "frozen", False):
+        st = os.stat(sys.executable)
+        return f"exe-{st.st_size}-{st.st_mtime_ns}"
 
-                title_df = pd.DataFrame([[title]])
-                title_df.to_excel(
-                    writer,
-                    sheet_name=sheet_name,
-                    startrow=start_row,
-                    index=False,
-                    header=False
-                )
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
 
-                stat_df.to_excel(
-                    writer,
-                    sheet_name=sheet_name,
-                    startrow=start_row + 2,
-                    index=False
-                )
 
-                start_row += len(stat_df) + 4
+def config_hashes():
+    """✅ (规则哈希, 模板哈希)：rules_config.json / template_columns.json 变化时缓存自动失效"""
+    template = json.dumps(load_template_columns(), ensure_ascii=False, sort_keys=True)
+    return _rules_hash(), hashlib.sha1(template.encode("utf-8")).hexdigest()
 
-            print(f"    ✅ {sheet_name} 写入完成")
 
-    print("\n===============================")
-    print("✅ 已完全按【JSON 模板结构】导出新版本")
-    print(f"📁 输出文件：{output_excel_path}")
-    print(f"📌 模板来源：{template_json_path}")
-    print("===============================\n")
\ No newline at end of file
+# ===============================
+# ✅ 抽样预览（配置：rules_config.json → preview.sample_rows）
+# ===============================
+# 只读每个 (文件, Sheet) 的前若干行，跑完整的 去重 → 分类 → 统计 链路，几秒内给出：
+#   投影计数 = 样本计数 × (总行数 / 样本行数)、未匹配的分类组合、列覆盖率
+# ⚠️ 取的是前 N 行而不是随机行：数据按日期排序时投影会偏向靠前的部分，
+#    预览用于尽早发现列映射 / 分类规则问题，正式数字以完整运行为准
+
+def _projected_counts(counts: dict, factor: float):
+    """完整计数按比例放大（四舍五入为整数；crosstab 同样适用）"""
+    if factor == 1:
+        return counts
+    return {
+        key: None if c is None else (c * factor).round().astype("int64")
+        for key, c in counts.items()
+    }
+
+
+def find_unmatched_categories(df, df_map=None):
+    """
+    ✅ 分类映射（classification_mapping）中不存在的 (药品类别一, 药品类别二) 组合
+    即 step2_add_class_and_save 会归为 Others 的记录，返回 [药品类别一, 药品类别二, 行数]
+    """
+    df_map = df_map if df_map is not None else build_classify_mapping_from_json()
+    keys = ["药品类别一", "药品类别二"]
+
+    pairs = df[keys].value_counts(dropna=False, sort=True).rename("行数").reset_index()
+    merged = pairs.merge(df_map[keys].drop_duplicates(), on=keys, how="left", indicator=True)
+
+    return merged.loc[merged["_merge"] == "left_only", keys + ["行数"]].reset_index(drop=True)
+
+
+def column_coverage(df, source: str):
+    """
+    ✅ 列覆盖率：该来源用得到的列（见 plan_source_columns）是否存在、非空比例
+    返回 [列, 是否存在, 非空比例(%)]，缺失的列排在最前
+    """
+    rows = []
+    for col in plan_source_columns(source):
+        if col in PROVENANCE_COLUMNS:
+            continue
+        present = col in df.columns
+        filled = float(df[col].notna().mean()) * 100 if present and len(df) else 0.0
+        rows.append([col, present, round(filled, 1)])
+
+    table = pd.DataFrame(rows, columns=["列", "是否存在", "非空比例(%)"])
+    return table.sort_values("是否存在", kind="stable").reset_index(drop=True)
+
+
+def preview_source(source: str, input_file, year: int = None, quarter: str = None,
+                   sample_rows: int = None, **options):
+    """
+    ✅ 单个来源的抽样预览（不写任何文件）
+    options 原样传给流水线（near_dedup_enabled / column_projection 等）
+    返回 {source, sampled_rows, total_rows, factor, seconds, df, stat_specs,
+          stat_counts（已投影）, stat_tables（已投影）, unmatched, coverage}
+    """
+    if sample_rows is None:
+        sample_rows = load_rules_config().get("preview", {}).get("sample_rows", 5000)
+
+    t0 = time.time()
+    with sample_reads(sample_rows) as sample:
+        res = run_source_pipeline(source, input_file, None, year, quarter, **options)
+
+    sampled = sum(r["sampled"] for r in sample["reads"])
+    totals = [r["total"] for r in sample["reads"]]
+    total = None if None in totals else sum(totals)
+    factor = total / sampled if total and sampled else 1.0
+
+    counts = _projected_counts(res["stat_counts"], factor)
+
+    return {
+        "source": source,
+        "sampled_rows": sampled,
+        "total_rows": total,
+        "factor": factor,
+        "seconds": round(time.time() - t0, 2),
+        "df": res["df"],
+        "stat_specs": res["stat_specs"],
+        "stat_counts": counts,
+        "stat_tables": finalize_statistics(counts, res["stat_specs"], columns=res["df"].columns),
+        "unmatched": find_unmatched_categories(res["df"]),
+        "coverage": column_coverage(res["df"], source)
+    }
+
+
+def preview_inputs(inputs, year: int, quarter: str, sample_rows: int = None,
+                   rules: dict = None, template: dict = None, **options):
+    """
+    ✅ 所有来源的抽样预览：
+    - inputs 同 match_regulatory_inputs（上传文件列表 / {来源: 文件}）
+    - stats_dict 结构与 run_all 相同（按模板 Sheet 分组），数字为投影值
+    返回 {"previews": {来源: preview_source 结果}, "stats_dict": {...}}
+    """
+    with config_overrides(rules=rules, template=template):
+        file_map = match_regulatory_inputs(inputs)
+
+        previews = {}
+        stats_dict = {}
+        for source in ["IND", "NDA", "FDA", "NMPA"]:
+            if not file_map.get(source):
+                continue
+
+            p = preview_source(source, file_map[source], year, quarter, sample_rows, **options)
+            previews[source] = p
+            stats_dict[SOURCE_TEMPLATE_SHEETS[source]] = stat_blocks(
+                p["stat_tables"], p["stat_specs"], title_field="template_title"
+            )
+
+        print_preview_report(previews)
+
+    return {"previews": previews, "stats_dict": stats_dict}
+
+
+def print_preview_report(previews: dict):
+    """✅ 打印抽样预览摘要：样本 / 总行数、未匹配分类、缺失列"""
+    print("\n==============================")
+    print("🔎 抽样预览结果（统计数字为按比例投影的估计值）")
+    print("==============================")
+
+    for source, p in previews.items():
+        total = "未知" if p["total_rows"] is None else p["total_rows"]
+        print(f"\n📌 {source}：样本 {p['sampled_rows']} 行 / 总计 {total} 行"
+              f"（×{p['factor']:.1f}），用时 {p['seconds']} 秒")
+
+        if len(p["df"]) == 0:
+            print("⚠️ 样本经过筛选 / 去重后为空：投影结果不可信，请检查日期列或放大 sample_rows")
+
+        if p["unmatched"].empty:
+            print("✅ 样本中所有分类组合都能匹配")
+        else:
+            print(f"⚠️ 样本中有 {len(p['unmatched'])} 个分类组合未匹配（将归为 Others）：")
+            display(p["unmatched"])
+
+        missing = p["coverage"].loc[~p["coverage"]["是否存在"], "列"].tolist()
+        if missing:
+            print(f"⚠️ 缺失 {len(missing)} 列：{'、'.join(missing)}")
+        else:
+            print("✅ 用得到的列全部存在")